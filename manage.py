@@ -1,3 +1,7 @@
+import sys
+
+import click
+from flask import current_app
 from flask.cli import FlaskGroup
 
 from project import create_app, db
@@ -114,5 +118,196 @@ def seed_db():
     print("Database seeded!")
 
 
+@cli.command()
+@click.option("--users", default=1000, help="Passengers.")
+@click.option("--drivers", default=100, help="Drivers, with a vehicle and licence each.")
+@click.option("--churches", default=20)
+@click.option("--trips", default=10000)
+@click.option("--ratings", default=2000, help="Ratings of completed rides.")
+@click.option("--batch-size", default=10000, help="Rows per executemany and commit.")
+@click.option("--seed", default=0, help="Random seed, the same seed loads the same data.")
+def seed_load(users, drivers, churches, trips, ratings, batch_size, seed):
+    """Loads a large synthetic dataset for load tests."""
+    import time
+    from project.perf.dataset import PASSWORD, seed_dataset
+
+    if min(users, drivers, churches) < 1:
+        print("At least one user, driver and church are needed")
+        sys.exit(1)
+
+    start = time.perf_counter()
+
+    def progress(counts):
+        print("{:>7.1f}s {}".format(time.perf_counter() - start, ", ".join(
+            "{} {}".format(count, table) for table, count in counts.items())))
+
+    counts, accounts = seed_dataset(
+        users=users, drivers=drivers, churches=churches, trips=trips,
+        ratings=ratings, batch_size=batch_size, rng_seed=seed, progress=progress)
+
+    print("Loaded {} rows in {:.1f}s".format(
+        sum(counts.values()), time.perf_counter() - start))
+    print("Sign in as {} (passenger) or {} (driver), password {}".format(
+        accounts["passenger"], accounts["driver"], PASSWORD))
+
+
+@cli.command()
+def check_query_plans():
+    """Fails if a hot query's plan falls back to a full table scan."""
+    from project.perf.query_plans import check_query_plans
+
+    if not current_app.config.get("TESTING"):
+        print("Refusing to recreate a non testing database, "
+              "set APP_SETTINGS=project.config.TestingConfig")
+        sys.exit(1)
+
+    failed = 0
+    for name, statement, plan, scans in check_query_plans(current_app):
+        print("{} {}".format("FULL SCAN" if scans else "ok", name))
+        if scans:
+            print("    {}".format(" ".join(statement.split())))
+        for line in plan:
+            print("    {}".format(line))
+
+        failed += 1 if scans else 0
+
+    if failed:
+        print("{} hot query(s) regressed to a full scan".format(failed))
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument("user_id", type=int)
+def purge_account(user_id):
+    """Deletes an account and its dependent rows in chunks."""
+    from project.services import purge_account
+
+    purge_account(user_id, current_app.config.get("PURGE_CHUNK_SIZE"))
+    print("Account {} purged".format(user_id))
+
+
+@cli.command()
+def email_worker():
+    """Sends queued emails until interrupted."""
+    from project.services import email_outbox
+
+    print("Draining email outbox...")
+    email_outbox.run()
+
+
+@cli.command()
+@click.option("--sizes", default="1,4,8", help="Upload sizes in MB.")
+def bench_upload(sizes):
+    """Reports peak memory per image upload, streaming vs the old path."""
+    from project.perf.upload_bench import run_upload_bench
+
+    if current_app.config.get("TESTING"):
+        db.create_all()
+
+    print("{:>8} {:>14} {:>14}".format("size MB", "streaming KB", "legacy KB"))
+    sizes = [float(size) for size in sizes.split(",")]
+    for size_mb, streaming, legacy in run_upload_bench(current_app, sizes):
+        print("{:>8} {:>14.0f} {:>14.0f}".format(
+            size_mb, streaming / 1024, legacy / 1024))
+
+
+@cli.command()
+@click.option("--number", default=100000, help="Calls per timing.")
+def bench_validators(number):
+    """Times payload validation, compiled schemas vs the old validators."""
+    from project.perf.validator_bench import run_validator_bench
+
+    print("{:>8} {:>12} {:>12}".format("payload", "legacy us", "schema us"))
+    for name, legacy, compiled in run_validator_bench(number):
+        print("{:>8} {:>12.2f} {:>12.2f}".format(name, legacy, compiled))
+
+
+@cli.command()
+@click.option("--scales", default="1000,10000,100000", help="Trips per dataset.")
+@click.option("--repeat", default=5, help="Timed calls per endpoint.")
+@click.option("--endpoints", default="", help="Comma separated endpoint names, all by default.")
+@click.option("--output", default="benchmarks/endpoints.json", help="Results file.")
+@click.option("--baseline", default=None, help="Results of an earlier run to compare with.")
+@click.option("--tolerance", default=0.25, help="Allowed median latency growth.")
+def bench_endpoints(scales, repeat, endpoints, output, baseline, tolerance):
+    """Benchmarks the hot endpoints on seeded datasets of several sizes."""
+    import os
+    from project.perf import endpoint_bench
+
+    if not current_app.config.get("TESTING"):
+        print("Refusing to recreate a non testing database, "
+              "set APP_SETTINGS=project.config.TestingConfig")
+        sys.exit(1)
+
+    results = endpoint_bench.run_endpoint_bench(
+        current_app,
+        scales=[int(scale) for scale in scales.split(",")],
+        repeat=repeat,
+        endpoints=[name for name in endpoints.split(",") if name])
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    endpoint_bench.save(results, output)
+    print("Results written to {}".format(output))
+
+    if baseline:
+        regressions = endpoint_bench.compare(
+            results, endpoint_bench.load(baseline), tolerance)
+
+        for scale, name, measure, before, after in regressions:
+            print("REGRESSION {:>8} {:<14} {} {} -> {}".format(
+                scale, name, measure, before, after))
+
+        if regressions:
+            sys.exit(1)
+
+        print("No regression against {}".format(baseline))
+
+
+@cli.command()
+def check_query_budgets():
+    """Fails when a route runs more statements than its query budget."""
+    from project.perf import query_budgets
+
+    if not current_app.config.get("TESTING"):
+        print("Refusing to recreate a non testing database, "
+              "set APP_SETTINGS=project.config.TestingConfig")
+        sys.exit(1)
+
+    counts, failures = query_budgets.check_query_budgets(current_app)
+
+    for endpoint, route in sorted(counts.items()):
+        print("{:<40} budget {:>4}  statements {}".format(
+            endpoint, str(route["budget"]), route["statements"]))
+
+    for failure in failures:
+        print("FAILED " + failure)
+
+    if failures:
+        sys.exit(1)
+
+    print("Every route within its query budget")
+
+
+@cli.command()
+def check_replica_routing():
+    """Fails when reads reach the wrong database with a lagging replica."""
+    from project.perf.replica_routing import check_replica_routing
+
+    binds = current_app.config.get("SQLALCHEMY_BINDS") or {}
+    if not current_app.config.get("TESTING") or "replica" not in binds:
+        print("Needs TestingConfig with two throwaway databases, e.g. "
+              "DATABASE_TEST_URL=sqlite:////tmp/primary.db "
+              "DATABASE_TEST_REPLICA_URL=sqlite:////tmp/replica.db")
+        sys.exit(1)
+
+    failures = check_replica_routing(current_app)
+
+    if failures:
+        print("{} replica routing check(s) failed".format(len(failures)))
+        sys.exit(1)
+
+    print("Replica routing behaves")
+
+
 if __name__ == "__main__":
     cli()
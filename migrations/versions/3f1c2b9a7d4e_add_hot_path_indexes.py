@@ -0,0 +1,58 @@
+"""add hot path indexes
+
+Databases created with `manage.py create-db` before this revision have no
+indexes beyond primary keys and the user uniques; run `flask db upgrade`
+on them. Databases created afterwards already carry these indexes, so
+mark them with `flask db stamp head` instead.
+
+Revision ID: 3f1c2b9a7d4e
+Revises:
+Create Date: 2026-10-19 09:12:41.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2b9a7d4e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_trip_driver_id_date_time', 'trip',
+                    ['driver_id', 'date', 'time'], unique=False)
+    op.create_index('ix_trip_status_date_time', 'trip',
+                    ['status', 'date', 'time'], unique=False)
+    op.create_index('ix_trip_passenger_trip_id_passenger_id_request_status',
+                    'trip_passenger',
+                    ['trip_id', 'passenger_id', 'request_status'], unique=False)
+    op.create_index('ix_trip_passenger_passenger_id_request_status',
+                    'trip_passenger',
+                    ['passenger_id', 'request_status'], unique=False)
+    op.create_index('ix_rating_driver_id', 'rating',
+                    ['driver_id'], unique=False)
+    op.create_index('ix_rating_trip_id_passenger_id', 'rating',
+                    ['trip_id', 'passenger_id'], unique=False)
+    op.create_index('ix_vehicle_user_id', 'vehicle',
+                    ['user_id'], unique=False)
+    op.create_index('ix_licence_user_id', 'licence',
+                    ['user_id'], unique=False)
+    op.create_index('ix_location_place', 'location',
+                    ['place'], unique=False, mysql_length=255)
+
+
+def downgrade():
+    op.drop_index('ix_location_place', table_name='location')
+    op.drop_index('ix_licence_user_id', table_name='licence')
+    op.drop_index('ix_vehicle_user_id', table_name='vehicle')
+    op.drop_index('ix_rating_trip_id_passenger_id', table_name='rating')
+    op.drop_index('ix_rating_driver_id', table_name='rating')
+    op.drop_index('ix_trip_passenger_passenger_id_request_status',
+                  table_name='trip_passenger')
+    op.drop_index('ix_trip_passenger_trip_id_passenger_id_request_status',
+                  table_name='trip_passenger')
+    op.drop_index('ix_trip_status_date_time', table_name='trip')
+    op.drop_index('ix_trip_driver_id_date_time', table_name='trip')
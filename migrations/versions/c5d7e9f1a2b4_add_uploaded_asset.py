@@ -0,0 +1,34 @@
+"""add uploaded asset
+
+Revision ID: c5d7e9f1a2b4
+Revises: 8b2e4f6a1c93
+Create Date: 2026-10-19 14:21:48.530172
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d7e9f1a2b4'
+down_revision = '8b2e4f6a1c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('uploaded_asset',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('variant', sa.String(length=32), nullable=False),
+    sa.Column('url', sa.String(length=255), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('digest', 'variant',
+                        name='uq_uploaded_asset_digest_variant')
+    )
+
+
+def downgrade():
+    op.drop_table('uploaded_asset')
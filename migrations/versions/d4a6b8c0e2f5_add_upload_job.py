@@ -0,0 +1,38 @@
+"""add upload job
+
+Revision ID: d4a6b8c0e2f5
+Revises: c5d7e9f1a2b4
+Create Date: 2026-10-19 15:08:33.917406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a6b8c0e2f5'
+down_revision = 'c5d7e9f1a2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upload_job',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('status', sa.Enum('pending', 'running', 'done', 'failed', name='jobstatus'), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('content_type', sa.String(length=128), nullable=True),
+    sa.Column('keep_original', sa.Boolean(), nullable=False),
+    sa.Column('path', sa.String(length=255), nullable=True),
+    sa.Column('image_url', sa.String(length=255), nullable=True),
+    sa.Column('original_url', sa.String(length=255), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('upload_job')
+    sa.Enum(name='jobstatus').drop(op.get_bind(), checkfirst=True)
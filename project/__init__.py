@@ -6,15 +6,15 @@ from flask import Flask
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
 from flask_debugtoolbar import DebugToolbarExtension
 
 from project.exceptions import handle_exception
+from project.routing import RoutingSQLAlchemy
 # get credentials from .env file
 load_dotenv()
 
 # instantiate the extensions
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 toolbar = DebugToolbarExtension()
 migrate = Migrate()
 bcrypt = Bcrypt()
@@ -28,16 +28,40 @@ def create_app(script_info=None):
     # enable CORS
     CORS(app)
 
+    # spool uploads in bounded memory
+    from project.api.utils import SpooledRequest
+    app.request_class = SpooledRequest
+
     # set config
     app_settings = os.getenv('APP_SETTINGS')
     app.config.from_object(app_settings)
 
+    # request metrics first, so they time the other request hooks too
+    from project.services import request_metrics, pool_monitor
+    request_metrics.init_app(app)
+    # time pool checkouts, before the engine is created
+    pool_monitor.init_app(app)
+
     # set up extensions
     db.init_app(app)
     toolbar.init_app(app)
     migrate.init_app(app, db)
     bcrypt.init_app(app)
 
+    from project.services import (
+        email_outbox, otp_service, image_normalizer, upload_service,
+        deliverability_checker, query_inspector, slow_query_log,
+        request_profiler, memory_tracer)
+    email_outbox.init_app(app)
+    otp_service.init_app(app)
+    image_normalizer.init_app(app)
+    upload_service.init_app(app)
+    deliverability_checker.init_app(app)
+    query_inspector.init_app(app)
+    slow_query_log.init_app(app)
+    request_profiler.init_app(app)
+    memory_tracer.init_app(app)
+
     @app.after_request
     def after_request(response):
         response.headers.add(
@@ -63,6 +87,10 @@ def create_app(script_info=None):
     app.register_blueprint(trip_blueprint)
     from project.api import ride_blueprint
     app.register_blueprint(ride_blueprint)
+    from project.api import metrics_blueprint
+    app.register_blueprint(metrics_blueprint)
+    from project.api import profiling_blueprint
+    app.register_blueprint(profiling_blueprint)
 
     @app.errorhandler(Exception)
     def manage_exception(ex):
@@ -6,3 +6,5 @@ from .church import church_blueprint
 from .utils import upload_file, secure_file
 from .trip import trip_blueprint
 from .ride import ride_blueprint
+from .metrics import metrics_blueprint
+from .profiling import profiling_blueprint
@@ -2,24 +2,50 @@ import logging
 from flask import jsonify, request, Blueprint
 
 from project import db, bcrypt
+from project.services import query_budget
 from project.api.authentications import authenticate
-from project.api.validators import email_validator, field_type_validator, required_validator
+from project.api.validators import (
+    email_validator,
+    Schema,
+    Field,
+    VEHICLE_SCHEMA,
+    LICENCE_SCHEMA
+)
 from project.models import Role, Gender, User, BlacklistToken, Vehicle, Licence
 
 auth_blueprint = Blueprint('auth', __name__, template_folder='templates')
 logger = logging.getLogger(__name__)
 
+LOGIN_SCHEMA = Schema({
+    "mobile_no": Field(str, required=True),
+    "password": Field(str, required=True)
+})
+
+REGISTER_SCHEMA = Schema({
+    "fullname": Field(str, required=True), "email": Field(str, required=True),
+    "mobile_no": Field(str, required=True), "password": Field(str, required=True),
+    "role": Field(str, required=True), "dob": Field(str, required=True),
+    "gender": Field(str, required=True), "profile_pic": Field(str),
+    "address": Field(str), "vehicle": Field(dict, schema=VEHICLE_SCHEMA),
+    "licence": Field(dict, schema=LICENCE_SCHEMA)
+})
+
+# drivers must also give their address
+DRIVER_REGISTER_SCHEMA = REGISTER_SCHEMA.extend(address=Field(str, required=True))
+
 
 @auth_blueprint.route('/users/auth/access_token', methods=['GET'])
+@query_budget(3)
 @authenticate
 def get_access_token(user_id):
     """Get access token"""
+    response_object = {
+        'status': False,
+        'message': 'User does not exist',
+    }
+
     user = User.query.filter_by(id=int(user_id)).first()
     if not user:
-        response_object = {
-            'status': False,
-            'message': 'User does not exist',
-        }
         return jsonify(response_object), 200
 
     auth_token = user.encode_auth_token(user.id)
@@ -32,10 +58,11 @@ def get_access_token(user_id):
             "role": user.role.name,
         }
 
-        return jsonify(response_object), 200
+    return jsonify(response_object), 200
 
 
 @auth_blueprint.route('/users/auth/login', methods=['POST'])
+@query_budget(3)
 def login():
     """Login user"""
     post_data = request.get_json()
@@ -49,11 +76,7 @@ def login():
         return jsonify(response_object), 200
 
     try:
-        field_types = {"mobile_no": str, "password": str}
-        required_fields = list(field_types.keys())
-
-        post_data = field_type_validator(post_data, field_types)
-        required_validator(post_data, required_fields)
+        post_data = LOGIN_SCHEMA.validate(post_data)
 
         mobile_no = post_data.get('mobile_no')
         password = post_data.get('password')
@@ -96,6 +119,7 @@ def login():
 
 
 @auth_blueprint.route('/users/auth/logout', methods=['GET'])
+@query_budget(5)
 @authenticate
 def logout(user_id):
     """Logout user"""
@@ -129,6 +153,7 @@ def logout(user_id):
 
 
 @auth_blueprint.route('/users/auth/register', methods=['POST'])
+@query_budget(10)
 def register():
     post_data = request.get_json()
 
@@ -140,16 +165,10 @@ def register():
     if not post_data:
         return jsonify(response_object), 200
 
-    field_types = {
-        "fullname": str, "email": str, "mobile_no": str,
-        "password": str, "role": str, "dob": str,
-        "gender": str, "profile_pic": str, "address": str,
-        "vehicle": dict, "licence": dict
-    }
-
-    post_data = field_type_validator(post_data, field_types)
-    required_fields = list(field_types.keys())
-    required_fields.remove('profile_pic')
+    if str(post_data.get('role')).lower() == Role.driver.name:
+        post_data = DRIVER_REGISTER_SCHEMA.validate(post_data)
+    else:
+        post_data = REGISTER_SCHEMA.validate(post_data)
 
     # verify role
     role = str(post_data.get('role')).lower()
@@ -157,13 +176,6 @@ def register():
         response_object['message'] = 'Invalid role {}.'.format(role)
         return jsonify(response_object), 200
 
-    if Role[role] != Role.driver:
-        required_fields.remove('address')
-
-    required_fields.remove('vehicle')
-    required_fields.remove('licence')
-
-    required_validator(post_data, required_fields)
     email_validator(post_data["email"])
 
     # verify gender
@@ -209,16 +221,6 @@ def register():
             vehicle = post_data.get('vehicle')
             licence = post_data.get('licence')
 
-            field_types = {
-                "vehicle_no": str, "vehicle_image": str,
-                "vehicle_color": str, "vehicle_brand_name": str,
-                "vehicle_plate_image": str, "licence_no": str,
-                "licence_image_front": str, "licence_image_back": str
-            }
-
-            vehicle = field_type_validator(vehicle, field_types)
-            licence = field_type_validator(licence, field_types)
-
             if licence:
                 Licence(
                     user_id=new_user.id,
@@ -257,6 +259,7 @@ def register():
 
 
 @auth_blueprint.route('/users/auth/status', methods=['GET'])
+@query_budget(3)
 @authenticate
 def get_user_status(user_id):
     """Get user status"""
@@ -272,7 +275,7 @@ def get_user_status(user_id):
         response_object['message'] = 'User status.'
         response_object['data'] = {
             'active': user.active,
-            'role': user.role
+            'role': user.role.name
         }
 
     return jsonify(response_object), 200
@@ -2,6 +2,7 @@ from functools import wraps
 from flask import jsonify, request
 
 from project.models import User, BlacklistToken
+from project.routing import on_primary
 
 
 def authenticate(f):
@@ -17,7 +18,11 @@ def authenticate(f):
         try:
             auth_token = auth_header.split(" ")[1]
 
-            if BlacklistToken.check_blacklist(auth_token):
+            # a replica lagging behind would accept a logged out token
+            with on_primary():
+                blacklisted = BlacklistToken.check_blacklist(auth_token)
+
+            if blacklisted:
                 response_object["message"] = "Token blacklisted. Please log in again."
                 return jsonify(response_object), 401
 
@@ -29,7 +34,8 @@ def authenticate(f):
         if user_id:
             if is_superadmin(auth_header):
 
-                user = User.query.filter_by(id=user_id).first()
+                with on_primary():
+                    user = User.query.filter_by(id=user_id).first()
 
                 if user:
                     return f(user_id, *args, **kwargs)
@@ -39,7 +45,8 @@ def authenticate(f):
             response_object["message"] = resp
             return jsonify(response_object), 401
 
-        user = User.query.filter_by(id=resp).first()
+        with on_primary():
+            user = User.query.filter_by(id=resp).first()
 
         if not user or not user.active:
             return jsonify(response_object), 401
@@ -78,7 +85,8 @@ def is_superadmin(auth_header):
     if isinstance(resp, str):
         return False
 
-    user = User.query.filter_by(id=resp).first()
+    with on_primary():
+        user = User.query.filter_by(id=resp).first()
 
     if not user or not user.active:
         return False
@@ -8,15 +8,29 @@ from project import db
 
 from project.exceptions import APIError
 from project.models import Church, Location
+from project.services import Preloaded, query_budget
 from project.api.authentications import authenticate
-from project.api.validators import field_type_validator, required_validator
+from project.api.validators import Schema, Field, LOCATION_SCHEMA
 
 logger = logging.getLogger(__name__)
 
+CHURCH_SCHEMA = Schema({
+    "name": Field(str, required=True),
+    "opening_time": Field(str, required=True),
+    "closing_time": Field(str, required=True),
+    "contact_no": Field(str),
+    "address": Field(str, required=True),
+    "location": Field(dict, schema=LOCATION_SCHEMA),
+    "image_url": Field(str)
+})
+
+CHURCH_UPDATE_SCHEMA = CHURCH_SCHEMA.partial()
+
 church_blueprint = Blueprint('church', __name__, template_folder='templates')
 
 
 @church_blueprint.route('/church/ping', methods=['GET'])
+@query_budget(0)
 def ping_pong():
     return jsonify({
         'status': 'success',
@@ -25,20 +39,23 @@ def ping_pong():
 
 
 @church_blueprint.route('/church/list', methods=['GET'])
+@query_budget(4)
 @authenticate
 def get_churches(user_id):
     """Get all churches"""
     churches = Church.query.all()
+    preloaded = Preloaded.load(churches=churches)
     response_object = {
         'status': True,
         'data': {
-            'churches': [church.to_json() for church in churches]
+            'churches': [church.to_json(preloaded) for church in churches]
         }
     }
     return jsonify(response_object), 200
 
 
 @church_blueprint.route('/church/get/<int:church_id>', methods=['GET'])
+@query_budget(4)
 @authenticate
 def get_church(user_id, church_id):
     """Get a single church"""
@@ -60,6 +77,7 @@ def get_church(user_id, church_id):
 
 
 @church_blueprint.route('/church/create', methods=['POST'])
+@query_budget(10)
 @authenticate
 def create_church(user_id):
     """Create a new church"""
@@ -74,19 +92,7 @@ def create_church(user_id):
         return jsonify(response_object), 200
 
     try:
-        field_types = {
-            "name": str, "opening_time": str, "closing_time": str,
-            "contact_no": str, "address": str, "location": dict,
-            "image_url": str
-        }
-
-        required_fields = list(field_types.keys())
-        required_fields.remove('location')
-        required_fields.remove('contact_no')
-        required_fields.remove('image_url')
-
-        post_data = field_type_validator(post_data, field_types)
-        required_validator(post_data, required_fields)
+        post_data = CHURCH_SCHEMA.validate(post_data)
 
         name = post_data.get('name')
         opening_time = post_data.get('opening_time')
@@ -99,15 +105,6 @@ def create_church(user_id):
         location_id = None
 
         if location:
-            field_types = {
-                "latitude": float, "longitude": float, "place": str
-            }
-
-            required_fields = list(field_types.keys())
-
-            location = field_type_validator(location, field_types)
-            required_validator(location, required_fields)
-
             loc = Location.query.filter_by(
                 place=str(location.get('place')).strip()).first()
 
@@ -163,6 +160,7 @@ def create_church(user_id):
 
 
 @church_blueprint.route('/church/update/<int:church_id>', methods=['PATCH'])
+@query_budget(9)
 @authenticate
 def update_church(user_id, church_id):
     """Update a church"""
@@ -177,13 +175,7 @@ def update_church(user_id, church_id):
         return jsonify(response_object), 200
 
     try:
-        field_types = {
-            "name": str, "opening_time": str, "closing_time": str,
-            "contact_no": str, "address": str, "location": dict,
-            "image_url": str
-        }
-
-        post_data = field_type_validator(post_data, field_types)
+        post_data = CHURCH_UPDATE_SCHEMA.validate(post_data)
 
         name = post_data.get('name')
         opening_time = post_data.get('opening_time')
@@ -195,12 +187,6 @@ def update_church(user_id, church_id):
 
         location_id = None
         if location:
-            field_types = {
-                "latitude": float, "longitude": float, "place": str
-            }
-
-            location = field_type_validator(location, field_types)
-
             loc = Location.query.filter_by(
                 place=str(location.get('place')).strip()).first()
 
@@ -253,6 +239,7 @@ def update_church(user_id, church_id):
 
 
 @church_blueprint.route('/church/delete/<int:church_id>', methods=['DELETE'])
+@query_budget(7)
 @authenticate
 def delete_church(user_id, church_id):
     """Delete a church"""
@@ -14,15 +14,32 @@ from project.models import (
 )
 
 from project import db, bcrypt
+from project.services import Preloaded, remove_account, query_budget
 from project.api.authentications import authenticate
-from project.api.validators import email_validator, field_type_validator
+from project.api.validators import (
+    email_validator,
+    Schema,
+    Field,
+    LOCATION_SCHEMA,
+    VEHICLE_SCHEMA,
+    LICENCE_SCHEMA
+)
 
 
 driver_blueprint = Blueprint('driver', __name__, template_folder='templates')
 logger = logging.getLogger(__name__)
 
+DRIVER_INFO_SCHEMA = Schema({
+    "fullname": Field(str), "email": Field(str), "password": Field(str),
+    "mobile_no": Field(str), "profile_picture": Field(str), "dob": Field(str),
+    "gender": Field(str), "address": Field(str), "active": Field(bool)
+})
+
+LOCATION_UPDATE_SCHEMA = LOCATION_SCHEMA.partial()
+
 
 @driver_blueprint.route('/drivers/ping', methods=['GET'])
+@query_budget(0)
 def ping_pong():
     return jsonify({
         'status': True,
@@ -31,20 +48,23 @@ def ping_pong():
 
 
 @driver_blueprint.route('/drivers/list', methods=['GET'])
+@query_budget(2)
 def get_all_drivers():
     """Get all drivers"""
     drivers = User.query.filter_by(role=Role.driver).all()
+    preloaded = Preloaded.load(users=drivers)
     response_object = {
         'status': True,
         'message': '{} driver(s) found'.format(len(drivers)),
         'data': {
-            'drivers': [driver.to_json() for driver in drivers]
+            'drivers': [driver.to_json(preloaded) for driver in drivers]
         }
     }
     return jsonify(response_object), 200
 
 
 @driver_blueprint.route('/drivers/get/<int:driver_id>', methods=['GET'])
+@query_budget(4)
 def get_single_driver(driver_id):
     """Get single driver details"""
     response_object = {
@@ -79,6 +99,7 @@ def get_single_driver(driver_id):
 
 
 @driver_blueprint.route('/drivers/get', methods=['GET'])
+@query_budget(6)
 @authenticate
 def get_driver(driver_id):
     """Get single driver details"""
@@ -114,6 +135,7 @@ def get_driver(driver_id):
 
 
 @driver_blueprint.route('/drivers/update_info', methods=['PATCH'])
+@query_budget(8)
 @authenticate
 def update_driver_info(driver_id):
     """Update driver info"""
@@ -128,13 +150,7 @@ def update_driver_info(driver_id):
         if not driver:
             return jsonify(response_object), 200
 
-        field_types = {
-            "fullname": str, "email": str, "password": str,
-            "mobile_no": str, "profile_picture": str, "dob": str,
-            "gender": str, "address": str, "active": bool
-        }
-
-        post_data = field_type_validator(post_data, field_types)
+        post_data = DRIVER_INFO_SCHEMA.validate(post_data)
 
         if post_data.get("email"):
             email_validator(post_data["email"])
@@ -187,6 +203,7 @@ def update_driver_info(driver_id):
 
 
 @driver_blueprint.route('/drivers/update_vehicle', methods=['PATCH'])
+@query_budget(7)
 @authenticate
 def update_driver_vehicle(driver_id):
     """Update driver vehicle"""
@@ -201,12 +218,7 @@ def update_driver_vehicle(driver_id):
         if not driver:
             return jsonify(response_object), 200
 
-        field_types = {
-            "vehicle_no": str, "vehicle_image": str, "vehicle_color": str,
-            "vehicle_brand_name": str, "vehicle_plate_image": str
-        }
-
-        post_data = field_type_validator(post_data, field_types)
+        post_data = VEHICLE_SCHEMA.validate(post_data)
 
         vehicle = Vehicle.query.filter_by(user_id=driver.id).first()
         if not vehicle:
@@ -253,6 +265,7 @@ def update_driver_vehicle(driver_id):
 
 
 @driver_blueprint.route('/drivers/update_licence', methods=['PATCH'])
+@query_budget(7)
 @authenticate
 def update_driver_licence(driver_id):
     """Update driver licence"""
@@ -267,11 +280,7 @@ def update_driver_licence(driver_id):
         if not driver:
             return jsonify(response_object), 200
 
-        field_types = {
-            "licence_no": str, "licence_image_front": str, "licence_image_back": str
-        }
-
-        post_data = field_type_validator(post_data, field_types)
+        post_data = LICENCE_SCHEMA.validate(post_data)
 
         licence = Licence.query.filter_by(user_id=driver.id).first()
         if not licence:
@@ -312,6 +321,7 @@ def update_driver_licence(driver_id):
 
 
 @driver_blueprint.route('/drivers/update_location', methods=['PATCH'])
+@query_budget(10)
 @authenticate
 def update_driver_location(driver_id):
     """Update driver location"""
@@ -326,11 +336,7 @@ def update_driver_location(driver_id):
         if not driver:
             return jsonify(response_object), 200
 
-        field_types = {
-            "latitude": float, "longitude": float, "place": str
-        }
-
-        post_data = field_type_validator(post_data, field_types)
+        post_data = LOCATION_UPDATE_SCHEMA.validate(post_data)
 
         location = Location.query.filter_by(id=driver.location_id).first()
         if not location:
@@ -371,6 +377,7 @@ def update_driver_location(driver_id):
 
 
 @driver_blueprint.route('/drivers/delete', methods=['DELETE'])
+@query_budget(16)
 @authenticate
 def delete_driver(driver_id):
     """Delete driver"""
@@ -384,23 +391,12 @@ def delete_driver(driver_id):
         if not driver:
             return jsonify(response_object), 200
 
-        licence = Licence.query.filter_by(user_id=driver.id).first()
-        if licence:
-            licence.delete()
-
-        vehicle = Vehicle.query.filter_by(user_id=driver.id).first()
-        if vehicle:
-            vehicle.delete()
-
-        location = Location.query.filter_by(id=driver.location_id).first()
-
-        driver.delete()
-
-        if location:
-            location.delete()
+        if remove_account(driver):
+            response_object['message'] = "Driver's account deleted successfully"
+        else:
+            response_object['message'] = "Driver's account is scheduled for deletion"
 
         response_object['status'] = True
-        response_object['message'] = "Driver's account deleted successfully"
 
         return jsonify(response_object), 200
 
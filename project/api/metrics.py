@@ -0,0 +1,24 @@
+import hmac
+import logging
+
+from flask import Blueprint, jsonify, request, current_app
+
+from project.services import request_metrics, query_budget
+
+
+metrics_blueprint = Blueprint('metrics', __name__)
+logger = logging.getLogger(__name__)
+
+
+@metrics_blueprint.route('/metrics', methods=['GET'])
+@query_budget(0)
+def metrics():
+    """Prometheus scrape endpoint"""
+    token = current_app.config.get("METRICS_TOKEN")
+    if token and not hmac.compare_digest(
+            request.headers.get("Authorization", ""), "Bearer {}".format(token)):
+        return jsonify({'status': False, 'message': 'Provide a valid metrics token.'}), 401
+
+    return request_metrics.render(), 200, {
+        "Content-Type": "text/plain; version=0.0.4; charset=utf-8"
+    }
@@ -0,0 +1,163 @@
+import pstats
+import logging
+
+from flask import Blueprint, jsonify, request, send_file
+
+from project.exceptions import APIError
+from project.api.validators import Schema, Field
+from project.services import request_profiler, memory_tracer, query_budget
+from project.api.authentications import authenticate, is_superadmin
+
+
+profiling_blueprint = Blueprint('profiling', __name__)
+logger = logging.getLogger(__name__)
+
+SAMPLING_SCHEMA = Schema({"percent": Field(float, required=True)})
+
+TRACE_SCHEMA = Schema({"seconds": Field(int)})
+
+SORT_KEYS = sorted(key.value for key in pstats.SortKey)
+
+
+def admin_required():
+    return jsonify({
+        'status': False,
+        'message': 'Admin access required.'
+    }), 403
+
+
+@profiling_blueprint.route('/profiles', methods=['GET'])
+@query_budget(3)
+@authenticate
+def list_profiles(user_id):
+    """Stored request profiles, newest first"""
+    if not is_superadmin(request.headers.get("Authorization")):
+        return admin_required()
+
+    return jsonify({
+        'status': True,
+        'message': 'Stored profiles',
+        'data': {
+            'sample_percent': request_profiler.sample_percent,
+            'profiles': request_profiler.list()
+        }
+    }), 200
+
+
+@profiling_blueprint.route('/profiles/<name>', methods=['GET'])
+@query_budget(3)
+@authenticate
+def get_profile(user_id, name):
+    """Report of a stored profile, or the pstats file itself with ?raw=1"""
+    if not is_superadmin(request.headers.get("Authorization")):
+        return admin_required()
+
+    path = request_profiler.path(name)
+    if not path:
+        return jsonify({'status': False, 'message': 'Profile not found'}), 404
+
+    if request.args.get('raw'):
+        return send_file(path, as_attachment=True, download_name=name)
+
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in SORT_KEYS:
+        return jsonify({
+            'status': False,
+            'message': 'sort must be one of {}'.format(", ".join(SORT_KEYS))
+        }), 400
+
+    report = request_profiler.report(pstats.Stats(path), sort)
+    return report, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
+@profiling_blueprint.route('/profiles/sampling', methods=['PUT'])
+@query_budget(3)
+@authenticate
+def set_sampling(user_id):
+    """Profile a percentage of all requests, in this process"""
+    if not is_superadmin(request.headers.get("Authorization")):
+        return admin_required()
+
+    response_object = {
+        'status': False,
+        'message': 'Invalid payload.'
+    }
+
+    try:
+        percent = SAMPLING_SCHEMA.validate(request.get_json())['percent']
+        if not 0 <= percent <= 100:
+            raise APIError("percent must be between 0 and 100")
+
+        request_profiler.sample_percent = percent
+
+        response_object['status'] = True
+        response_object['message'] = 'Profiling {}% of requests'.format(percent)
+
+    except Exception as e:
+        logger.error(e)
+        response_object['message'] = 'Try again: ' + str(e)
+
+    return jsonify(response_object), 200
+
+
+@profiling_blueprint.route('/memory/trace', methods=['POST'])
+@query_budget(3)
+@authenticate
+def start_memory_trace(user_id):
+    """Take a baseline snapshot and trace allocations for a while"""
+    if not is_superadmin(request.headers.get("Authorization")):
+        return admin_required()
+
+    response_object = {
+        'status': False,
+        'message': 'Invalid payload.'
+    }
+
+    try:
+        seconds = TRACE_SCHEMA.validate(request.get_json(silent=True) or {}).get('seconds')
+        if seconds is not None and seconds <= 0:
+            raise APIError("seconds must be positive")
+
+        response_object['status'] = True
+        response_object['message'] = 'Tracing memory allocations'
+        response_object['data'] = {'deadline': memory_tracer.start(seconds)}
+
+    except Exception as e:
+        logger.error(e)
+        response_object['message'] = 'Try again: ' + str(e)
+
+    return jsonify(response_object), 200
+
+
+@profiling_blueprint.route('/memory/trace', methods=['GET'])
+@query_budget(3)
+@authenticate
+def memory_trace_report(user_id):
+    """Top allocation sites against the baseline and peaks per endpoint"""
+    if not is_superadmin(request.headers.get("Authorization")):
+        return admin_required()
+
+    report = memory_tracer.report(request.args.get('limit', type=int))
+    if not report:
+        return jsonify({'status': False, 'message': 'No memory trace taken'}), 404
+
+    return jsonify({
+        'status': True,
+        'message': 'Memory trace',
+        'data': report
+    }), 200
+
+
+@profiling_blueprint.route('/memory/trace', methods=['DELETE'])
+@query_budget(3)
+@authenticate
+def stop_memory_trace(user_id):
+    """Stop tracing, returns the final report"""
+    if not is_superadmin(request.headers.get("Authorization")):
+        return admin_required()
+
+    return jsonify({
+        'status': True,
+        'message': 'Memory trace stopped',
+        'data': memory_tracer.stop()
+    }), 200
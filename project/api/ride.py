@@ -14,15 +14,33 @@ from project.models import (
 )
 
 from project import db
+from project.services import Preloaded, load_trip_detail, query_budget
 from project.api.authentications import authenticate
-from project.api.validators import field_type_validator, required_validator
+from project.api.validators import Schema, Field, LOCATION_SCHEMA
 
 logger = logging.getLogger(__name__)
 
+RIDE_SCHEMA = Schema({
+    "trip_id": Field(int, required=True),
+    "origin": Field(dict, required=True, schema=LOCATION_SCHEMA),
+    "seats_booked": Field(int, required=True)
+})
+
+RIDE_UPDATE_SCHEMA = Schema({
+    "origin": Field(dict, required=True, schema=LOCATION_SCHEMA.partial()),
+    "seats_booked": Field(int, required=True)
+})
+
+FEEDBACK_SCHEMA = Schema({
+    "rating": Field(int, required=True),
+    "comment": Field(str)
+})
+
 ride_blueprint = Blueprint("ride", __name__, template_folder="templates")
 
 
 @ride_blueprint.route("/ride/ping", methods=["GET"])
+@query_budget(0)
 def ping():
     return jsonify({
         "status": "success",
@@ -31,19 +49,22 @@ def ping():
 
 
 @ride_blueprint.route("/ride/list", methods=["GET"])
+@query_budget(3)
 def list_rides():
     """List all rides"""
     rides = TripPassenger.query.all()
+    preloaded = Preloaded.load(passengers=rides)
     return jsonify({
         "status": True,
         "message": "Rides retrieved successfully",
         "data": {
-            "rides": [ride.to_json() for ride in rides]
+            "rides": [ride.to_json(preloaded) for ride in rides]
         }
     })
 
 
 @ride_blueprint.route("/ride/get", methods=["GET"])
+@query_budget(9)
 @authenticate
 def get(user_id):
     """Get available rides for a user sorted by driver rating"""
@@ -57,24 +78,22 @@ def get(user_id):
         Trip.time.asc()
     ).all()
 
-    rides_json = []
-    for ride in rides:
-        user_trip = TripPassenger.query.filter_by(
-            trip_id=ride.id,
-            passenger_id=user_id,
-        ).all()
+    requested = {trip_id for trip_id, in TripPassenger.query.filter(
+        TripPassenger.passenger_id == user_id,
+        TripPassenger.request_status.in_(
+            [RequestStatus.pending, RequestStatus.accepted])
+    ).with_entities(TripPassenger.trip_id).all()}
 
-        ride_requested = False
-        for trip in user_trip:
-            if trip.request_status in [RequestStatus.pending, RequestStatus.accepted]:
-                ride_requested = True
-                break
+    rides = [ride for ride in rides if ride.id not in requested]
 
-        if not ride_requested:
-            ride_json = ride.to_json()
-            ride_json["avg_rating"] = Rating.get_average_rating(
-                ride.driver_id)
-            rides_json.append(ride_json)
+    preloaded = Preloaded.load(rides)
+    ratings = Rating.get_average_ratings({ride.driver_id for ride in rides})
+
+    rides_json = []
+    for ride in rides:
+        ride_json = ride.to_json(preloaded)
+        ride_json["avg_rating"] = ratings[ride.driver_id]
+        rides_json.append(ride_json)
 
     return jsonify({
         "status": True,
@@ -86,31 +105,26 @@ def get(user_id):
 
 
 @ride_blueprint.route("/ride/get/<int:ride_id>", methods=["GET"])
+@query_budget(8)
 @authenticate
 def get_ride(user_id, ride_id):
     """Get a ride"""
-    trip = Trip.query.filter_by(
-        id=ride_id
-    ).first()
-    if not trip:
+    trip_detail = load_trip_detail(ride_id)
+    if not trip_detail:
         return jsonify({
             "status": False,
             "message": "Trip not found"
         }), 200
 
-    ride = TripPassenger.query.filter_by(
-        trip_id=ride_id,
-        passenger_id=user_id,
-        request_status=RequestStatus.accepted
-    ).first()
+    ride = trip_detail.passenger(user_id)
     if not ride:
         return jsonify({
             "status": False,
             "message": "Ride not found"
         }), 200
 
-    ride = ride.to_json()
-    ride["trip"] = trip.to_json()
+    ride = ride.to_json(trip_detail.preloaded)
+    ride["trip"] = trip_detail.trip_json()
 
     return jsonify({
         "status": True,
@@ -122,6 +136,7 @@ def get_ride(user_id, ride_id):
 
 
 @ride_blueprint.route("/ride/create", methods=["POST"])
+@query_budget(13)
 @authenticate
 def create(user_id):
     """Create a ride"""
@@ -135,14 +150,7 @@ def create(user_id):
         if not data:
             return jsonify(response_object), 200
 
-        field_types = {
-            "trip_id": int, "origin": dict, "seats_booked": int
-        }
-
-        required_fields = list(field_types.keys())
-
-        post_data = field_type_validator(data, field_types)
-        required_validator(post_data, required_fields)
+        post_data = RIDE_SCHEMA.validate(data)
 
         trip_id = post_data.get("trip_id")
         source = post_data.get("origin")
@@ -184,15 +192,6 @@ def create(user_id):
                 "message": "You have already booked this ride"
             }), 200
 
-        field_types = {
-            "latitude": float, "longitude": float, "place": str
-        }
-
-        required_fields = list(field_types.keys())
-
-        source = field_type_validator(source, field_types)
-        required_validator(source, required_fields)
-
         source = Location(
             latitude=source.get("latitude"),
             longitude=source.get("longitude"),
@@ -227,6 +226,7 @@ def create(user_id):
 
 
 @ride_blueprint.route("/ride/update/<int:ride_id>", methods=["PATCH", "PUT"])
+@query_budget(13)
 @authenticate
 def update(user_id, ride_id):
     """Update a ride"""
@@ -266,14 +266,7 @@ def update(user_id, ride_id):
                 "message": "You can't update {} ride".format(ride.request_status.name)
             }), 200
 
-        field_types = {
-            "origin": dict, "seats_booked": int
-        }
-
-        required_fields = list(field_types.keys())
-
-        post_data = field_type_validator(data, field_types)
-        required_validator(post_data, required_fields)
+        post_data = RIDE_UPDATE_SCHEMA.validate(data)
 
         source = post_data.get("origin")
         seats_booked = post_data.get("seats_booked")
@@ -290,14 +283,6 @@ def update(user_id, ride_id):
                 "message": "Not enough seats available"
             }), 200
 
-        field_types = {
-            "latitude": float, "longitude": float, "place": str
-        }
-
-        required_fields = list(field_types.keys())
-
-        source = field_type_validator(source, field_types)
-
         location = Location.query.get(ride.source_id)
 
         location.latitude = source.get("latitude") or location.latitude
@@ -325,6 +310,7 @@ def update(user_id, ride_id):
 
 
 @ride_blueprint.route("/ride/delete/<int:ride_id>", methods=["DELETE"])
+@query_budget(7)
 @authenticate
 def delete(user_id, ride_id):
     """Delete a ride"""
@@ -371,6 +357,7 @@ def delete(user_id, ride_id):
 
 
 @ride_blueprint.route("/ride/status", methods=["GET"])
+@query_budget(7)
 @authenticate
 def ride_status(user_id):
     """Get ride status"""
@@ -402,10 +389,12 @@ def ride_status(user_id):
             Trip.time.asc()
         ).all()
 
+        preloaded = Preloaded.load(rides)
+
         response_object["status"] = True
         response_object["message"] = "{} ride(s) found".format(len(rides))
         response_object["data"] = {
-            "rides": [ride.to_json() for ride in rides]
+            "rides": [ride.to_json(preloaded) for ride in rides]
         }
 
         return jsonify(response_object), 200
@@ -417,6 +406,7 @@ def ride_status(user_id):
 
 
 @ride_blueprint.route("/ride/feedback/<int:ride_id>", methods=["POST"])
+@query_budget(13)
 @authenticate
 def rate_ride(user_id, ride_id):
     """Rate a ride"""
@@ -430,15 +420,7 @@ def rate_ride(user_id, ride_id):
         if not post_data:
             return jsonify(response_object), 200
 
-        field_types = {
-            "rating": int, "comment": str
-        }
-
-        required_fields = list(field_types.keys())
-        required_fields.remove("comment")
-
-        post_data = field_type_validator(post_data, field_types)
-        required_validator(post_data, required_fields)
+        post_data = FEEDBACK_SCHEMA.validate(post_data)
 
         rating = post_data.get("rating")
         feedback = post_data.get("comment")
@@ -497,7 +479,7 @@ def rate_ride(user_id, ride_id):
         response_object["status"] = True
         response_object["message"] = "Trip rated successfully"
         response_object["data"] = {
-            "rating": rating.to_json()
+            "rating": rating.to_json(Preloaded.load(ratings=[rating]))
         }
 
         return jsonify(response_object), 200
@@ -14,15 +14,69 @@ from project.models import (
 )
 
 from project import db
+from project.services import (
+    Preloaded,
+    load_trip_detail,
+    accepted_passenger_counts,
+    apply_request_statuses,
+    recurrence_dates,
+    create_trips,
+    deletion,
+    query_budget
+)
 from project.api.authentications import authenticate
-from project.api.validators import field_type_validator, required_validator
+from project.api.validators import Schema, Field, LOCATION_SCHEMA
 
 logger = logging.getLogger(__name__)
 
 trip_blueprint = Blueprint('trip', __name__, template_folder='templates')
 
+MAX_BULK_REQUESTS = 100
+MAX_BULK_TRIPS = 52
+
+# the pickup place name is optional
+ORIGIN_SCHEMA = LOCATION_SCHEMA.extend(place=Field(str))
+
+TRIP_SCHEMA = Schema({
+    "origin": Field(dict, required=True, schema=ORIGIN_SCHEMA),
+    "destination_id": Field(int, required=True),
+    "date": Field(str, required=True),
+    "time": Field(str, required=True),
+    "number_of_seats": Field(int, required=True),
+    "carpool": Field(bool)
+})
+
+TRIP_UPDATE_SCHEMA = TRIP_SCHEMA.partial().extend(
+    origin=Field(dict, required=True, schema=ORIGIN_SCHEMA))
+
+RECURRENCE_SCHEMA = Schema({
+    "weekday": Field(str, required=True),
+    "weeks": Field(int, required=True),
+    "start_date": Field(str)
+})
+
+BULK_TRIP_SCHEMA = Schema({
+    "origin": Field(dict, required=True, schema=ORIGIN_SCHEMA),
+    "destination_id": Field(int, required=True),
+    "time": Field(str, required=True),
+    "number_of_seats": Field(int, required=True),
+    "carpool": Field(bool),
+    "dates": Field(list),
+    "recurrence": Field(dict, schema=RECURRENCE_SCHEMA)
+})
+
+STATUS_SCHEMA = Schema({"status": Field(str, required=True)})
+
+BULK_REQUESTS_SCHEMA = Schema({"requests": Field(list, required=True)})
+
+BULK_REQUEST_ITEM_SCHEMA = Schema({
+    "id": Field(int, required=True),
+    "status": Field(str, required=True)
+}, prefix="request")
+
 
 @trip_blueprint.route('/trip/ping', methods=['GET'])
+@query_budget(0)
 def ping_pong():
     return jsonify({
         'status': True,
@@ -31,58 +85,61 @@ def ping_pong():
 
 
 @trip_blueprint.route('/trip/list', methods=['GET'])
+@query_budget(5)
 def get_trips():
     """Get all trips"""
     trips = Trip.query.all()
+    preloaded = Preloaded.load(trips)
     response_object = {
         'status': True,
         'data': {
-            'trips': [trip.to_json() for trip in trips]
+            'trips': [trip.to_json(preloaded) for trip in trips]
         }
     }
     return jsonify(response_object), 200
 
 
 @trip_blueprint.route('/trip/get', methods=['GET'])
+@query_budget(7)
 @authenticate
 def get_user_trips(user_id):
     """Get all trips for a user"""
     trips = Trip.query.filter_by(driver_id=user_id).all()
+    preloaded = Preloaded.load(trips)
     response_object = {
         'status': True,
         'data': {
-            'trips': [trip.to_json() for trip in trips]
+            'trips': [trip.to_json(preloaded) for trip in trips]
         }
     }
     return jsonify(response_object), 200
 
 
 @trip_blueprint.route('/trip/get/<int:trip_id>', methods=['GET'])
+@query_budget(8)
 @authenticate
 def get_trip_by_id(user_id, trip_id):
     """Get a single trip"""
-    trip = Trip.query.filter_by(id=trip_id, driver_id=user_id).first()
-    if not trip:
+    trip_detail = load_trip_detail(trip_id, driver_id=user_id)
+    if not trip_detail:
         response_object = {
             'status': False,
             'message': 'Trip does not exist',
         }
         return jsonify(response_object), 200
 
-    passengers = TripPassenger.query.filter_by(
-        trip_id=trip_id, request_status=RequestStatus.accepted).all()
-
     response_object = {
         'status': True,
         'data': {
-            'trip': trip.to_json(),
-            'passengers': [passenger.to_json() for passenger in passengers]
+            'trip': trip_detail.trip_json(),
+            'passengers': trip_detail.passengers_json()
         }
     }
     return jsonify(response_object), 200
 
 
 @trip_blueprint.route('/trip/create', methods=['POST'])
+@query_budget(14)
 @authenticate
 def create_trip(user_id):
     """Create a new trip"""
@@ -101,16 +158,7 @@ def create_trip(user_id):
         if not post_data:
             return jsonify(response_object), 200
 
-        field_types = {
-            "origin": dict, "destination_id": int, "date": str,
-            "time": str, "number_of_seats": int, "carpool": bool
-        }
-
-        required_fields = list(field_types.keys())
-        required_fields.remove('carpool')
-
-        post_data = field_type_validator(post_data, field_types)
-        required_validator(post_data, required_fields)
+        post_data = TRIP_SCHEMA.validate(post_data)
 
         source = post_data.get('origin')
         destination_id = post_data.get('destination_id')
@@ -143,16 +191,6 @@ def create_trip(user_id):
                                          "on this date & time.".format(status)
             return jsonify(response_object), 200
 
-        field_types = {
-            "latitude": float, "longitude": float, "place": str
-        }
-
-        required_fields = list(field_types.keys())
-        required_fields.remove("place")
-
-        source = field_type_validator(source, field_types)
-        required_validator(source, required_fields)
-
         source = Location(
             latitude=source.get("latitude"),
             longitude=source.get("longitude"),
@@ -193,7 +231,112 @@ def create_trip(user_id):
         return jsonify(response_object), 200
 
 
+@trip_blueprint.route('/trip/create/bulk', methods=['POST'])
+# one INSERT per source location where executemany returns no ids, e.g. sqlite
+@query_budget(10 + MAX_BULK_TRIPS)
+@authenticate
+def create_trips_bulk(user_id):
+    """Create the same trip on several dates, e.g. every sunday for 12 weeks"""
+    response_object = {
+        'status': False,
+        'message': 'Invalid payload.'
+    }
+
+    try:
+        driver = User.query.get(user_id)
+        if driver.role != Role.driver:
+            response_object['message'] = 'Only drivers can create trips'
+            return jsonify(response_object), 200
+
+        post_data = request.get_json()
+        if not post_data:
+            return jsonify(response_object), 200
+
+        post_data = BULK_TRIP_SCHEMA.validate(post_data)
+
+        source = post_data.get('origin')
+        destination_id = post_data.get('destination_id')
+        number_of_seats = post_data.get('number_of_seats')
+        carpool = post_data.get('carpool') or False
+        time = datetime.strptime(post_data.get('time'), '%H:%M:%S').time()
+
+        recurrence = post_data.get('recurrence')
+        if recurrence:
+            weeks = recurrence.get('weeks')
+            if weeks < 1 or weeks > MAX_BULK_TRIPS:
+                response_object['message'] = 'Recurrence weeks must be ' \
+                    'between 1 and {}'.format(MAX_BULK_TRIPS)
+                return jsonify(response_object), 200
+
+            start_date = recurrence.get('start_date')
+            start_date = datetime.strptime(
+                start_date, '%Y-%m-%d').date() if start_date else None
+
+            dates = recurrence_dates(
+                recurrence.get('weekday'), weeks, time, start_date)
+
+        elif post_data.get('dates'):
+            dates = [datetime.strptime(str(date), '%Y-%m-%d').date()
+                     for date in post_data.get('dates')]
+
+            if len(set(dates)) != len(dates):
+                response_object['message'] = 'Dates should not repeat'
+                return jsonify(response_object), 200
+
+            if len(dates) > MAX_BULK_TRIPS:
+                response_object['message'] = 'At most {} trips can be ' \
+                    'created at once'.format(MAX_BULK_TRIPS)
+                return jsonify(response_object), 200
+
+        else:
+            response_object['message'] = 'dates or recurrence is required'
+            return jsonify(response_object), 200
+
+        # Validate date and time
+        if min(datetime.combine(date, time) for date in dates) < datetime.now():
+            response_object['message'] = 'Trip cannot be in the past, ' \
+                'please check the date and time'
+            return jsonify(response_object), 200
+
+        if number_of_seats < 1:
+            response_object['message'] = 'Number of seats must be greater than 0'
+            return jsonify(response_object), 200
+
+        destination = Location.query.filter_by(id=destination_id).first()
+        if not destination:
+            response_object['message'] = 'Destination does not exist'
+            return jsonify(response_object), 200
+
+        trips = create_trips(
+            driver_id=user_id,
+            source=source,
+            destination_id=destination_id,
+            at_time=time,
+            dates=dates,
+            number_of_seats=number_of_seats,
+            carpool=carpool
+        )
+
+        preloaded = Preloaded.load(trips)
+
+        response_object['status'] = True
+        response_object['message'] = '{} trip(s) created successfully'.format(
+            len(trips))
+        response_object['data'] = {
+            'trips': [trip.to_json(preloaded) for trip in trips]
+        }
+
+        return jsonify(response_object), 200
+
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(e)
+        response_object['message'] = str(e)
+        return jsonify(response_object), 200
+
+
 @trip_blueprint.route('/trip/update/<int:trip_id>', methods=['PATCH'])
+@query_budget(17)
 @authenticate
 def update_trip(user_id, trip_id):
     """Update a trip"""
@@ -217,12 +360,7 @@ def update_trip(user_id, trip_id):
         if not post_data:
             return jsonify(response_object), 200
 
-        field_types = {
-            "origin": dict, "destination_id": int, "date": str,
-            "time": str, "number_of_seats": int, "carpool": bool
-        }
-
-        post_data = field_type_validator(post_data, field_types)
+        post_data = TRIP_UPDATE_SCHEMA.validate(post_data)
 
         source = post_data.get('origin')
         destination_id = post_data.get('destination_id')
@@ -267,16 +405,6 @@ def update_trip(user_id, trip_id):
                 response_object['message'] = 'Destination does not exist'
                 return jsonify(response_object), 200
 
-        field_types = {
-            "latitude": float, "longitude": float, "place": str
-        }
-
-        required_fields = list(field_types.keys())
-        required_fields.remove("place")
-
-        source = field_type_validator(source, field_types)
-        required_validator(source, required_fields)
-
         old_source = Location.query.filter_by(id=trip.source_id).first()
         if old_source:
             old_source.latitude = source.get("latitude") or old_source.latitude
@@ -320,6 +448,7 @@ def update_trip(user_id, trip_id):
 
 
 @trip_blueprint.route('/trip/delete/<int:trip_id>', methods=['DELETE'])
+@query_budget(9)
 @authenticate
 def delete_trip(user_id, trip_id):
     """Delete a trip"""
@@ -339,9 +468,7 @@ def delete_trip(user_id, trip_id):
             response_object['message'] = 'Trip does not exist'
             return jsonify(response_object), 200
 
-        TripPassenger.query.filter_by(trip_id=trip_id).delete()
-
-        trip.delete()
+        deletion.delete_trip(trip)
 
         response_object['status'] = True
         response_object['message'] = 'Trip deleted successfully'
@@ -356,6 +483,7 @@ def delete_trip(user_id, trip_id):
 
 
 @trip_blueprint.route('/trip/status/<int:trip_id>', methods=['GET', 'PUT'])
+@query_budget(5)
 @authenticate
 def trip_status(user_id, trip_id):
     """Update a trip status"""
@@ -388,11 +516,7 @@ def trip_status(user_id, trip_id):
         if not post_data:
             return jsonify(response_object), 200
 
-        field_types = {"status": str}
-        required_fields = ["status"]
-
-        post_data = field_type_validator(post_data, field_types)
-        required_validator(post_data, required_fields)
+        post_data = STATUS_SCHEMA.validate(post_data)
 
         status = post_data.get('status')
         status = str(status).lower() if status else status
@@ -424,6 +548,7 @@ def trip_status(user_id, trip_id):
 
 
 @trip_blueprint.route('/trip/status', methods=['GET'])
+@query_budget(8)
 @authenticate
 def trip_status_list(user_id):
     """Get trip status list"""
@@ -450,14 +575,13 @@ def trip_status_list(user_id):
 
         trips = trips.order_by(Trip.date.asc(), Trip.time.asc()).all()
 
-        trips = [trip.to_json() for trip in trips]
+        preloaded = Preloaded.load(trips)
+        passenger_counts = accepted_passenger_counts([trip.id for trip in trips])
+
+        trips = [trip.to_json(preloaded) for trip in trips]
 
         for trip in trips:
-            passengers = TripPassenger.query.filter_by(
-                trip_id=trip['id'],
-                request_status=RequestStatus.accepted
-            ).all()
-            trip['number_of_passengers'] = len(passengers)
+            trip['number_of_passengers'] = passenger_counts[trip['id']]
 
         response_object['status'] = True
         response_object['message'] = '{} trips retrieved successfully'.format(
@@ -476,6 +600,7 @@ def trip_status_list(user_id):
 
 
 @trip_blueprint.route('/trip/requests', methods=['GET'])
+@query_budget(5)
 @authenticate
 def trip_requests(user_id):
     """Get all trip requests"""
@@ -500,11 +625,13 @@ def trip_requests(user_id):
             TripPassenger.timestamp.asc()
         ).all()
 
+        preloaded = Preloaded.load(passengers=pending_requests)
+
         response_object['status'] = True
         response_object['message'] = '{} trip request(s) available'.format(
             len(pending_requests))
         response_object['data'] = {
-            'requests': [request.to_json() for request in pending_requests]
+            'requests': [request.to_json(preloaded) for request in pending_requests]
         }
 
         return jsonify(response_object), 200
@@ -515,7 +642,81 @@ def trip_requests(user_id):
         return jsonify(response_object), 200
 
 
+@trip_blueprint.route('/trip/requests/bulk', methods=['PUT'])
+# authenticate, the locking read, one UPDATE per status and the seats UPDATE
+@query_budget(4 + len(RequestStatus))
+@authenticate
+def trip_requests_bulk(user_id):
+    """Accept or reject several trip requests at once"""
+    response_object = {
+        'status': False,
+        'message': 'Invalid payload.'
+    }
+
+    try:
+        driver = User.query.get(user_id)
+        if driver.role != Role.driver:
+            response_object['message'] = 'Only drivers can access trip requests'
+            return jsonify(response_object), 200
+
+        post_data = request.get_json()
+        if not post_data:
+            return jsonify(response_object), 200
+
+        post_data = BULK_REQUESTS_SCHEMA.validate(post_data)
+
+        items = post_data.get('requests')
+        if len(items) > MAX_BULK_REQUESTS:
+            response_object['message'] = 'At most {} trip requests can be ' \
+                'updated at once'.format(MAX_BULK_REQUESTS)
+            return jsonify(response_object), 200
+
+        changes = []
+        invalid = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                invalid[index] = {
+                    'id': None,
+                    'status': False,
+                    'message': 'request should be dict value'
+                }
+                continue
+
+            cleaned, errors = BULK_REQUEST_ITEM_SCHEMA.check(item)
+            if errors:
+                invalid[index] = {
+                    'id': item.get('id'),
+                    'status': False,
+                    'message': ", ".join(errors)
+                }
+                continue
+
+            changes.append((cleaned['id'], cleaned['status']))
+
+        results = iter(apply_request_statuses(user_id, changes))
+        results = [invalid.get(index) or next(results)
+                   for index in range(len(items))]
+
+        updated = len([result for result in results if result['status']])
+
+        response_object['status'] = True
+        response_object['message'] = '{} of {} trip request(s) updated'.format(
+            updated, len(results))
+        response_object['data'] = {
+            'results': results
+        }
+
+        return jsonify(response_object), 200
+
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(e)
+        response_object['message'] = str(e)
+        return jsonify(response_object), 200
+
+
 @trip_blueprint.route('/trip/request/<int:request_id>', methods=['GET', 'PUT'])
+@query_budget(12)
 @authenticate
 def trip_request(user_id, request_id):
     """Get a trip request"""
@@ -551,11 +752,7 @@ def trip_request(user_id, request_id):
         if not post_data:
             return jsonify(response_object), 200
 
-        field_types = {"status": str}
-        required_fields = ["status"]
-
-        post_data = field_type_validator(post_data, field_types)
-        required_validator(post_data, required_fields)
+        post_data = STATUS_SCHEMA.validate(post_data)
 
         status = post_data.get('status')
         status = str(status).lower() if status else status
@@ -596,6 +793,7 @@ def trip_request(user_id, request_id):
 
 
 @trip_blueprint.route('/trip/rides', methods=['GET'])
+@query_budget(4)
 @authenticate
 def trip_rides(user_id):
     """Get total number of rides and passengers"""
@@ -615,31 +813,33 @@ def trip_rides(user_id):
         total_passengers = 0
         documents_verified = False
 
-        if driver.vehicle_verified and driver.license_verified:
+        if driver.vehicle_verified and driver.licence_verified:
             documents_verified = True
 
-        trips = Trip.query.filter(
+        trips_by_status = dict(Trip.query.filter(
             Trip.driver_id == user_id
-        ).all()
-
-        for trip in trips:
-            if trip.status in [TripStatus.pending, TripStatus.active]:
-                remaining_trips -= 1
+        ).with_entities(
+            Trip.status, db.func.count(Trip.id)
+        ).group_by(Trip.status).all())
 
-            elif trip.status == TripStatus.completed:
-                total_rides += 1
+        remaining_trips -= trips_by_status.get(TripStatus.pending, 0) + \
+            trips_by_status.get(TripStatus.active, 0)
+        total_rides = trips_by_status.get(TripStatus.completed, 0)
 
-                passengers = TripPassenger.query.filter(
-                    TripPassenger.trip_id == trip.id,
-                    TripPassenger.request_status == RequestStatus.accepted
-                ).with_entities(
-                    db.func.sum(
-                        TripPassenger.seats_booked
-                    ).label('total_seats')
-                ).first().total_seats
+        passengers = TripPassenger.query.join(
+            Trip, Trip.id == TripPassenger.trip_id
+        ).filter(
+            Trip.driver_id == user_id,
+            Trip.status == TripStatus.completed,
+            TripPassenger.request_status == RequestStatus.accepted
+        ).with_entities(
+            db.func.sum(
+                TripPassenger.seats_booked
+            ).label('total_seats')
+        ).first().total_seats
 
-                if passengers:
-                    total_passengers += int(passengers)
+        if passengers:
+            total_passengers = int(passengers)
 
         response_object['status'] = True
         response_object['message'] = 'Trip rides retrieved successfully'
@@ -659,6 +859,7 @@ def trip_rides(user_id):
 
 
 @trip_blueprint.route('/trip/latest', methods=['GET'])
+@query_budget(9)
 @authenticate
 def latest_trip(user_id):
     """Get latest trip"""
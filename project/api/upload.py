@@ -1,17 +1,30 @@
-import os
-import base64
 import logging
+from collections import Counter
 
-from flask import Blueprint, jsonify, request
-from project.api.utils import secure_file, upload_file
-from project.api.authentications import authenticate
+from flask import Blueprint, current_app, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+from project import db
+from project.exceptions import APIError
+from project.api.utils import secure_file
+from project.api.validators import Schema, Field
+from project.models import UploadJob
+from project.services import upload_service, asset_stats, query_budget
+from project.api.authentications import authenticate, is_superadmin
 
 
 upload_blueprint = Blueprint('upload', __name__, template_folder='templates')
 logger = logging.getLogger(__name__)
 
+SESSION_SCHEMA = Schema({
+    "filename": Field(str, required=True),
+    "content_type": Field(str),
+    "size": Field(int, required=True)
+})
+
 
 @upload_blueprint.route('/upload/ping', methods=['GET'])
+@query_budget(0)
 def ping_pong():
     return jsonify({
         'status': True,
@@ -20,41 +33,48 @@ def ping_pong():
 
 
 @upload_blueprint.route('/upload/image', methods=['POST'])
+@query_budget(6)
 def upload_image():
-    filename = None
     try:
-        # get file from request
+        # get file from request, spooled to disk beyond a few hundred KB
         file = request.files['file']
         if file:
             # secure file
             secured_file = secure_file(file)
             filename = secured_file["filename"]
+            logger.info("Uploading {} ({} bytes)".format(
+                filename, secured_file["filesize"]))
 
-            # get current path
-            current_path = os.path.dirname(os.path.abspath(__name__))
-            file_path = os.path.join(current_path, filename)
-            logger.info("File path: {}".format(file_path))
+            keep_original = request.args.get("keep_original") == "1"
 
-            # read binary file and encode it to base64
-            with open(file_path, mode="rb") as img:
-                imgstr = base64.b64encode(img.read())
+            if request.args.get("async") == "1":
+                # answer right away, the upload runs in the background
+                job = upload_service.submit(
+                    file.stream, filename, secured_file["filetype"], keep_original)
 
-            # upload file
-            response = upload_file(imgstr, filename)
-            object_url = response.url
+                if not job:
+                    return jsonify({
+                        'status': False,
+                        'message': 'Upload queue is full, please retry shortly'
+                    }), 503
 
-            logger.info("File uploaded successfully: {}".format(object_url))
+                return jsonify({
+                    'status': True,
+                    'message': 'Upload queued',
+                    'data': job.to_json()
+                }), 202
 
-            # delete file locally
-            os.remove(filename)
+            data = upload_service.store(
+                file.stream, filename, secured_file["filetype"], keep_original)
+            object_url = data["image_url"]
+
+            logger.info("File uploaded successfully: {}".format(object_url))
 
             # return response
             return jsonify({
                 'status': True,
                 'message': 'File uploaded successfully',
-                'data': {
-                    'image_url': object_url
-                }
+                'data': data
             }), 200
 
         else:
@@ -63,11 +83,202 @@ def upload_image():
                 'message': "Invalid payload: file not found!"
             }), 400
 
+    except RequestEntityTooLarge:
+        raise
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error uploading file: {}".format(e))
+        return jsonify({"message": str(e), "status": False}), 400
+
+
+@upload_blueprint.route('/upload/images', methods=['POST'])
+# the files are stored by the batch workers, in their own sessions
+@query_budget(0)
+def upload_images():
+    """
+    Upload several files in one request, e.g. licence_image_front,
+    licence_image_back, vehicle_image and vehicle_plate_image, returns the
+    url of each file under its form field name
+    """
+    try:
+        files = [(key, file) for key, file in request.files.items(multi=True) if file]
+        if not files:
+            return jsonify({
+                'status': False,
+                'message': "Invalid payload: file not found!"
+            }), 400
+
+        if len(files) > current_app.config.get("UPLOAD_MAX_FILES"):
+            raise APIError("At most {} files can be uploaded at once".format(
+                current_app.config.get("UPLOAD_MAX_FILES")))
+
+        # a field sent several times is keyed by file name instead
+        field_counts = Counter(key for key, _ in files)
+
+        batch = []
+        for key, file in files:
+            secured_file = secure_file(file)
+            if field_counts[key] > 1:
+                key = secured_file["filename"]
+
+            batch.append((key, file.stream, secured_file["filename"],
+                          secured_file["filetype"]))
+
+        if len(set(item[0] for item in batch)) != len(batch):
+            raise APIError("Duplicate file names in payload")
+
+        results, errors = upload_service.store_many(
+            batch, request.args.get("keep_original") == "1")
+
+        if errors:
+            return jsonify({
+                'status': False,
+                'message': 'Error uploading {}'.format(", ".join(sorted(errors))),
+                'data': {key: data["image_url"] for key, data in results.items()},
+                'errors': errors
+            }), 400
+
+        response_object = {
+            'status': True,
+            'message': 'Files uploaded successfully',
+            'data': {key: data["image_url"] for key, data in results.items()}
+        }
+
+        originals = {key: data["original_url"] for key, data in results.items()
+                     if "original_url" in data}
+        if originals:
+            response_object['originals'] = originals
+
+        return jsonify(response_object), 200
+
+    except RequestEntityTooLarge:
+        raise
+
+    except APIError as e:
+        return jsonify({"message": str(e), "status": False}), 400
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error uploading files: {}".format(e))
+        return jsonify({"message": str(e), "status": False}), 400
+
+
+@upload_blueprint.route('/upload/session', methods=['POST'])
+@query_budget(2)
+@authenticate
+def create_upload_session(user_id):
+    """Start a resumable upload, chunks are then sent with PUT"""
+    try:
+        post_data = SESSION_SCHEMA.validate(request.get_json(silent=True))
+
+        session = upload_service.open_session(
+            int(user_id),
+            secure_filename(post_data["filename"]),
+            post_data["content_type"],
+            post_data["size"]
+        )
+
+        return jsonify({
+            'status': True,
+            'message': 'Upload session created',
+            'data': session
+        }), 201
+
+    except APIError as e:
+        return jsonify({"message": str(e), "status": False}), 400
+
     except Exception as e:
+        logger.error("Error opening upload session: {}".format(e))
+        return jsonify({"message": str(e), "status": False}), 400
+
+
+@upload_blueprint.route('/upload/session/<session_id>', methods=['GET'])
+@query_budget(2)
+@authenticate
+def get_upload_session(user_id, session_id):
+    """Offset to resume a session from"""
+    try:
+        return jsonify({
+            'status': True,
+            'message': 'Upload session',
+            'data': upload_service.session_state(session_id, int(user_id))
+        }), 200
+
+    except APIError as e:
+        return jsonify({"message": str(e), "status": False}), 400
+
+
+@upload_blueprint.route('/upload/session/<session_id>', methods=['PUT'])
+@query_budget(8)
+@authenticate
+def upload_session_chunk(user_id, session_id):
+    """
+    Append the raw request body at ?offset=, the last chunk completes the
+    upload and returns the file url
+    """
+    try:
         try:
-            logger.error("Error uploading file: {}".format(e))
-            os.remove(filename)
-        except:
-            pass
-        finally:
-            return jsonify({"message": str(e), "status": False}), 400
+            offset = int(request.args.get("offset", ""))
+        except ValueError:
+            raise APIError("offset should be integer value")
+
+        max_length = current_app.config.get("MAX_CONTENT_LENGTH")
+        if request.content_length is None or (
+                max_length and request.content_length > max_length):
+            raise RequestEntityTooLarge()
+
+        session = upload_service.append_chunk(
+            session_id, int(user_id), offset, request.stream)
+
+        return jsonify({
+            'status': True,
+            'message': 'File uploaded successfully' if "image_url" in session
+            else 'Chunk received',
+            'data': session
+        }), 200
+
+    except RequestEntityTooLarge:
+        raise
+
+    except APIError as e:
+        return jsonify({"message": str(e), "status": False}), 400
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error uploading chunk: {}".format(e))
+        return jsonify({"message": str(e), "status": False}), 400
+
+
+@upload_blueprint.route('/upload/job/<job_id>', methods=['GET'])
+@query_budget(1)
+def get_upload_job(job_id):
+    job = UploadJob.query.get(job_id)
+    if not job:
+        return jsonify({
+            'status': False,
+            'message': 'Upload job not found'
+        }), 404
+
+    return jsonify({
+        'status': True,
+        'message': 'Upload job {}'.format(job.status.name),
+        'data': job.to_json()
+    }), 200
+
+
+@upload_blueprint.route('/upload/stats', methods=['GET'])
+@query_budget(3)
+@authenticate
+def upload_stats(user_id):
+    if not is_superadmin(request.headers.get("Authorization")):
+        return jsonify({
+            'status': False,
+            'message': 'Admin access required.'
+        }), 403
+
+    return jsonify({
+        'status': True,
+        'message': 'Upload deduplication stats',
+        'data': asset_stats.to_json()
+    }), 200
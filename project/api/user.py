@@ -1,6 +1,6 @@
 import os
-import random
 import logging
+import datetime
 
 from flask import Blueprint, jsonify, request
 from flask import current_app
@@ -14,16 +14,36 @@ from project.models import (
 
 from project import db, bcrypt
 from project.exceptions import APIError
+from project.services import (
+    Preloaded,
+    remove_account,
+    otp_service,
+    deliverability_checker,
+    query_budget
+)
 from project.api.utils import send_email
-from project.api.authentications import authenticate
-from project.api.validators import email_validator, field_type_validator, required_validator
+from project.api.authentications import authenticate, is_superadmin
+from project.api.validators import email_validator, Schema, Field, LOCATION_SCHEMA
 
 
 user_blueprint = Blueprint('user', __name__, template_folder='templates')
 logger = logging.getLogger(__name__)
 
+USER_INFO_SCHEMA = Schema({
+    "fullname": Field(str), "email": Field(str), "password": Field(str),
+    "mobile_no": Field(str), "profile_picture": Field(str), "dob": Field(str),
+    "gender": Field(str), "address": Field(str), "active": Field(bool)
+})
+
+LOCATION_UPDATE_SCHEMA = LOCATION_SCHEMA.partial()
+
+STATUS_SCHEMA = Schema({"status": Field(bool, required=True)})
+
+OTP_SCHEMA = Schema({"otp": Field(int, required=True)})
+
 
 @user_blueprint.route('/health', methods=['GET'])
+@query_budget(0)
 def health():
     return jsonify({
         'status': True,
@@ -32,6 +52,7 @@ def health():
 
 
 @user_blueprint.route('/users/ping', methods=['GET'])
+@query_budget(0)
 def ping_pong():
     return jsonify({
         'status': True,
@@ -40,20 +61,23 @@ def ping_pong():
 
 
 @user_blueprint.route('/users/list', methods=['GET'])
+@query_budget(2)
 def get_all_users():
     """Get all users"""
     users = User.query.filter_by(role=Role.user).all()
+    preloaded = Preloaded.load(users=users)
     response_object = {
         'status': True,
         'message': '{} user(s) found'.format(len(users)),
         'data': {
-            'users': [user.to_json() for user in users]
+            'users': [user.to_json(preloaded) for user in users]
         }
     }
     return jsonify(response_object), 200
 
 
 @user_blueprint.route('/users/get/<int:user_id>', methods=['GET'])
+@query_budget(2)
 def get_single_user(user_id):
     """Get single user details"""
     response_object = {
@@ -76,6 +100,7 @@ def get_single_user(user_id):
 
 
 @user_blueprint.route('/users/get', methods=['GET'])
+@query_budget(4)
 @authenticate
 def get_user_by_auth_token(user_id):
     """Get single user details"""
@@ -99,6 +124,7 @@ def get_user_by_auth_token(user_id):
 
 
 @user_blueprint.route('/users/update_info', methods=['PATCH'])
+@query_budget(6)
 @authenticate
 def update_user_info(user_id):
     """Update user info"""
@@ -118,13 +144,7 @@ def update_user_info(user_id):
         if not user:
             raise APIError("User does not exist")
 
-        field_types = {
-            "fullname": str, "email": str, "password": str,
-            "mobile_no": str, "profile_picture": str, "dob": str,
-            "gender": str, "address": str, "active": bool
-        }
-
-        post_data = field_type_validator(post_data, field_types)
+        post_data = USER_INFO_SCHEMA.validate(post_data)
         if post_data.get("email"):
             email_validator(post_data.get("email"))
 
@@ -166,6 +186,7 @@ def update_user_info(user_id):
 
 
 @user_blueprint.route('/users/update_location', methods=['PATCH'])
+@query_budget(10)
 @authenticate
 def update_user_location(user_id):
     response_object = {
@@ -178,11 +199,7 @@ def update_user_location(user_id):
         if not user:
             return jsonify(response_object), 200
 
-        field_types = {
-            "latitude": float, "longitude": float, "place": str
-        }
-
-        post_data = field_type_validator(post_data, field_types)
+        post_data = LOCATION_UPDATE_SCHEMA.validate(post_data)
 
         location = Location.query.filter_by(id=user.location_id).first()
         if not location:
@@ -224,6 +241,7 @@ def update_user_location(user_id):
 
 
 @user_blueprint.route('/users/status/mobile', methods=['GET', 'PUT'])
+@query_budget(4)
 @authenticate
 def mobile_no_otp(user_id):
     """Get or update user's mobile no. verification status"""
@@ -250,8 +268,7 @@ def mobile_no_otp(user_id):
         if not post_data:
             return jsonify(response_object), 200
 
-        post_data = field_type_validator(post_data, {"status": bool})
-        required_validator(post_data, ['status'])
+        post_data = STATUS_SCHEMA.validate(post_data)
 
         user.fcm_verified = post_data.get('status')
         user.update()
@@ -271,6 +288,7 @@ def mobile_no_otp(user_id):
 
 
 @user_blueprint.route('/users/status/email', methods=['GET', 'PUT'])
+@query_budget(3)
 @authenticate
 def email_otp(user_id):
     """Get or update user's email verification status"""
@@ -281,9 +299,9 @@ def email_otp(user_id):
     }
 
     try:
-        user = User.query.get(int(user_id))
-
         if request.method == 'GET':
+            user = User.query.get(int(user_id))
+
             response_object['status'] = True
             response_object['message'] = 'User status retrieved successfully.'
             response_object['data'] = {
@@ -294,31 +312,33 @@ def email_otp(user_id):
 
         post_data = request.get_json()
 
-        if user.email_verified:
-            raise APIError("Email already verified")
-
         if not post_data:
             return jsonify(response_object), 200
 
-        post_data = field_type_validator(post_data, {"otp": int})
-        required_validator(post_data, ['otp'])
+        post_data = OTP_SCHEMA.validate(post_data)
 
-        current_otp = user.email_otp
-        logger.info("Current OTP: {}".format(current_otp))
+        # a verified user must not spend the code or an attempt on it
+        user = User.query.get(int(user_id))
+        if user.email_verified:
+            raise APIError("Email already verified")
 
-        if not current_otp:
-            raise APIError("OTP not sent yet")
+        otp_service.verify(user_id, post_data.get('otp'))
 
-        if post_data.get('otp') != int(current_otp):
-            raise APIError("Invalid OTP")
+        verified = User.query.filter_by(
+            id=int(user_id), email_verified=False
+        ).update({
+            'email_verified': True,
+            'timestamp': datetime.datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
 
-        user.email_verified = True
-        user.update()
+        if not verified:
+            raise APIError("Email already verified")
 
         response_object['status'] = True
         response_object['message'] = 'User status updated successfully.'
         response_object['data'] = {
-            'email_verified': user.email_verified
+            'email_verified': True
         }
 
         return jsonify(response_object), 200
@@ -330,6 +350,7 @@ def email_otp(user_id):
 
 
 @user_blueprint.route('/users/otp/email', methods=['GET'])
+@query_budget(5)
 @authenticate
 def get_email_otp(user_id):
     """Send email verification OTP"""
@@ -345,12 +366,7 @@ def get_email_otp(user_id):
         if user.email_verified:
             raise APIError("Email already verified")
 
-        email_otp = random.randint(100000, 999999)
-
-        user.email_otp = email_otp
-        user.update()
-
-        logger.info("Current OTP in session: {}".format(user.email_otp))
+        email_otp = otp_service.issue(user.id)
 
         send_email(email=user.email, name=user.fullname, body=str(email_otp))
 
@@ -370,6 +386,7 @@ def get_email_otp(user_id):
 
 
 @user_blueprint.route('/users/delete', methods=['DELETE'])
+@query_budget(16)
 @authenticate
 def delete_user(user_id):
     """Delete user"""
@@ -384,14 +401,12 @@ def delete_user(user_id):
         if not user:
             raise APIError("User does not exist")
 
-        location = Location.query.filter_by(id=user.location_id).first()
-        user.delete()
-
-        if location:
-            location.delete()
+        if remove_account(user):
+            response_object['message'] = 'User deleted successfully.'
+        else:
+            response_object['message'] = 'User is scheduled for deletion.'
 
         response_object['status'] = True
-        response_object['message'] = 'User deleted successfully.'
 
         return jsonify(response_object), 200
 
@@ -399,3 +414,21 @@ def delete_user(user_id):
         db.session.rollback()
         response_object['message'] = str(e)
         return jsonify(response_object), 200
+
+
+@user_blueprint.route('/users/email/deliverability', methods=['GET'])
+@query_budget(3)
+@authenticate
+def email_deliverability_stats(user_id):
+    """Deliverability cache stats, for admins"""
+    if not is_superadmin(request.headers.get("Authorization")):
+        return jsonify({
+            'status': False,
+            'message': 'Admin access required.'
+        }), 403
+
+    return jsonify({
+        'status': True,
+        'message': 'Email deliverability cache stats',
+        'data': deliverability_checker.cache.to_json()
+    }), 200
@@ -1,43 +1,45 @@
 import os
 import random
 import logging
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, current_app
 from werkzeug.utils import secure_filename
-from imagekitio.client import ImageKit
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
 
 from project.exceptions import APIError
+from project.services import email_outbox, upload_service
 
 logger = logging.getLogger(__name__)
 
-ACCESS_PRIVATE_KEY = os.getenv('IMAGEKIT_PRIVATE_KEY')
-ACCESS_PUBLIC_KEY = os.getenv('IMAGEKIT_PUBLIC_KEY')
-ACCESS_URL_ENDPOINT = os.getenv('IMAGEKIT_URL_ENDPOINT')
-SENDGRID_API_KEY = os.getenv('SENDGRID_API_KEY')
-
-imagekit = ImageKit(
-    private_key=ACCESS_PRIVATE_KEY,
-    public_key=ACCESS_PUBLIC_KEY,
-    url_endpoint=ACCESS_URL_ENDPOINT
-)
+class SpooledRequest(Request):
+    """
+    Request whose uploaded files are spooled in memory up to
+    UPLOAD_SPOOL_MAX_MEMORY bytes and roll over to a temporary file beyond
+    """
 
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        return SpooledTemporaryFile(
+            max_size=current_app.config.get("UPLOAD_SPOOL_MAX_MEMORY"),
+            mode="rb+")
 
-def upload_file(file, file_name):
-    response = imagekit.upload_file(
-        file=file,
-        file_name=file_name
-    )
 
-    return response
+def upload_file(file, file_name, content_type=None):
+    """
+    Store a file-like object with the configured storage backend, streamed
+    as is. Returns the upload response, including the file url
+    """
+    return {"url": upload_service.storage.save(file, file_name, content_type)}
 
 
 def secure_file(file) -> dict:
     filename = secure_filename(file.filename)
     filetype = file.content_type
 
-    # save file locally
-    file.save(filename)
-    filesize = os.stat(filename).st_size
+    # measure the spooled upload without copying it
+    file.stream.seek(0, os.SEEK_END)
+    filesize = file.stream.tell()
+    file.stream.seek(0)
 
     return {
         "filename": filename,
@@ -47,26 +49,20 @@ def secure_file(file) -> dict:
 
 
 def send_email(email: str, name: str, body: str):
-    logger.info("Sending email to: {}".format(email))
+    """Queue the OTP email in the outbox, returns the outbox id"""
+    logger.info("Queueing email to: {}".format(email))
 
     html_content = """
         <strong>Hi {}</strong>, <br><br> 
         Please enter the following One Time PIN (OTP) in the app: <strong>{}</strong>
     """.format(name, body)
 
-    message = Mail(
-        from_email="businesssolutiongovirtual@gmail.com",
-        to_emails=email,
-        subject="One Time PIN (OTP) for registration",
-        html_content=html_content
-    )
-
     try:
-        sg = SendGridAPIClient(SENDGRID_API_KEY)
-        response = sg.send(message)
-        logger.info("Email sent: {}".format(response.status_code))
-
-        return response.status_code
+        return email_outbox.enqueue(
+            recipient=email,
+            subject="One Time PIN (OTP) for registration",
+            html_content=html_content
+        )
 
     except Exception as e:
         logger.error(e)
@@ -1,14 +1,10 @@
-import os
-from email_validator import validate_email
-
-from project.exceptions import APIError
+from project.exceptions import APIError, ValidationError
+from project.services import deliverability_checker
 
 TYPE_NAMES = {
     int: "integer", float: "float", bool: "boolean", str: "string", dict: "dict"
 }
 
-check_deliverability = os.getenv("CHECK_DELIVERABILITY")
-
 def field_type_validator(request_data={}, field_types={}, prefix=""):
     """
     Validate given dict of fields and their types
@@ -56,15 +52,146 @@ def required_validator(request_data={}, required_fields=[], prefix=""):
 
             raise APIError(message)
 
+class Field:
+    """
+    Declares a payload field: its expected type, whether it is required,
+    and for dict fields the Schema of the nested payload
+    """
+    __slots__ = ("type", "required", "schema")
+
+    def __init__(self, type, required=False, schema=None):
+        self.type = type
+        self.required = required
+        self.schema = schema
+
+
+def _compile_field(name, field, prefix):
+    """
+    Build the check of one field, with its error messages formatted once.
+    Same rules as field_type_validator followed by required_validator
+    """
+    label = f"{prefix} {name}" if prefix else name
+    expected = field.type
+    type_error = f"{label} should be {TYPE_NAMES.get(expected, expected.__name__)} value"
+    required_error = f"{label} is required" if field.required else None
+    coerce_float = expected is float
+    nested = Schema(field.schema.fields, prefix=label)._check if field.schema else None
+
+    def check(data, errors):
+        value = data.get(name)
+
+        if value is None:
+            if required_error:
+                errors.append(required_error)
+            return None
+
+        if coerce_float:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                pass
+
+        if type(value) is not expected:
+            errors.append(type_error)
+            return value
+
+        if required_error and value == "":
+            errors.append(required_error)
+            return value
+
+        if nested is not None:
+            return nested(value, errors)
+
+        return value
+
+    return check
+
+
+class Schema:
+    """
+    Declarative payload schema, compiled once into one check per field.
+    Validates nested dicts in the same pass and reports every error:
+
+        LOCATION = Schema({
+            "latitude": Field(float, required=True),
+            "longitude": Field(float, required=True),
+            "place": Field(str, required=True)
+        })
+        CHURCH = Schema({
+            "name": Field(str, required=True),
+            "location": Field(dict, schema=LOCATION)
+        })
+
+        post_data = CHURCH.validate(request.get_json())
+
+    Like field_type_validator, the cleaned payload holds every declared
+    field (None when missing) and nothing else.
+    """
+
+    def __init__(self, fields, prefix=""):
+        self.fields = fields
+        self.prefix = prefix
+        self._checks = tuple(
+            (name, _compile_field(name, field, prefix))
+            for name, field in fields.items())
+
+    def _check(self, data, errors):
+        return {name: check(data, errors) for name, check in self._checks}
+
+    def check(self, data):
+        """Returns the cleaned payload and the list of errors"""
+        if not isinstance(data, dict):
+            return None, ["Invalid payload."]
+
+        errors = []
+        return self._check(data, errors), errors
+
+    def validate(self, data):
+        """Returns the cleaned payload, raises ValidationError listing all errors"""
+        cleaned, errors = self.check(data)
+
+        if errors:
+            raise ValidationError(errors)
+
+        return cleaned
+
+    def extend(self, **fields):
+        """New schema with fields added or replaced"""
+        return Schema({**self.fields, **fields}, prefix=self.prefix)
+
+    def partial(self):
+        """Same schema, nested ones included, with no required field"""
+        return Schema({
+            name: Field(field.type,
+                        schema=field.schema.partial() if field.schema else None)
+            for name, field in self.fields.items()
+        }, prefix=self.prefix)
+
+
+LOCATION_SCHEMA = Schema({
+    "latitude": Field(float, required=True),
+    "longitude": Field(float, required=True),
+    "place": Field(str, required=True)
+})
+
+VEHICLE_SCHEMA = Schema({
+    "vehicle_no": Field(str), "vehicle_image": Field(str),
+    "vehicle_color": Field(str), "vehicle_brand_name": Field(str),
+    "vehicle_plate_image": Field(str)
+})
+
+LICENCE_SCHEMA = Schema({
+    "licence_no": Field(str), "licence_image_front": Field(str),
+    "licence_image_back": Field(str)
+})
+
+
 def email_validator(email:str):
     """
-    Validate email
+    Validate email, deliverability results are cached per domain
     """
     try:
-        deliverability = bool(int(check_deliverability)) if check_deliverability else False
-
-        valid = validate_email(email, check_deliverability=deliverability)
-        email = valid.email
+        email = deliverability_checker.validate(email)
 
-    except Exception as e:        
+    except Exception as e:
         raise APIError(f"Invalid email: {email}, {str(e)}")
@@ -1,2 +1,2 @@
-from .custom_exceptions import APIError
+from .custom_exceptions import APIError, ValidationError
 from .exception_handler import handle_exception
\ No newline at end of file
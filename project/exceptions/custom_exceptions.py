@@ -6,3 +6,11 @@ All other exceptions are properly managed by exception handlers
 
 class APIError(Exception):
 	pass
+
+
+class ValidationError(APIError):
+	"""APIError carrying every validation error of a payload"""
+
+	def __init__(self, errors):
+		super().__init__(", ".join(errors))
+		self.errors = errors
@@ -19,6 +19,14 @@ def handle_exception(ex):
 
         return jsonify(response_data), 400
 
+    if hasattr(ex, 'code') and ex.code == 413:
+
+        response_data = {
+            "status": False,
+            "message": "Payload too large"
+        }
+        return jsonify(response_data), 413
+
     if hasattr(ex, 'code') and ex.code == 404:
 
         response_data = {
@@ -2,3 +2,6 @@ from .user_model import Role, Gender, User, BlacklistToken, Licence, Vehicle, Lo
 from .trip_model import TripStatus, RequestStatus, Trip, TripPassenger
 from .church_model import Church
 from .rating_model import Rating
+from .email_model import EmailStatus, EmailOutbox
+from .asset_model import UploadedAsset
+from .upload_job_model import JobStatus, UploadJob
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from project import db
+
+
+class UploadedAsset(db.Model):
+    """
+    UploadedAsset:
+        id: int
+        digest: string
+        variant: string
+        url: string
+        size: int
+        timestamp: datetime
+    """
+
+    __tablename__ = "uploaded_asset"
+    __table_args__ = (
+        db.UniqueConstraint("digest", "variant",
+                            name="uq_uploaded_asset_digest_variant"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    digest = db.Column(db.String(64), nullable=False)
+    variant = db.Column(db.String(32), nullable=False)
+    url = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"UploadedAsset {self.id} {self.digest}"
+
+    def __init__(self, digest: str, variant: str, url: str, size: int):
+        self.digest = digest
+        self.variant = variant
+        self.url = url
+        self.size = size
+
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
+    def update(self):
+        self.timestamp = datetime.utcnow()
+        db.session.commit()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "digest": self.digest,
+            "variant": self.variant,
+            "url": self.url,
+            "size": self.size,
+            "timestamp": self.timestamp.strftime("%Y-%m-%d %H:%M:%S") if self.timestamp else None
+        }
@@ -57,8 +57,12 @@ class Church(db.Model):
         db.session.delete(self)
         db.session.commit()
 
-    def to_json(self):
-        location = Location.query.filter_by(id=self.location_id).first()
+    def to_json(self, preloaded=None):
+        if preloaded is None:
+            location = Location.query.filter_by(id=self.location_id).first()
+        else:
+            location = preloaded.locations.get(self.location_id)
+
         return {
             "id": self.id,
             "name": self.name,
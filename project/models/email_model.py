@@ -0,0 +1,85 @@
+import enum
+from datetime import datetime
+
+from project import db
+
+
+class EmailStatus(enum.Enum):
+    """
+    EmailStatus:
+        pending: 0
+        sending: 1
+        sent: 2
+        failed: 3
+    """
+    pending = 0
+    sending = 1
+    sent = 2
+    failed = 3
+
+
+class EmailOutbox(db.Model):
+    """
+    EmailOutbox:
+        id: int
+        recipient: string
+        subject: string
+        html_content: text
+        status: enum
+        attempts: int
+        next_attempt_at: datetime
+        last_error: text
+        sent_at: datetime
+        timestamp: datetime
+    """
+
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        db.Index("ix_email_outbox_status_next_attempt_at",
+                 "status", "next_attempt_at"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    recipient = db.Column(db.String(128), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html_content = db.Column(db.Text, nullable=False)
+    status = db.Column(db.Enum(EmailStatus), nullable=False,
+                       default=EmailStatus.pending)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"EmailOutbox {self.id} {self.recipient}"
+
+    def __init__(self, recipient: str, subject: str, html_content: str):
+        self.recipient = recipient
+        self.subject = subject
+        self.html_content = html_content
+
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
+    def update(self):
+        self.timestamp = datetime.utcnow()
+        db.session.commit()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "recipient": self.recipient,
+            "subject": self.subject,
+            "status": self.status.name,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "sent_at": self.sent_at.strftime("%Y-%m-%d %H:%M:%S") if self.sent_at else None,
+            "timestamp": self.timestamp.strftime("%Y-%m-%d %H:%M:%S") if self.timestamp else None
+        }
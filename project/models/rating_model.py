@@ -18,11 +18,15 @@ class Rating(db.Model):
     """
 
     __tablename__ = "rating"
+    __table_args__ = (
+        db.Index("ix_rating_trip_id_passenger_id", "trip_id", "passenger_id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     passenger_id = db.Column(
         db.Integer, db.ForeignKey('user.id'), nullable=False)
-    driver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    driver_id = db.Column(db.Integer, db.ForeignKey(
+        'user.id'), nullable=False, index=True)
     trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=False)
     rating = db.Column(db.Integer, nullable=False, default=5)
     feedback = db.Column(db.Text, nullable=False, default="")
@@ -51,16 +55,22 @@ class Rating(db.Model):
         db.session.delete(self)
         db.session.commit()
 
-    def to_json(self):
-        passenger = User.query.get(self.passenger_id)
-        driver = User.query.get(self.driver_id)
-        trip = Trip.query.get(self.trip_id)
+    def to_json(self, preloaded=None):
+        if preloaded is None:
+            passenger = User.query.get(self.passenger_id)
+            driver = User.query.get(self.driver_id)
+            trip = Trip.query.get(self.trip_id)
+
+        else:
+            passenger = preloaded.users.get(self.passenger_id)
+            driver = preloaded.users.get(self.driver_id)
+            trip = preloaded.trips.get(self.trip_id)
 
         return {
             "id": self.id,
-            "passenger": passenger.to_json() if passenger else None,
-            "driver": driver.to_json() if driver else None,
-            "trip": trip.to_json() if trip else None,
+            "passenger": passenger.to_json(preloaded) if passenger else None,
+            "driver": driver.to_json(preloaded) if driver else None,
+            "trip": trip.to_json(preloaded) if trip else None,
             "rating": self.rating,
             "feedback": self.feedback,
             "timestamp": self.timestamp.strftime("%Y-%m-%d %H:%M:%S") if self.timestamp else None
@@ -76,3 +86,21 @@ class Rating(db.Model):
             [rating.rating for rating in ratings]) / len(ratings)
 
         return round(average_rating, 1)
+
+    @staticmethod
+    def get_average_ratings(driver_ids):
+        """{driver_id: average rating} of many drivers in one query"""
+        averages = {driver_id: 0.0 for driver_id in driver_ids}
+        if not averages:
+            return averages
+
+        rows = db.session.query(
+            Rating.driver_id, db.func.avg(Rating.rating)
+        ).filter(
+            Rating.driver_id.in_(averages)
+        ).group_by(Rating.driver_id).all()
+
+        for driver_id, average_rating in rows:
+            averages[driver_id] = round(float(average_rating), 1)
+
+        return averages
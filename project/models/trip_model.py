@@ -49,6 +49,10 @@ class Trip(db.Model):
     """
 
     __tablename__ = "trip"
+    __table_args__ = (
+        db.Index("ix_trip_driver_id_date_time", "driver_id", "date", "time"),
+        db.Index("ix_trip_status_date_time", "status", "date", "time"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     driver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -91,18 +95,28 @@ class Trip(db.Model):
         db.session.delete(self)
         db.session.commit()
 
-    def to_json(self):
-        driver = User.query.get(self.driver_id).to_json()
+    def to_json(self, preloaded=None):
+        if preloaded is None:
+            driver = User.query.get(self.driver_id).to_json()
 
-        vehicle = Vehicle.query.filter_by(user_id=self.driver_id).first()
-        licence = Licence.query.filter_by(user_id=self.driver_id).first()
+            vehicle = Vehicle.query.filter_by(user_id=self.driver_id).first()
+            licence = Licence.query.filter_by(user_id=self.driver_id).first()
+
+            source = Location.query.get(self.source_id)
+            destination = Location.query.get(self.destination_id)
+
+        else:
+            driver = preloaded.users[self.driver_id].to_json(preloaded)
+
+            vehicle = preloaded.vehicles.get(self.driver_id)
+            licence = preloaded.licences.get(self.driver_id)
+
+            source = preloaded.locations.get(self.source_id)
+            destination = preloaded.locations.get(self.destination_id)
 
         driver["vehicle"] = vehicle.to_json() if vehicle else None
         driver["licence"] = licence.to_json() if licence else None
 
-        source = Location.query.get(self.source_id)
-        destination = Location.query.get(self.destination_id)
-
         return {
             "id": self.id,
             "driver": driver,
@@ -131,6 +145,12 @@ class TripPassenger(db.Model):
     """
 
     __tablename__ = "trip_passenger"
+    __table_args__ = (
+        db.Index("ix_trip_passenger_trip_id_passenger_id_request_status",
+                 "trip_id", "passenger_id", "request_status"),
+        db.Index("ix_trip_passenger_passenger_id_request_status",
+                 "passenger_id", "request_status"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'), nullable=False)
@@ -169,15 +189,21 @@ class TripPassenger(db.Model):
         db.session.delete(self)
         db.session.commit()
 
-    def to_json(self):
-        passenger = User.query.get(self.passenger_id)
-        source = Location.query.get(self.source_id)
-        destination = Location.query.get(self.destination_id)
+    def to_json(self, preloaded=None):
+        if preloaded is None:
+            passenger = User.query.get(self.passenger_id)
+            source = Location.query.get(self.source_id)
+            destination = Location.query.get(self.destination_id)
+
+        else:
+            passenger = preloaded.users.get(self.passenger_id)
+            source = preloaded.locations.get(self.source_id)
+            destination = preloaded.locations.get(self.destination_id)
 
         return {
             "id": self.id,
             "trip_id": self.trip_id,
-            "passenger": passenger.to_json() if passenger else None,
+            "passenger": passenger.to_json(preloaded) if passenger else None,
             "origin": source.to_json() if source else None,
             "destination": destination.to_json() if destination else None,
             "seats_booked": self.seats_booked,
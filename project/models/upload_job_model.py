@@ -0,0 +1,85 @@
+import enum
+from datetime import datetime
+
+from project import db
+
+
+class JobStatus(enum.Enum):
+    """
+    JobStatus:
+        pending: 0
+        running: 1
+        done: 2
+        failed: 3
+    """
+    pending = 0
+    running = 1
+    done = 2
+    failed = 3
+
+
+class UploadJob(db.Model):
+    """
+    UploadJob:
+        id: string
+        status: enum
+        filename: string
+        content_type: string
+        keep_original: bool
+        path: string
+        image_url: string
+        original_url: string
+        error: text
+        finished_at: datetime
+        timestamp: datetime
+    """
+
+    __tablename__ = "upload_job"
+
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.Enum(JobStatus), nullable=False,
+                       default=JobStatus.pending)
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(128), nullable=True)
+    keep_original = db.Column(db.Boolean, nullable=False, default=False)
+    path = db.Column(db.String(255), nullable=True)
+    image_url = db.Column(db.String(255), nullable=True)
+    original_url = db.Column(db.String(255), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"UploadJob {self.id} {self.status}"
+
+    def __init__(self, id: str, filename: str, content_type: str,
+                 keep_original: bool, path: str):
+        self.id = id
+        self.filename = filename
+        self.content_type = content_type
+        self.keep_original = keep_original
+        self.path = path
+
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
+    def update(self):
+        self.timestamp = datetime.utcnow()
+        db.session.commit()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "status": self.status.name,
+            "filename": self.filename,
+            "image_url": self.image_url,
+            "original_url": self.original_url,
+            "error": self.error,
+            "finished_at": self.finished_at.strftime("%Y-%m-%d %H:%M:%S") if self.finished_at else None,
+            "timestamp": self.timestamp.strftime("%Y-%m-%d %H:%M:%S") if self.timestamp else None
+        }
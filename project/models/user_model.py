@@ -79,8 +79,12 @@ class User(db.Model):
         db.session.delete(self)
         db.session.commit()
 
-    def to_json(self):
-        location = Location.query.filter_by(id=self.location_id).first()
+    def to_json(self, preloaded=None):
+        if preloaded is None:
+            location = Location.query.filter_by(id=self.location_id).first()
+        else:
+            location = preloaded.locations.get(self.location_id)
+
         return {
             "id": self.id,
             "fullname": self.fullname,
@@ -189,6 +193,10 @@ class BlacklistToken(db.Model):
 
 class Location(db.Model):
     __tablename__ = "location"
+    __table_args__ = (
+        # place is TEXT, so MySQL needs a prefix length to index it
+        db.Index("ix_location_place", "place", mysql_length=255),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
@@ -230,7 +238,8 @@ class Vehicle(db.Model):
     __tablename__ = "vehicle"
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'user.id'), nullable=False, index=True)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     vehicle_no = db.Column(db.String(128), default="", nullable=False)
     vehicle_image = db.Column(db.String(128), default="", nullable=False)
@@ -280,7 +289,8 @@ class Licence(db.Model):
     __tablename__ = "licence"
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'user.id'), nullable=False, index=True)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     licence_no = db.Column(db.String(128), default="", nullable=False)
     licence_image_front = db.Column(db.String(128), default="", nullable=False)
@@ -0,0 +1,299 @@
+"""Synthetic datasets for benchmarks and load tests.
+
+Rows are generated with their primary keys assigned up front, from the
+current maximum id of each table, so related rows can reference each other
+without reading ids back, and are written with Core `executemany` inserts
+in batches. Every user shares one password hash computed once, instead of
+paying for bcrypt per user.
+"""
+import random
+from datetime import datetime, time, timedelta
+
+from project import db, bcrypt
+from project.models import (
+    User,
+    Role,
+    Gender,
+    Location,
+    Vehicle,
+    Licence,
+    Church,
+    Trip,
+    TripStatus,
+    TripPassenger,
+    RequestStatus,
+    Rating
+)
+
+PASSWORD = "greaterthaneight"
+
+
+def default_size(trips):
+    """Users, drivers, churches and ratings in proportion to trips"""
+    return {
+        "users": max(20, trips // 5),
+        "drivers": max(5, trips // 50),
+        "churches": max(5, min(500, trips // 200)),
+        "trips": trips,
+        "ratings": trips // 4
+    }
+
+
+class IdSequence:
+    """Primary keys following the largest id already in a table"""
+
+    def __init__(self, model):
+        self.next = (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+    def take(self):
+        value = self.next
+        self.next += 1
+        return value
+
+
+class BulkWriter:
+    """
+    Buffers rows per table, inserted with executemany once a table holds
+    batch_size rows. Every table is flushed then, in the order tables were
+    first added, so parents (locations, users) land before their children,
+    and committed
+    """
+
+    def __init__(self, batch_size, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.rows = {}
+        self.counts = {}
+
+    def add(self, model, row):
+        rows = self.rows.setdefault(model, [])
+        rows.append(row)
+
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for model, rows in self.rows.items():
+            if rows:
+                db.session.execute(model.__table__.insert(), rows)
+                self.counts[model.__tablename__] = \
+                    self.counts.get(model.__tablename__, 0) + len(rows)
+                self.rows[model] = []
+
+        # a transaction per batch, not one spanning a million rows
+        db.session.commit()
+
+        if self.progress:
+            self.progress(self.counts)
+
+    def close(self):
+        self.flush()
+        return self.counts
+
+
+# towns users, churches and trips cluster around, with their relative weight
+CLUSTERS = [
+    ("Manchester", 53.4808, -2.2426, 10),
+    ("Salford", 53.4875, -2.2901, 3),
+    ("Stockport", 53.4106, -2.1575, 3),
+    ("Oldham", 53.5409, -2.1114, 2),
+    ("Bolton", 53.5769, -2.4282, 3),
+    ("Liverpool", 53.4084, -2.9916, 8),
+    ("Leeds", 53.8008, -1.5491, 8),
+    ("Sheffield", 53.3811, -1.4701, 6),
+    ("Preston", 53.7632, -2.7031, 2),
+    ("Chester", 53.1934, -2.8931, 1),
+]
+
+
+class Geo:
+    """
+    Coordinates clustered around CLUSTERS: each point falls near a town
+    picked by weight, normally distributed about spread degrees around it
+    """
+
+    def __init__(self, rng, clusters=CLUSTERS, spread=0.03):
+        self.rng = rng
+        self.clusters = clusters
+        self.spread = spread
+        self.weights = [cluster[3] for cluster in clusters]
+
+    def pick(self):
+        """Index of a town, by weight"""
+        return self.rng.choices(range(len(self.clusters)), self.weights)[0]
+
+    def point(self, cluster):
+        _, latitude, longitude, _ = self.clusters[cluster]
+        return (round(self.rng.gauss(latitude, self.spread), 6),
+                round(self.rng.gauss(longitude, self.spread * 1.6), 6))
+
+
+def seed_dataset(users, drivers, churches, trips, ratings, batch_size=5000,
+                 rng_seed=0, geo=None, password_hash=None, progress=None):
+    """
+    Insert a dataset, returns (counts per table, bench accounts) where the
+    bench accounts are the mobile numbers of the first passenger and driver,
+    whose password is PASSWORD.
+
+    Users, drivers and churches belong to a town; a trip picks a town and
+    one of its drivers, goes to one of its churches and carries passengers
+    living there. progress(counts) is called after every batch
+    """
+    rng = random.Random(rng_seed)
+    geo = geo or Geo(rng)
+    now = datetime.utcnow()
+    today = now.date()
+
+    password_hash = password_hash or bcrypt.generate_password_hash(
+        PASSWORD, db.get_app().config.get("BCRYPT_LOG_ROUNDS")).decode()
+
+    location_ids = IdSequence(Location)
+    user_ids = IdSequence(User)
+    church_ids = IdSequence(Church)
+    trip_ids = IdSequence(Trip)
+    passenger_ids = IdSequence(TripPassenger)
+    writer = BulkWriter(batch_size, progress)
+
+    towns = range(len(geo.clusters))
+    passengers_by_town = {town: [] for town in towns}
+    drivers_by_town = {town: [] for town in towns}
+    churches_by_town = {town: [] for town in towns}
+
+    def location(place, town):
+        latitude, longitude = geo.point(town)
+        location_id = location_ids.take()
+        writer.add(Location, {
+            "id": location_id, "latitude": latitude, "longitude": longitude,
+            "place": place, "timestamp": now})
+        return location_id
+
+    def user(role, index, town):
+        user_id = user_ids.take()
+        writer.add(User, {
+            "id": user_id,
+            "fullname": "{} {}".format(role.name.capitalize(), user_id),
+            "mobile_no": "+44{:010d}".format(user_id),
+            "email": "{}{}@example.com".format(role.name, user_id),
+            "password": password_hash,
+            "dob": datetime(1960 + index % 45, 1 + index % 12, 1 + index % 28),
+            "gender": (Gender.male, Gender.female)[index % 2],
+            "address": "{} {}".format(user_id, geo.clusters[town][0]),
+            "location_id": location("Home {}".format(user_id), town),
+            "profile_picture": "",
+            "timestamp": now,
+            "active": True,
+            "email_verified": True,
+            "licence_verified": role == Role.driver,
+            "vehicle_verified": role == Role.driver,
+            "role": role
+        })
+        return user_id
+
+    passenger_list = []
+    for i in range(users):
+        town = geo.pick()
+        passenger_list.append(user(Role.user, i, town))
+        passengers_by_town[town].append(passenger_list[-1])
+
+    driver_list = []
+    for i in range(drivers):
+        town = geo.pick()
+        driver_list.append(user(Role.driver, i, town))
+        drivers_by_town[town].append(driver_list[-1])
+
+        writer.add(Vehicle, {
+            "user_id": driver_list[-1], "vehicle_no": "V{}".format(driver_list[-1]),
+            "vehicle_image": "", "vehicle_color": rng.choice(("white", "black", "silver", "blue")),
+            "vehicle_plate_image": "", "timestamp": now})
+        writer.add(Licence, {
+            "user_id": driver_list[-1], "licence_no": "L{}".format(driver_list[-1]),
+            "licence_image_front": "", "licence_image_back": "", "timestamp": now})
+
+    for i in range(churches):
+        # one church per town first, the rest by weight
+        town = i if i < len(towns) else geo.pick()
+        church_id = church_ids.take()
+        location_id = location("Church {}".format(church_id), town)
+        churches_by_town[town].append(location_id)
+        writer.add(Church, {
+            "id": church_id, "name": "Church {}".format(church_id),
+            "opening_time": time(8, 0), "closing_time": time(18, 0),
+            "address": "{} Church Street, {}".format(church_id, geo.clusters[town][0]),
+            "location_id": location_id, "contact_no": "+440{:09d}".format(church_id),
+            "image_url": "", "timestamp": now})
+
+    all_churches = [church for town in towns for church in churches_by_town[town]]
+
+    # trips over the past year and the next four weeks, past ones mostly done;
+    # ratings are a uniform sample of the completed bookings (reservoir)
+    rated, completed = [], 0
+    for _ in range(trips):
+        trip_id = trip_ids.take()
+        town = geo.pick()
+        day = today + timedelta(days=rng.randint(-365, 28))
+        if day >= today:
+            status = TripStatus.pending
+        else:
+            status = TripStatus.completed if rng.random() < 0.9 else TripStatus.cancelled
+
+        driver_id = rng.choice(drivers_by_town[town] or driver_list)
+        destination_id = rng.choice(churches_by_town[town] or all_churches)
+        seats = rng.randint(1, 4)
+        neighbours = passengers_by_town[town] or passenger_list
+
+        source_id = location("Pickup {}".format(trip_id), town)
+        departure = time(rng.choice((8, 9, 10, 11, 17, 18)), rng.choice((0, 15, 30, 45)))
+        carpool = rng.random() < 0.3
+
+        # one seat per booking and no more bookings than seats
+        bookings = []
+        for passenger_id in rng.sample(neighbours, min(rng.randint(0, 2), seats, len(neighbours))):
+            if status == TripStatus.pending:
+                request_status = rng.choice((RequestStatus.pending, RequestStatus.accepted))
+            else:
+                request_status = RequestStatus.accepted
+            bookings.append((passenger_id, request_status))
+
+        # accepting a request takes its seats off the trip, as the app does
+        accepted = sum(1 for _, request_status in bookings
+                       if request_status == RequestStatus.accepted)
+
+        writer.add(Trip, {
+            "id": trip_id, "driver_id": driver_id,
+            "source_id": source_id,
+            "destination_id": destination_id, "date": day,
+            "time": departure,
+            "status": status, "number_of_seats": seats - accepted,
+            "carpool": carpool, "timestamp": now})
+
+        for passenger_id, request_status in bookings:
+            writer.add(TripPassenger, {
+                "id": passenger_ids.take(), "trip_id": trip_id,
+                "passenger_id": passenger_id,
+                "source_id": location("Stop {}".format(trip_id), town),
+                "destination_id": destination_id, "seats_booked": 1,
+                "request_status": request_status, "timestamp": now})
+
+            if status == TripStatus.completed and request_status == RequestStatus.accepted:
+                completed += 1
+                booking = (trip_id, driver_id, passenger_id)
+
+                if len(rated) < ratings:
+                    rated.append(booking)
+                else:
+                    slot = rng.randrange(completed)
+                    if slot < ratings:
+                        rated[slot] = booking
+
+    for trip_id, driver_id, passenger_id in rated:
+        writer.add(Rating, {
+            "trip_id": trip_id, "driver_id": driver_id, "passenger_id": passenger_id,
+            "rating": rng.choice((3, 4, 4, 5, 5, 5)), "feedback": "", "timestamp": now})
+
+    counts = writer.close()
+
+    accounts = {
+        "passenger": "+44{:010d}".format(passenger_list[0]),
+        "driver": "+44{:010d}".format(driver_list[0])
+    }
+    return counts, accounts
@@ -0,0 +1,185 @@
+"""Latency, query count and peak memory of the hot endpoints per dataset size.
+
+For each scale the database is recreated and seeded with `seed_dataset`
+(users, drivers, churches and ratings in proportion to the trips), then
+every endpoint in ENDPOINTS is called through the Flask test client: once
+to warm up, `repeat` times timed while counting SQL statements, and once
+more under tracemalloc for the peak. Only run it against a throwaway
+database such as TestingConfig's in-memory sqlite.
+
+Results are written as JSON; passing the file of an earlier run as the
+baseline reports every endpoint whose statement count grew or whose median
+latency grew beyond a tolerance.
+"""
+import sys
+import json
+import time
+import logging
+import platform
+import statistics
+import tracemalloc
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from project import db
+from project.perf.dataset import PASSWORD, default_size, seed_dataset
+
+DEFAULT_SCALES = (1000, 10000, 100000)
+
+Endpoint = namedtuple("Endpoint", ["name", "method", "path", "account"])
+
+# account is whose token is sent, None for public endpoints
+ENDPOINTS = [
+    Endpoint("authenticate", "GET", "/users/auth/status", "passenger"),
+    Endpoint("auth.login", "POST", "/users/auth/login", None),
+    Endpoint("ride.get", "GET", "/ride/get", "passenger"),
+    Endpoint("trip.status", "GET", "/trip/status", "driver"),
+    Endpoint("trip.rides", "GET", "/trip/rides", "driver"),
+    Endpoint("church.list", "GET", "/church/list", "passenger"),
+    Endpoint("trip.list", "GET", "/trip/list", None),
+]
+
+
+class StatementCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(Engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, "before_cursor_execute", self)
+
+
+def login(client, mobile_no):
+    response = client.post("/users/auth/login", json={
+        "mobile_no": mobile_no, "password": PASSWORD})
+    return response.get_json()["data"]["auth_token"]
+
+
+def measure(client, endpoint, headers, body, repeat):
+    def call():
+        return client.open(endpoint.path, method=endpoint.method,
+                           headers=headers, json=body)
+
+    response = call()
+    timings = []
+
+    with StatementCounter() as counter:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "status": response.status_code,
+        "bytes": len(response.get_data()),
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "queries": counter.count // repeat,
+        "peak_kb": round(peak / 1024, 1)
+    }
+
+
+def run_endpoint_bench(app, scales=DEFAULT_SCALES, repeat=5, endpoints=None, report=print):
+    """Returns {"meta": ..., "results": {scale: {endpoint: measures}}}"""
+    results = {}
+    client = app.test_client()
+
+    # N+1 warnings would flood the output on the unpaginated endpoints
+    query_logger = logging.getLogger("project.services.query_stats")
+    level = query_logger.level
+    query_logger.setLevel(logging.ERROR)
+
+    try:
+        for trips in scales:
+            db.session.remove()
+            db.drop_all()
+            db.create_all()
+
+            start = time.perf_counter()
+            counts, accounts = seed_dataset(**default_size(trips))
+            report("seeded {} trips in {:.1f}s: {}".format(
+                trips, time.perf_counter() - start, counts))
+
+            tokens = {role: login(client, mobile_no) for role, mobile_no in accounts.items()}
+            scale_results = results[str(trips)] = {}
+
+            for endpoint in ENDPOINTS:
+                if endpoints and endpoint.name not in endpoints:
+                    continue
+
+                headers = {}
+                if endpoint.account:
+                    headers["Authorization"] = "Bearer " + tokens[endpoint.account]
+
+                body = None
+                if endpoint.method == "POST":
+                    body = {"mobile_no": accounts["passenger"], "password": PASSWORD}
+
+                scale_results[endpoint.name] = measure(
+                    client, endpoint, headers, body, repeat)
+                report("{:>8} {:<14} {}".format(
+                    trips, endpoint.name, scale_results[endpoint.name]))
+
+    finally:
+        query_logger.setLevel(level)
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": sys.platform,
+            "database": db.engine.dialect.name,
+            "repeat": repeat
+        },
+        "results": results
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Regressions against a baseline run, as (scale, endpoint, measure,
+    baseline value, value). Statement counts must not grow at all
+    """
+    regressions = []
+
+    for scale, endpoints in results["results"].items():
+        for name, measures in endpoints.items():
+            before = baseline.get("results", {}).get(scale, {}).get(name)
+            if not before:
+                continue
+
+            if measures["queries"] > before["queries"]:
+                regressions.append((scale, name, "queries", before["queries"], measures["queries"]))
+
+            if measures["median_ms"] > before["median_ms"] * (1 + tolerance):
+                regressions.append((scale, name, "median_ms", before["median_ms"], measures["median_ms"]))
+
+    return regressions
+
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
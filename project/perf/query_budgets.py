@@ -0,0 +1,529 @@
+"""Statement budgets of every route, checked on seeded datasets.
+
+Every view declares with `query_budget` the most SQL statements a request
+to it may run. The check seeds a small and a larger dataset, with more
+trips per driver, bookings per passenger, users and churches in the
+larger one, and calls every GET route as the busiest passenger and as the
+busiest driver while counting statements. A route fails when it runs more
+statements than its budget, or more on the larger dataset than on the
+small one: its query count grows with the number of rows. Routes without
+a budget fail as well.
+
+Every write route in WRITES is then called once per dataset, each call on
+a freshly seeded database so that it neither reads what an earlier write
+left behind nor changes what the next one reads. The call's own rows are
+prepared first, e.g. a pending ride to update or an issued OTP, picking
+the worst case where the route's statements depend on its payload. Write
+routes answering with a failed status are reported, as they were counted
+on their error path only, and a write route missing from WRITES fails.
+As in the query inspector, only the statements of the request's own
+thread are counted, not those of background workers. Only run it against a throwaway database such as TestingConfig's.
+"""
+import io
+import logging
+import tempfile
+import threading
+from collections import namedtuple
+from datetime import date, timedelta
+from itertools import cycle
+
+from PIL import Image
+
+from project import db
+from project.models import (
+    Role,
+    User,
+    Location,
+    Church,
+    Rating,
+    Trip,
+    TripStatus,
+    TripPassenger,
+    RequestStatus
+)
+from project.services import (
+    budget_of,
+    otp_service,
+    upload_service,
+    request_profiler,
+    memory_tracer
+)
+from project.api.trip import MAX_BULK_TRIPS
+from project.perf.dataset import PASSWORD, seed_dataset
+from project.perf.endpoint_bench import StatementCounter, login
+
+SIZES = (
+    {"users": 40, "drivers": 5, "churches": 10, "trips": 400, "ratings": 100},
+    {"users": 200, "drivers": 10, "churches": 40, "trips": 2000, "ratings": 500},
+)
+
+ACCOUNTS = ("passenger", "driver")
+
+# endpoints whose GET cannot be called with the bench tokens, and why
+EXCLUDED = {
+    "auth.logout": "blacklists the token it is called with",
+}
+
+# request(values) prepares the rows the call needs, may set the values of
+# its URL arguments and returns the keyword arguments of client.open
+WriteCall = namedtuple("WriteCall", ["endpoint", "method", "account", "request"])
+
+
+class RequestStatementCounter(StatementCounter):
+    """Statements of the calling thread only, as the query inspector counts"""
+
+    def __call__(self, *args):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+    def __enter__(self):
+        self.thread = threading.get_ident()
+        return super().__enter__()
+
+
+def busiest_accounts():
+    """
+    Mobile numbers of the driver with the most pending requests and of the
+    passenger with the most accepted rides, so that the routes have rows
+    to read for them at every size
+    """
+    driver = db.session.query(User.mobile_no).join(
+        Trip, Trip.driver_id == User.id
+    ).join(
+        TripPassenger, TripPassenger.trip_id == Trip.id
+    ).filter(
+        Trip.status == TripStatus.pending,
+        TripPassenger.request_status == RequestStatus.pending
+    ).group_by(User.id, User.mobile_no).order_by(
+        db.func.count(TripPassenger.id).desc()
+    ).first()
+
+    passenger = db.session.query(User.mobile_no).join(
+        TripPassenger, TripPassenger.passenger_id == User.id
+    ).filter(
+        TripPassenger.request_status == RequestStatus.accepted
+    ).group_by(User.id, User.mobile_no).order_by(
+        db.func.count(TripPassenger.id).desc()
+    ).first()
+
+    return {"passenger": passenger.mobile_no, "driver": driver.mobile_no}
+
+
+def url_values(accounts):
+    """Values for the URL arguments of the routes, from the seeded data"""
+    passenger = User.query.filter_by(mobile_no=accounts["passenger"]).first()
+    driver = User.query.filter_by(mobile_no=accounts["driver"]).first()
+
+    trip = Trip.query.filter_by(driver_id=driver.id).first() or Trip.query.first()
+    ride = TripPassenger.query.filter_by(
+        passenger_id=passenger.id, request_status=RequestStatus.accepted).first()
+    pending = TripPassenger.query.join(
+        Trip, Trip.id == TripPassenger.trip_id
+    ).filter(
+        Trip.driver_id == driver.id,
+        TripPassenger.request_status == RequestStatus.pending
+    ).first()
+
+    return {
+        "trip_id": trip.id,
+        "ride_id": ride.trip_id if ride else trip.id,
+        "request_id": pending.id if pending else 0,
+        "church_id": Church.query.first().id,
+        "user_id": passenger.id,
+        "driver_id": driver.id,
+        "name": "missing.prof",
+        "session_id": "missing",
+        "job_id": "missing"
+    }
+
+
+def write_values(accounts):
+    """
+    url_values, with the driver's pending trip with the most seats left as
+    trip_id, and the origin and destination of new trips and rides
+    """
+    values = url_values(accounts)
+    passenger = User.query.get(values["user_id"])
+    location = Location.query.get(passenger.location_id)
+
+    trip = Trip.query.filter_by(
+        driver_id=values["driver_id"], status=TripStatus.pending
+    ).order_by(Trip.number_of_seats.desc()).first()
+
+    if trip:
+        values["trip_id"] = trip.id
+
+    values["mobile_no"] = passenger.mobile_no
+    values["origin"] = {"latitude": location.latitude,
+                        "longitude": location.longitude, "place": location.place}
+    values["destination_id"] = Church.query.first().location_id
+    return values
+
+
+def open_trips(passenger_id, limit):
+    """Pending trips with seats left that the passenger has not booked"""
+    booked = db.session.query(TripPassenger.trip_id).filter_by(
+        passenger_id=passenger_id)
+
+    return Trip.query.filter(
+        Trip.status == TripStatus.pending,
+        Trip.number_of_seats > 0,
+        Trip.driver_id != passenger_id,
+        ~Trip.id.in_(booked)
+    ).order_by(Trip.id).limit(limit).all()
+
+
+def book(trip, passenger_ids):
+    """Pending one seat requests of the passengers on a trip, returns their ids"""
+    requests = [TripPassenger(trip.id, passenger_id, trip.source_id,
+                              trip.destination_id, 1)
+                for passenger_id in passenger_ids]
+    db.session.add_all(requests)
+    db.session.commit()
+    return [passenger_request.id for passenger_request in requests]
+
+
+def pending_requests(values, count):
+    """
+    Ids of count new pending requests on the driver's trip, booked by users
+    who had not requested it yet
+    """
+    trip = Trip.query.get(values["trip_id"])
+    booked = db.session.query(TripPassenger.passenger_id).filter_by(trip_id=trip.id)
+
+    passengers = db.session.query(User.id).filter(
+        User.role == Role.user, ~User.id.in_(booked)
+    ).order_by(User.id).limit(count).all()
+
+    return book(trip, [passenger_id for passenger_id, in passengers])
+
+
+def trip_payload(values):
+    return {
+        "origin": values["origin"],
+        "destination_id": values["destination_id"],
+        "date": (date.today() + timedelta(days=7)).isoformat(),
+        "time": "09:00:00",
+        "number_of_seats": 3,
+        "carpool": True
+    }
+
+
+def sample_image():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "white").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def church_request(values):
+    return {"json": {
+        "name": "Budget church",
+        "opening_time": "08:00:00",
+        "closing_time": "12:00:00",
+        "contact_no": "0000000000",
+        "address": "1 Budget street",
+        "location": values["origin"]
+    }}
+
+
+def bulk_trips_request(values):
+    payload = trip_payload(values)
+    del payload["date"]
+    payload["recurrence"] = {"weekday": "sunday", "weeks": MAX_BULK_TRIPS}
+    return {"json": payload}
+
+
+def trip_request_request(values):
+    values["request_id"], = pending_requests(values, 1)
+    return {"json": {"status": RequestStatus.accepted.name}}
+
+
+def bulk_requests_request(values):
+    # one UPDATE per status, accepted first so that it gets a seat
+    statuses = [RequestStatus.accepted.name] + [
+        status.name for status in RequestStatus if status != RequestStatus.accepted]
+    ids = pending_requests(values, len(statuses))
+
+    return {"json": {"requests": [
+        {"id": request_id, "status": status}
+        for request_id, status in zip(ids, cycle(statuses))]}}
+
+
+def ride_create_request(values):
+    trip, = open_trips(values["user_id"], 1)
+    return {"json": {"trip_id": trip.id, "origin": values["origin"],
+                     "seats_booked": 1}}
+
+
+def ride_update_request(values):
+    trip, = open_trips(values["user_id"], 1)
+    book(trip, [values["user_id"]])
+    values["ride_id"] = trip.id
+    return {"json": {"origin": values["origin"], "seats_booked": 1}}
+
+
+def rate_ride_request(values):
+    rated = db.session.query(Rating.trip_id).filter_by(passenger_id=values["user_id"])
+
+    ride = TripPassenger.query.join(
+        Trip, Trip.id == TripPassenger.trip_id
+    ).filter(
+        TripPassenger.passenger_id == values["user_id"],
+        TripPassenger.request_status == RequestStatus.accepted,
+        Trip.status == TripStatus.completed,
+        ~Trip.id.in_(rated)
+    ).first()
+
+    values["ride_id"] = ride.trip_id if ride else values["ride_id"]
+    return {"json": {"rating": 4, "comment": "On time"}}
+
+
+def as_admin(request):
+    """Make the passenger an admin before preparing the request"""
+    def admin_request(values):
+        User.query.get(values["user_id"]).is_admin = True
+        db.session.commit()
+        return request(values)
+    return admin_request
+
+
+def stop_trace_request(values):
+    memory_tracer.start()
+    return {}
+
+
+def email_otp_request(values):
+    User.query.get(values["user_id"]).email_verified = False
+    db.session.commit()
+    return {"json": {"otp": otp_service.issue(values["user_id"])}}
+
+
+def upload_chunk_request(values):
+    image = sample_image()
+    session = upload_service.open_session(
+        values["user_id"], "budget.png", "image/png", len(image))
+    values["session_id"] = session["id"]
+    return {"data": image, "query_string": {"offset": 0},
+            "content_type": "application/octet-stream"}
+
+
+def register_request(values):
+    return {"json": {
+        "fullname": "Budget User",
+        "email": "budget.user@example.com",
+        "mobile_no": "0000000001",
+        "password": "budget-password",
+        "role": Role.user.name,
+        "dob": "1990-01-01",
+        "gender": "male",
+        "address": "1 Budget street"
+    }}
+
+
+def static(payload):
+    return lambda values: {"json": payload}
+
+
+# every write route, in URL order; the DELETE of the memory trace follows
+# its POST so that tracing ends with the check
+WRITES = (
+    WriteCall("church.create_church", "POST", "passenger", church_request),
+    WriteCall("church.delete_church", "DELETE", "passenger", static(None)),
+    WriteCall("church.update_church", "PATCH", "passenger",
+              static({"address": "2 Budget street"})),
+    WriteCall("driver.delete_driver", "DELETE", "driver", static(None)),
+    WriteCall("driver.update_driver_info", "PATCH", "driver",
+              static({"fullname": "Budget Driver", "address": "3 Budget street"})),
+    WriteCall("driver.update_driver_licence", "PATCH", "driver",
+              static({"licence_no": "BUDGET-1"})),
+    WriteCall("driver.update_driver_location", "PATCH", "driver",
+              lambda values: {"json": values["origin"]}),
+    WriteCall("driver.update_driver_vehicle", "PATCH", "driver",
+              static({"vehicle_no": "BUDGET-2"})),
+    WriteCall("profiling.start_memory_trace", "POST", "passenger",
+              as_admin(static({"seconds": 60}))),
+    WriteCall("profiling.stop_memory_trace", "DELETE", "passenger",
+              as_admin(stop_trace_request)),
+    WriteCall("profiling.set_sampling", "PUT", "passenger",
+              as_admin(lambda values: {
+                  "json": {"percent": request_profiler.sample_percent}})),
+    WriteCall("ride.create", "POST", "passenger", ride_create_request),
+    WriteCall("ride.delete", "DELETE", "passenger", static(None)),
+    WriteCall("ride.rate_ride", "POST", "passenger", rate_ride_request),
+    WriteCall("ride.update", "PUT", "passenger", ride_update_request),
+    WriteCall("trip.create_trip", "POST", "driver",
+              lambda values: {"json": trip_payload(values)}),
+    WriteCall("trip.create_trips_bulk", "POST", "driver", bulk_trips_request),
+    WriteCall("trip.delete_trip", "DELETE", "driver", static(None)),
+    WriteCall("trip.trip_request", "PUT", "driver", trip_request_request),
+    WriteCall("trip.trip_requests_bulk", "PUT", "driver", bulk_requests_request),
+    WriteCall("trip.trip_status", "PUT", "driver",
+              static({"status": TripStatus.active.name})),
+    WriteCall("trip.update_trip", "PATCH", "driver",
+              lambda values: {"json": trip_payload(values)}),
+    WriteCall("upload.upload_image", "POST", "passenger",
+              lambda values: {"data": {"file": (io.BytesIO(sample_image()), "budget.png")}}),
+    WriteCall("upload.upload_images", "POST", "passenger",
+              lambda values: {"data": {
+                  "licence_image_front": (io.BytesIO(sample_image()), "front.png"),
+                  "licence_image_back": (io.BytesIO(sample_image()), "back.png")}}),
+    WriteCall("upload.create_upload_session", "POST", "passenger",
+              static({"filename": "budget.png", "content_type": "image/png",
+                      "size": 1024})),
+    WriteCall("upload.upload_session_chunk", "PUT", "passenger", upload_chunk_request),
+    WriteCall("auth.login", "POST", "passenger",
+              lambda values: {"json": {"mobile_no": values["mobile_no"],
+                                       "password": PASSWORD}}),
+    WriteCall("auth.register", "POST", "passenger", register_request),
+    WriteCall("user.delete_user", "DELETE", "passenger", static(None)),
+    WriteCall("user.email_otp", "PUT", "passenger", email_otp_request),
+    WriteCall("user.mobile_no_otp", "PUT", "passenger", static({"status": True})),
+    WriteCall("user.update_user_info", "PATCH", "passenger",
+              static({"fullname": "Budget User", "address": "4 Budget street"})),
+    WriteCall("user.update_user_location", "PATCH", "passenger",
+              lambda values: {"json": values["origin"]}),
+)
+
+
+def routes(app):
+    """(rule, view) of every route but static files, in URL order"""
+    return sorted(
+        ((rule, app.view_functions[rule.endpoint])
+         for rule in app.url_map.iter_rules() if rule.endpoint != "static"),
+        key=lambda route: (route[0].rule, route[0].endpoint))
+
+
+def write_routes(app):
+    """Endpoints of the routes taking another method than GET"""
+    return {rule.endpoint for rule in app.url_map.iter_rules()
+            if rule.methods - {"GET", "HEAD", "OPTIONS"}}
+
+
+def reseed(size):
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    seed_dataset(**size)
+
+
+def count_statements(client, path, headers):
+    """Statements of one call, after a first call warmed caches up"""
+    client.get(path, headers=headers)
+
+    with RequestStatementCounter() as counter:
+        client.get(path, headers=headers)
+
+    return counter.count
+
+
+def count_write(client, adapter, rule, call, size):
+    """Statements of one write call on a freshly seeded database, and its response"""
+    reseed(size)
+    accounts = busiest_accounts()
+    values = write_values(accounts)
+    headers = {"Authorization": "Bearer " + login(client, accounts[call.account])}
+
+    kwargs = call.request(values)
+    path = adapter.build(call.endpoint, {
+        argument: values[argument] for argument in rule.arguments}, method=call.method)
+
+    # the request must not find the prepared rows in the session
+    db.session.remove()
+
+    with RequestStatementCounter() as counter:
+        response = client.open(path, method=call.method, headers=headers, **kwargs)
+
+    return counter.count, response
+
+
+def check_query_budgets(app, sizes=SIZES, report=print):
+    """
+    Returns (counts, failures): counts is {endpoint: {"budget": budget,
+    "statements": [the most statements per size]}}, failures the list of
+    broken budgets, empty when every route holds its budget
+    """
+    failures = []
+    counts = {}
+    client = app.test_client()
+    adapter = app.url_map.bind("localhost")
+
+    rules = {}
+    for rule, view in routes(app):
+        rules.setdefault(rule.endpoint, rule)
+        if budget_of(view) is None:
+            failures.append("{} {}: no query budget declared".format(
+                rule.endpoint, rule.rule))
+
+    for endpoint in sorted(write_routes(app) - {call.endpoint for call in WRITES}):
+        failures.append("{}: write route missing from WRITES".format(endpoint))
+
+    # budget and N+1 warnings would repeat every failure below
+    query_logger = logging.getLogger("project.services.query_stats")
+    level = query_logger.level
+    query_logger.setLevel(logging.ERROR)
+
+    # the upload sessions opened by the write calls are thrown away with it
+    session_dir = app.config.get("UPLOAD_SESSION_DIR")
+    staging = tempfile.TemporaryDirectory()
+    app.config["UPLOAD_SESSION_DIR"] = staging.name
+
+    try:
+        for index, size in enumerate(sizes):
+            reseed(size)
+            accounts = busiest_accounts()
+            values = url_values(accounts)
+            headers = {role: {"Authorization": "Bearer " + login(client, mobile_no)}
+                       for role, mobile_no in accounts.items()}
+
+            for rule, view in routes(app):
+                if "GET" not in rule.methods or rule.endpoint in EXCLUDED:
+                    continue
+
+                path = adapter.build(rule.endpoint, {
+                    argument: values[argument] for argument in rule.arguments})
+
+                statements = max(count_statements(client, path, headers[account])
+                                 for account in ACCOUNTS)
+
+                route = counts.setdefault(rule.endpoint, {
+                    "budget": budget_of(view), "statements": []})
+                route["statements"].append(statements)
+
+            for call in WRITES:
+                rule = rules[call.endpoint]
+                statements, response = count_write(client, adapter, rule, call, size)
+
+                # GET and PUT routes keep the most of both
+                route = counts.setdefault(call.endpoint, {
+                    "budget": budget_of(app.view_functions[call.endpoint]),
+                    "statements": []})
+                if len(route["statements"]) > index:
+                    route["statements"][-1] = max(route["statements"][-1], statements)
+                else:
+                    route["statements"].append(statements)
+
+                body = response.get_json(silent=True) or {}
+                if body.get("status") is not True:
+                    message = str(body.get("message") or "").split("\n")[0]
+                    report("{} {} answered {} {}, counted on its error path".format(
+                        call.method, call.endpoint, response.status_code, message))
+
+            report("checked {} trips".format(size["trips"]))
+
+    finally:
+        query_logger.setLevel(level)
+        app.config["UPLOAD_SESSION_DIR"] = session_dir
+        staging.cleanup()
+
+    for endpoint, route in sorted(counts.items()):
+        statements, budget = route["statements"], route["budget"]
+
+        if budget is not None and max(statements) > budget:
+            failures.append("{}: {} statements, over its budget of {}".format(
+                endpoint, max(statements), budget))
+
+        if max(statements[1:], default=0) > statements[0]:
+            failures.append("{}: statements grow with the data, {}".format(
+                endpoint, " -> ".join(str(count) for count in statements)))
+
+    return counts, failures
@@ -0,0 +1,220 @@
+"""Query plan regression checks for the hot queries issued by the blueprints.
+
+The read queries are recorded rather than rebuilt: the database is seeded
+with `seed_dataset`, the busiest passenger and driver log in and call every
+GET route through the test client, and each distinct SELECT they run is
+executed again, with its recorded parameters, rewritten to EXPLAIN. A
+change to an endpoint's queries is therefore checked without touching this
+module. Routes that intentionally read a whole table (`/trip/list`,
+`/church/list`, ...) are listed in FULL_SCAN_ROUTES.
+
+Lookups of write routes cannot be recorded without changing the data the
+reads depend on, so WRITE_QUERIES copies them from the blueprints and has
+to be kept in sync by hand. Only run it against a throwaway database such
+as TestingConfig's.
+"""
+import re
+import logging
+from collections import namedtuple
+from datetime import datetime, time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from project import db
+from project.models import (
+    User,
+    Location,
+    Trip,
+    Rating
+)
+from project.services.slow_queries import EXPLAIN_PREFIXES, format_plan
+from project.perf.dataset import seed_dataset
+from project.perf.endpoint_bench import login
+from project.perf.query_budgets import (
+    SIZES,
+    ACCOUNTS,
+    EXCLUDED,
+    busiest_accounts,
+    url_values,
+    routes
+)
+
+HotQuery = namedtuple("HotQuery", ["name", "build"])
+
+SQLITE_FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)")
+
+# routes listing a whole table by design, their statements are not checked
+FULL_SCAN_ROUTES = {
+    "church.get_churches": "/church/list, every church",
+    "driver.get_all_drivers": "/drivers/list, every driver",
+    "ride.list_rides": "/ride/list, every trip passenger",
+    "trip.get_trips": "/trip/list, every trip",
+    "user.get_all_users": "/users/list, every passenger",
+}
+
+
+def _today():
+    return datetime.now().date()
+
+
+WRITE_QUERIES = [
+    HotQuery("auth.register: user by email", lambda: User.query.filter_by(
+        email="user@cabby.com")),
+    HotQuery("church.create: location by place", lambda: Location.query.filter_by(
+        place="St. Mary's Church")),
+    HotQuery("trip.create: date conflict", lambda: Trip.query.filter_by(
+        driver_id=1, date=_today(), time=time(9, 0))),
+    HotQuery("trip.update: date conflict", lambda: Trip.query.filter(
+        Trip.driver_id == 1, Trip.date == _today(), Trip.id != 1)),
+    HotQuery("ride.rate_ride: existing rating", lambda: Rating.query.filter_by(
+        trip_id=1, passenger_id=2, driver_id=1)),
+]
+
+
+class StatementRecorder:
+    """Collects the distinct SELECT statements run, with their parameters"""
+
+    def __init__(self):
+        self.endpoint = None
+        self.statements = {}
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            self.statements.setdefault(statement, (self.endpoint, parameters))
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Engine, "before_cursor_execute", self)
+
+
+def record_queries(app, size=SIZES[0]):
+    """
+    Seed the database and call every GET route as the busiest passenger
+    and driver, returns a list of (name, statement, parameters) of the
+    SELECTs they ran, named after the first route running each
+    """
+    client = app.test_client()
+    adapter = app.url_map.bind("localhost")
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+    seed_dataset(**size)
+    accounts = busiest_accounts()
+    values = url_values(accounts)
+
+    # budget and N+1 warnings are not what is checked here
+    query_logger = logging.getLogger("project.services.query_stats")
+    level = query_logger.level
+    query_logger.setLevel(logging.ERROR)
+
+    try:
+        with StatementRecorder() as recorder:
+            recorder.endpoint = "auth.login"
+            headers = {role: {"Authorization": "Bearer " + login(client, mobile_no)}
+                       for role, mobile_no in accounts.items()}
+
+            for rule, view in routes(app):
+                if "GET" not in rule.methods or rule.endpoint in EXCLUDED \
+                        or rule.endpoint in FULL_SCAN_ROUTES:
+                    continue
+
+                path = adapter.build(rule.endpoint, {
+                    argument: values[argument] for argument in rule.arguments})
+
+                recorder.endpoint = rule.endpoint
+                for account in ACCOUNTS:
+                    client.get(path, headers=headers[account])
+
+    finally:
+        query_logger.setLevel(level)
+
+    queries = []
+    numbers = {}
+    for statement, (endpoint, parameters) in recorder.statements.items():
+        numbers[endpoint] = numbers.get(endpoint, 0) + 1
+        queries.append(("{} #{}".format(endpoint, numbers[endpoint]),
+                        statement, parameters))
+
+    return queries
+
+
+def _explain(execute):
+    """Plan rows of the statement run by execute(connection), under EXPLAIN"""
+    engine = db.get_engine()
+    prefix = EXPLAIN_PREFIXES.get(engine.dialect.name)
+    if not prefix:
+        raise RuntimeError(
+            "EXPLAIN is not supported for {}".format(engine.dialect.name))
+
+    rows = []
+
+    def explain(conn, cursor, statement, parameters, context, executemany):
+        return prefix + statement, parameters
+
+    def fetch_plan(conn, cursor, statement, parameters, context, executemany):
+        rows.extend(dict(zip([col[0] for col in cursor.description], row))
+                    for row in cursor.fetchall())
+
+    with engine.connect() as connection:
+        event.listen(connection, "before_cursor_execute", explain, retval=True)
+        event.listen(connection, "after_cursor_execute", fetch_plan)
+        execute(connection).close()
+
+    return rows
+
+
+def capture_plan(query):
+    """
+    Run the given query with its statement prefixed by EXPLAIN and return
+    the plan rows
+    """
+    return _explain(lambda connection: connection.execute(query.statement))
+
+
+def capture_statement_plan(statement, parameters):
+    """Same for a recorded statement and its DBAPI parameters"""
+    return _explain(lambda connection: connection.exec_driver_sql(
+        statement, parameters))
+
+
+def full_scans(plan, dialect_name):
+    """Return the plan rows that read a whole table"""
+    if dialect_name == "sqlite":
+        return [row for row in plan if SQLITE_FULL_SCAN.match(row["detail"])]
+
+    if dialect_name == "mysql":
+        return [row for row in plan if row.get("type") == "ALL"]
+
+    return [row for row in plan if "Seq Scan" in row["QUERY PLAN"]]
+
+
+def check_query_plans(app, queries=None):
+    """
+    Capture the plan of every recorded read and of WRITE_QUERIES, returns
+    a list of (name, statement, plan lines, full scan lines)
+    """
+    dialect_name = db.get_engine().dialect.name
+    results = []
+
+    def add(name, statement, plan):
+        results.append((
+            name,
+            statement,
+            format_plan(plan, dialect_name),
+            format_plan(full_scans(plan, dialect_name), dialect_name)
+        ))
+
+    for name, statement, parameters in record_queries(app):
+        add(name, statement, capture_statement_plan(statement, parameters))
+
+    for hot_query in (queries or WRITE_QUERIES):
+        query = hot_query.build()
+        add(hot_query.name, str(query.statement), capture_plan(query))
+
+    return results
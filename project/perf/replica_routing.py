@@ -0,0 +1,128 @@
+"""Checks of the read replica routing against two separate databases.
+
+The primary and the replica are two databases that do not replicate on
+their own, e.g. two sqlite files set as DATABASE_TEST_URL and
+DATABASE_TEST_REPLICA_URL. `replicate` copies the primary over when the
+check wants the replica caught up; in between, the replica behaves like
+one lagging behind forever. Requests are sent through the test client
+while the statements run on each database are counted.
+
+Each worker process has its own sticky marks by default, so a request
+served by another worker is simulated by giving the router an empty store.
+Only run it against throwaway databases.
+"""
+from sqlalchemy import event, select
+
+from project import db
+from project.models import User, Role
+from project.routing import REPLICA, MemoryStickyStore
+from project.perf.dataset import seed_dataset
+from project.perf.endpoint_bench import login
+
+SIZE = {"users": 20, "drivers": 5, "churches": 5, "trips": 20, "ratings": 5}
+
+
+class EngineCounter:
+    """Statements run on the primary and on the replica"""
+
+    def __init__(self, app):
+        self.engines = {
+            "primary": db.get_engine(app),
+            "replica": db.get_engine(app, bind=REPLICA)
+        }
+        self.listeners = {name: self._count_on(name) for name in self.engines}
+        self.counts = {}
+
+    def _count_on(self, name):
+        def count(*args):
+            self.counts[name] += 1
+        return count
+
+    def __enter__(self):
+        self.counts = {name: 0 for name in self.engines}
+        for name, engine in self.engines.items():
+            event.listen(engine, "before_cursor_execute", self.listeners[name])
+        return self
+
+    def __exit__(self, *exc):
+        for name, engine in self.engines.items():
+            event.remove(engine, "before_cursor_execute", self.listeners[name])
+
+
+def replicate(app):
+    """Copy every table of the primary over the replica"""
+    primary = db.get_engine(app)
+    replica = db.get_engine(app, bind=REPLICA)
+
+    with primary.connect() as source, replica.begin() as target:
+        for table in reversed(db.metadata.sorted_tables):
+            target.execute(table.delete())
+
+        for table in db.metadata.sorted_tables:
+            rows = [dict(row._mapping) for row in source.execute(select(table))]
+            if rows:
+                target.execute(table.insert(), rows)
+
+
+def other_worker(app):
+    """Forget the sticky marks, as another worker process would not see them"""
+    app.extensions["replica_router"].store = MemoryStickyStore()
+
+
+def check_replica_routing(app, report=print):
+    """Returns the list of failed checks, empty when routing behaves"""
+    failures = []
+    client = app.test_client()
+
+    def expect(name, passed):
+        report("{} {}".format("ok" if passed else "FAILED", name))
+        if not passed:
+            failures.append(name)
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    db.metadata.drop_all(db.get_engine(app, bind=REPLICA))
+    db.metadata.create_all(db.get_engine(app, bind=REPLICA))
+
+    seed_dataset(**SIZE)
+    passenger, other = User.query.filter_by(role=Role.user).limit(2).all()
+    headers = {"Authorization": "Bearer " + login(client, passenger.mobile_no)}
+    other_headers = {"Authorization": "Bearer " + login(client, other.mobile_no)}
+    db.session.remove()
+    replicate(app)
+    other_worker(app)
+
+    with EngineCounter(app) as counter:
+        response = client.get("/users/auth/status", headers=headers)
+
+    expect("GET is served once the replica caught up",
+           response.status_code == 200)
+    # the blacklist and user lookups of authenticate, then the view's read
+    expect("authenticate reads from the primary", counter.counts["primary"] == 2)
+    expect("the view reads from the replica", counter.counts["replica"] == 1)
+
+    response = client.get("/users/auth/logout", headers=headers)
+    expect("logout succeeds", response.get_json()["status"] is True)
+
+    with EngineCounter(app) as counter:
+        response = client.get("/users/auth/status", headers=headers)
+
+    expect("the same worker keeps the user on the primary after a write",
+           counter.counts["replica"] == 0)
+
+    other_worker(app)
+    response = client.get("/users/auth/status", headers=headers)
+    expect("another worker refuses the logged out token while the replica lags",
+           response.status_code == 401)
+
+    with db.get_engine(app).begin() as connection:
+        connection.execute(User.__table__.update().where(
+            User.__table__.c.id == other.id).values(account_suspension=True))
+
+    response = client.get("/users/auth/status", headers=other_headers)
+    expect("a suspended account is refused while the replica lags",
+           response.status_code == 401)
+
+    db.session.remove()
+    return failures
@@ -0,0 +1,118 @@
+"""Peak memory of the image upload path, per upload size.
+
+`/upload/image` is driven through the Flask test client against a local
+HTTP sink standing in for the ImageKit upload API, and tracemalloc traces
+the whole round trip. Image normalization is turned off so only the
+transfer is measured. The previous implementation (save to disk, read the
+file back, base64 encode it and post the encoded string) is replayed against
+the same sink for comparison.
+"""
+import os
+import json
+import base64
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from project.services import upload_service, ImageKitStorage
+
+DEFAULT_SIZES_MB = (1, 4, 8)
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    """Reads and discards the request body, answers like the upload API"""
+
+    def do_POST(self):
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+
+        body = json.dumps({"url": "http://sink.local/uploaded"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_sink():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SinkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_payload(size):
+    payload = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False)
+    chunk = os.urandom(1024 * 1024)
+    while size > 0:
+        payload.write(chunk[:size])
+        size -= len(chunk)
+
+    payload.close()
+    return payload.name
+
+
+def _traced(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def streaming_upload(client, path):
+    def run():
+        with open(path, "rb") as f:
+            response = client.post(
+                "/upload/image", data={"file": (f, "bench.jpg", "image/jpeg")},
+                content_type="multipart/form-data")
+
+        assert response.json["status"], response.json
+
+    return _traced(run)
+
+
+def legacy_upload(url, path):
+    def run():
+        with open(path, "rb") as f:
+            encoded = base64.b64encode(f.read())
+
+        response = requests.post(
+            url, files={"file": (None, encoded), "fileName": (None, "bench.jpg")})
+        assert response.status_code == 200
+
+    return _traced(run)
+
+
+def run_upload_bench(app, sizes_mb=DEFAULT_SIZES_MB):
+    """Yield (size_mb, streaming_peak_bytes, legacy_peak_bytes) per size"""
+    sink = start_sink()
+    url = "http://127.0.0.1:{}/".format(sink.server_address[1])
+
+    previous = {key: app.config.get(key) for key in (
+        "MAX_CONTENT_LENGTH", "IMAGE_NORMALIZE")}
+    app.config.update(MAX_CONTENT_LENGTH=None, IMAGE_NORMALIZE=False)
+
+    storage = upload_service.storage
+    upload_service.storage = ImageKitStorage(private_key="bench", upload_url=url)
+
+    try:
+        client = app.test_client()
+        for size_mb in sizes_mb:
+            path = make_payload(int(size_mb * 1024 * 1024))
+            try:
+                yield (size_mb, streaming_upload(client, path),
+                       legacy_upload(url, path))
+            finally:
+                os.remove(path)
+    finally:
+        app.config.update(previous)
+        upload_service.storage = storage
+        sink.shutdown()
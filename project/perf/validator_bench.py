@@ -0,0 +1,69 @@
+"""Microbenchmark of payload validation, schemas vs the legacy validators.
+
+Validates the trip creation payload (with its nested origin) the way the
+handlers used to, with `field_type_validator` and `required_validator` on
+each level, and with the compiled `TRIP_SCHEMA`. Both a valid payload and
+one with errors are timed; the legacy path stops at the first error.
+"""
+import timeit
+
+from project.exceptions import APIError
+from project.api.validators import field_type_validator, required_validator
+from project.api.trip import TRIP_SCHEMA
+
+VALID = {
+    "origin": {"latitude": 31.5204, "longitude": "74.3587", "place": "Gulberg"},
+    "destination_id": 12, "date": "2030-01-01", "time": "09:30:00",
+    "number_of_seats": 3, "carpool": True
+}
+
+INVALID = {
+    "origin": {"latitude": "north"},
+    "destination_id": "12", "date": "2030-01-01", "number_of_seats": 3
+}
+
+
+def legacy(payload):
+    try:
+        field_types = {
+            "origin": dict, "destination_id": int, "date": str,
+            "time": str, "number_of_seats": int, "carpool": bool
+        }
+
+        required_fields = list(field_types.keys())
+        required_fields.remove('carpool')
+
+        post_data = field_type_validator(payload, field_types)
+        required_validator(post_data, required_fields)
+
+        field_types = {
+            "latitude": float, "longitude": float, "place": str
+        }
+
+        required_fields = list(field_types.keys())
+        required_fields.remove("place")
+
+        source = field_type_validator(post_data["origin"], field_types)
+        required_validator(source, required_fields)
+
+    except APIError:
+        pass
+
+
+def compiled(payload):
+    try:
+        TRIP_SCHEMA.validate(payload)
+    except APIError:
+        pass
+
+
+def run_validator_bench(number=100000):
+    """Yield (payload name, legacy us per call, schema us per call)"""
+    for name, payload in (("valid", VALID), ("invalid", INVALID)):
+        timings = []
+        for fn in (legacy, compiled):
+            seconds = min(timeit.repeat(
+                lambda: fn(payload), number=number, repeat=3))
+            timings.append(seconds / number * 1e6)
+
+        yield (name, *timings)
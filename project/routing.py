@@ -0,0 +1,156 @@
+"""Read replica routing for the Flask-SQLAlchemy session.
+
+When SQLALCHEMY_BINDS has a `replica` entry, statements issued while
+serving GET, HEAD and OPTIONS requests run against it, and everything else
+(other methods, flushes, bulk UPDATE/DELETE/INSERT, code running outside a
+request such as workers and commands) uses the primary.
+
+Replication lags, so a user who just wrote would not see the write on the
+next read. Requests that wrote mark their user as sticky for
+DB_REPLICA_STICKY_SECONDS, during which the user's reads stay on the
+primary. Marks live in DB_STICKY_STORE; the default is process memory, with
+several worker processes configure a shared implementation of StickyStore.
+
+Reads that must never lag, such as the token blacklist and the user lookups
+of `authenticate`, run inside `on_primary()`.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+from werkzeug.utils import import_string
+
+REPLICA = "replica"
+READ_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+
+class StickyStore:
+    """Backend interface, keys marked for ttl seconds"""
+
+    def mark(self, key, ttl):
+        raise NotImplementedError
+
+    def is_marked(self, key):
+        raise NotImplementedError
+
+
+class MemoryStickyStore(StickyStore):
+    """In-process store, expired marks are swept lazily"""
+
+    sweep_every = 1000
+
+    def __init__(self):
+        self._marks = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def mark(self, key, ttl):
+        with self._lock:
+            self._marks[key] = time.monotonic() + ttl
+
+            self._writes += 1
+            if self._writes % self.sweep_every == 0:
+                now = time.monotonic()
+                for k in [k for k, expiry in self._marks.items() if expiry <= now]:
+                    del self._marks[k]
+
+    def is_marked(self, key):
+        with self._lock:
+            return self._marks.get(key, 0) > time.monotonic()
+
+
+@contextmanager
+def on_primary():
+    """Reads issued in the block go to the primary, even in a GET request"""
+    if not has_request_context():
+        yield
+        return
+
+    read_only = g.get("db_read_only")
+    g.db_read_only = False
+    try:
+        yield
+    finally:
+        # a write in the block keeps the rest of the request on the primary
+        if not g.get("db_wrote"):
+            g.db_read_only = read_only
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the reads of read-only requests to the replica"""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            # this request writes, its later reads must see it
+            if has_request_context():
+                g.db_read_only = False
+                g.db_wrote = True
+
+        elif has_request_context() and g.get("db_read_only"):
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+
+        app.extensions["replica_router"] = ReplicaRouter(app)
+
+
+class ReplicaRouter:
+    """Decides per request whether reads may go to the replica"""
+
+    def __init__(self, app):
+        self.enabled = REPLICA in (app.config.get("SQLALCHEMY_BINDS") or {})
+        self.ttl = app.config.get("DB_REPLICA_STICKY_SECONDS")
+        self.store = import_string(app.config.get("DB_STICKY_STORE"))()
+
+        if self.enabled:
+            app.before_request(self.before_request)
+            app.after_request(self.after_request)
+            app.teardown_request(self.teardown_request)
+
+    def _user_key(self):
+        from project.models import User
+
+        try:
+            auth_token = request.headers.get("Authorization").split(" ")[1]
+        except (AttributeError, IndexError):
+            return None
+
+        user_id = User.decode_auth_token(auth_token)
+        if isinstance(user_id, str):
+            return None
+
+        return "db-sticky:{}".format(user_id)
+
+    def before_request(self):
+        if request.method not in READ_METHODS:
+            return
+
+        key = self._user_key()
+        g.db_read_only = not (key and self.store.is_marked(key))
+
+    def after_request(self, response):
+        if g.get("db_wrote"):
+            key = self._user_key()
+            if key:
+                self.store.mark(key, self.ttl)
+
+        return response
+
+    def teardown_request(self, exc):
+        # g outlives the request when an app context was already pushed,
+        # e.g. test client calls from a command
+        g.pop("db_read_only", None)
+        g.pop("db_wrote", None)
@@ -0,0 +1,35 @@
+from .preload import Preloaded
+from .trips import (
+    TripDetail,
+    load_trip_detail,
+    accepted_passenger_counts,
+    apply_request_statuses,
+    recurrence_dates,
+    create_trips
+)
+from .deletion import delete_trip, delete_account, purge_account, remove_account
+from .email_outbox import (
+    email_outbox,
+    TransportError,
+    EmailTransport,
+    SendGridTransport,
+    FileTransport,
+    MemoryTransport
+)
+from .otp import otp_service, OTPStore, MemoryOTPStore
+from .images import image_normalizer, normalize_image, NormalizedImage
+from .assets import hash_stream, upload_once, asset_stats, AssetStats, ORIGINAL
+from .storage import (
+    StorageBackend,
+    ImageKitStorage,
+    LocalStorage,
+    MemoryStorage
+)
+from .uploads import upload_service
+from .deliverability import deliverability_checker, DeliverabilityCache, dns_resolver
+from .db_pool import pool_monitor, TimedQueuePool, PoolStats
+from .query_stats import query_inspector, query_budget, budget_of, RequestQueries
+from .metrics import request_metrics, registry, external_call, Counter, Gauge, Histogram
+from .slow_queries import slow_query_log, explain, format_plan
+from .profiler import request_profiler
+from .memory import memory_tracer
@@ -0,0 +1,87 @@
+"""Content addressed deduplication of uploaded files.
+
+Uploads are keyed by the SHA-256 of the received payload together with the
+variant stored on the CDN (the raw file, or a given normalization profile),
+so a retried registration re-using the same photo gets the url of the first
+upload back without a second transfer.
+"""
+import hashlib
+import logging
+import threading
+
+from sqlalchemy.exc import IntegrityError
+
+from project import db
+from project.models import UploadedAsset
+
+logger = logging.getLogger(__name__)
+
+ORIGINAL = "original"
+
+
+def hash_stream(stream, chunk_size=64 * 1024):
+    """SHA-256 hex digest and size of a seekable stream, rewound afterwards"""
+    digest = hashlib.sha256()
+    size = 0
+
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+        size += len(chunk)
+
+    stream.seek(0)
+
+    return digest.hexdigest(), size
+
+
+class AssetStats:
+    """Process wide dedup hit and miss counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def to_json(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+asset_stats = AssetStats()
+
+
+def upload_once(digest, size, variant, upload):
+    """
+    Url of the asset stored for digest and variant, calling upload() (which
+    returns the url) only if this content was never uploaded before
+    """
+    asset = UploadedAsset.query.filter_by(digest=digest, variant=variant).first()
+    asset_stats.count(asset is not None)
+
+    if asset:
+        return asset.url
+
+    url = upload()
+
+    try:
+        UploadedAsset(digest=digest, variant=variant, url=url, size=size).insert()
+
+    except IntegrityError:
+        # a concurrent upload of the same content won the race, keep its url
+        db.session.rollback()
+        url = UploadedAsset.query.filter_by(
+            digest=digest, variant=variant).first().url
+
+    return url
@@ -0,0 +1,131 @@
+"""Database connection pool instrumentation.
+
+When SQLALCHEMY_ENGINE_OPTIONS configure a queue pool (`pool_size`), the
+engine uses `TimedQueuePool`, which times every checkout: the time spent
+waiting for a free connection, plus connecting when the pool opens a new
+one. Each request reports its total in the `X-DB-Pool-Wait` header (ms) and
+logs a warning past DB_POOL_SLOW_WAIT_MS; process wide totals are kept in
+`pool_monitor.stats` so pool_size / max_overflow can be tuned from data.
+
+Each worker process opens DB_POOL_WARMUP connections before serving its
+first request, so the first requests after a deploy do not pay for the
+connection handshakes. This runs per process, after any pre-fork.
+"""
+import time
+import logging
+import threading
+
+from flask import g, has_request_context
+from sqlalchemy.pool import QueuePool
+
+from project import db
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Process wide checkout counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def to_json(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_ms_total": round(self.wait_seconds * 1000, 3),
+                "wait_ms_max": round(self.max_wait_seconds * 1000, 3),
+                "wait_ms_avg": round(self.wait_seconds * 1000 / self.checkouts, 3)
+                if self.checkouts else None
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool reporting how long each checkout took"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_monitor.record(time.perf_counter() - start)
+
+
+class PoolMonitor:
+
+    def __init__(self):
+        self.stats = PoolStats()
+        self.slow_wait = None
+
+    def init_app(self, app):
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        if "pool_size" in options:
+            app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dict(
+                options, poolclass=TimedQueuePool)
+
+        self.slow_wait = app.config.get("DB_POOL_SLOW_WAIT_MS") / 1000
+        warmup = app.config.get("DB_POOL_WARMUP")
+
+        if warmup:
+            app.before_first_request(lambda: self.warm_up(warmup))
+
+        app.after_request(self.report)
+        app.extensions["pool_monitor"] = self
+
+    def record(self, seconds):
+        self.stats.record(seconds)
+
+        if has_request_context():
+            g.db_pool_wait = g.get("db_pool_wait", 0.0) + seconds
+
+    def warm_up(self, count):
+        """Open up to count pooled connections and return them idle"""
+        try:
+            connections = [db.engine.connect()
+                           for _ in range(min(count, db.engine.pool.size()))]
+            for connection in connections:
+                connection.close()
+
+            logger.info("Warmed up {} database connection(s)".format(
+                len(connections)))
+
+        except Exception as e:
+            logger.error("Database pool warm up failed: {}".format(e))
+
+    def report(self, response):
+        wait = g.get("db_pool_wait")
+        if wait is None:
+            return response
+
+        response.headers["X-DB-Pool-Wait"] = "{:.3f}".format(wait * 1000)
+
+        if wait > self.slow_wait:
+            logger.warning("Waited {:.1f}ms for database connections".format(
+                wait * 1000))
+
+        return response
+
+    def pool_status(self):
+        """Current occupancy of the pool, when it is a queue pool"""
+        pool = db.engine.pool
+        if not isinstance(pool, QueuePool):
+            return None
+
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "idle": pool.checkedin()
+        }
+
+
+pool_monitor = PoolMonitor()
@@ -0,0 +1,187 @@
+"""Set-based removal of users, drivers and trips with everything hanging off them.
+
+Dependent rows are deleted with `DELETE ... WHERE ... IN (subquery)` in
+foreign key order. Per-ride locations (trip and ride request sources, the
+user's own location) are collected first and dropped last, skipping any
+location something else still points at (church locations, destinations).
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import or_
+
+from project import db
+from project.models import (
+    User,
+    Location,
+    Vehicle,
+    Licence,
+    Trip,
+    TripPassenger,
+    Church,
+    Rating
+)
+
+logger = logging.getLogger(__name__)
+
+purge_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="purge")
+
+
+def _ids(query):
+    return [row[0] for row in query.all()]
+
+
+def _chunks(query, chunk_size):
+    """Yield id chunks of a query whose rows are deleted chunk by chunk"""
+    while True:
+        ids = _ids(query.limit(chunk_size))
+        if not ids:
+            break
+
+        yield ids
+
+
+def _delete_locations(location_ids):
+    location_ids = set(location_ids) - {None}
+    if not location_ids:
+        return
+
+    Location.query.filter(
+        Location.id.in_(location_ids),
+        ~Location.id.in_(db.session.query(Trip.source_id)),
+        ~Location.id.in_(db.session.query(Trip.destination_id)),
+        ~Location.id.in_(db.session.query(TripPassenger.source_id)),
+        ~Location.id.in_(db.session.query(TripPassenger.destination_id)),
+        ~Location.id.in_(db.session.query(Church.location_id).filter(
+            Church.location_id.isnot(None))),
+        ~Location.id.in_(db.session.query(User.location_id).filter(
+            User.location_id.isnot(None)))
+    ).delete(synchronize_session=False)
+
+
+def _delete_rides(*criteria):
+    """Delete ride requests matching criteria, returns their location ids"""
+    location_ids = _ids(
+        db.session.query(TripPassenger.source_id).filter(*criteria))
+
+    TripPassenger.query.filter(*criteria).delete(synchronize_session=False)
+
+    return location_ids
+
+
+def _delete_trips(*criteria):
+    """
+    Delete trips matching criteria with their ride requests and ratings,
+    returns the location ids left to drop
+    """
+    trip_ids = db.session.query(Trip.id).filter(*criteria)
+
+    location_ids = _ids(db.session.query(Trip.source_id).filter(*criteria))
+    location_ids += _delete_rides(TripPassenger.trip_id.in_(trip_ids))
+
+    Rating.query.filter(Rating.trip_id.in_(trip_ids)).delete(
+        synchronize_session=False)
+    Trip.query.filter(*criteria).delete(synchronize_session=False)
+
+    return location_ids
+
+
+def delete_trip(trip):
+    """Delete a trip, its ride requests, ratings and their locations"""
+    _delete_locations(_delete_trips(Trip.id == trip.id))
+    db.session.commit()
+
+
+def account_size(user_id):
+    """Number of trips and rides an account owns, to decide how to delete it"""
+    trips = db.session.query(db.func.count(Trip.id)).filter(
+        Trip.driver_id == user_id)
+    rides = db.session.query(db.func.count(TripPassenger.id)).filter(
+        TripPassenger.passenger_id == user_id)
+
+    return db.session.query(
+        trips.scalar_subquery() + rides.scalar_subquery()).scalar()
+
+
+def delete_account(user):
+    """
+    Delete a user with their trips, rides, ratings, vehicle, licence and
+    locations in one transaction
+    """
+    location_ids = [user.location_id]
+    location_ids += _delete_trips(Trip.driver_id == user.id)
+    location_ids += _delete_rides(TripPassenger.passenger_id == user.id)
+
+    Rating.query.filter(or_(
+        Rating.passenger_id == user.id,
+        Rating.driver_id == user.id
+    )).delete(synchronize_session=False)
+
+    Vehicle.query.filter_by(user_id=user.id).delete(synchronize_session=False)
+    Licence.query.filter_by(user_id=user.id).delete(synchronize_session=False)
+    User.query.filter_by(id=user.id).delete(synchronize_session=False)
+
+    _delete_locations(location_ids)
+    db.session.commit()
+
+
+def purge_account(user_id, chunk_size):
+    """
+    Delete a large account chunk by chunk, committing after each chunk so no
+    transaction holds locks for long, then drop what is left at once
+    """
+    trips = db.session.query(Trip.id).filter(Trip.driver_id == user_id)
+    for trip_ids in _chunks(trips, chunk_size):
+        _delete_locations(_delete_trips(Trip.id.in_(trip_ids)))
+        db.session.commit()
+
+    rides = db.session.query(TripPassenger.id).filter(
+        TripPassenger.passenger_id == user_id)
+    for ride_ids in _chunks(rides, chunk_size):
+        _delete_locations(_delete_rides(TripPassenger.id.in_(ride_ids)))
+        db.session.commit()
+
+    ratings = db.session.query(Rating.id).filter(or_(
+        Rating.passenger_id == user_id,
+        Rating.driver_id == user_id
+    ))
+    for rating_ids in _chunks(ratings, chunk_size):
+        Rating.query.filter(Rating.id.in_(rating_ids)).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+    user = User.query.get(user_id)
+    if user:
+        delete_account(user)
+
+    logger.info("Purged account {}".format(user_id))
+
+
+def _purge_in_background(app, user_id):
+    with app.app_context():
+        try:
+            purge_account(user_id, app.config.get("PURGE_CHUNK_SIZE"))
+
+        except Exception as e:
+            db.session.rollback()
+            logger.exception(e)
+
+
+def remove_account(user):
+    """
+    Delete an account right away, or for very large accounts lock it and
+    leave the purge to a background worker. Returns True if deleted inline
+    """
+    if account_size(user.id) <= current_app.config.get("PURGE_INLINE_LIMIT"):
+        delete_account(user)
+        return True
+
+    user.active = False
+    user.account_suspension = True
+    user.update()
+
+    purge_executor.submit(
+        _purge_in_background, current_app._get_current_object(), user.id)
+
+    return False
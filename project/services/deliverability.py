@@ -0,0 +1,126 @@
+"""Email deliverability checks cached per domain.
+
+Checking deliverability means MX (then A/AAAA and SPF) lookups on the
+request thread, and most sign-ups share a handful of domains. Results are
+kept per domain in an LRU with a TTL, undeliverable domains included for a
+shorter time; lookups that time out are not cached. The resolver is any
+callable `(domain, domain_i18n)` returning normally for deliverable domains
+and raising EmailUndeliverableError otherwise, set with
+DELIVERABILITY_RESOLVER, so tests can use a local stub instead of DNS.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+from email_validator import (
+    validate_email,
+    validate_email_deliverability,
+    EmailUndeliverableError
+)
+from werkzeug.utils import import_string
+
+
+def dns_resolver(domain, domain_i18n):
+    """Default resolver, DNS lookups through email_validator"""
+    info = validate_email_deliverability(domain, domain_i18n)
+    return info.get("unknown-deliverability") is None
+
+
+class DeliverabilityCache:
+    """
+    Thread safe LRU of domain -> (expires_at, error) where error is None
+    for deliverable domains
+    """
+
+    def __init__(self, max_size, ttl, negative_ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, domain):
+        """Returns (found, error)"""
+        with self._lock:
+            entry = self._entries.get(domain)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(domain)
+                self.hits += 1
+                return True, entry[1]
+
+            if entry:
+                del self._entries[domain]
+
+            self.misses += 1
+            return False, None
+
+    def put(self, domain, error=None):
+        ttl = self.ttl if error is None else self.negative_ttl
+
+        with self._lock:
+            self._entries[domain] = (time.monotonic() + ttl, error)
+            self._entries.move_to_end(domain)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def to_json(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "size": len(self._entries)
+            }
+
+
+class DeliverabilityChecker:
+    """Validates email syntax, and deliverability when CHECK_DELIVERABILITY is set"""
+
+    def __init__(self):
+        self.enabled = False
+        self.resolver = None
+        self.cache = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get("CHECK_DELIVERABILITY")
+        self.resolver = import_string(app.config.get("DELIVERABILITY_RESOLVER"))
+        self.cache = DeliverabilityCache(
+            max_size=app.config.get("DELIVERABILITY_CACHE_SIZE"),
+            ttl=app.config.get("DELIVERABILITY_TTL_SECONDS"),
+            negative_ttl=app.config.get("DELIVERABILITY_NEGATIVE_TTL_SECONDS"))
+        app.extensions["deliverability_checker"] = self
+
+    def validate(self, email):
+        """
+        Returns the normalized email, raises the email_validator errors
+        (EmailSyntaxError, EmailUndeliverableError)
+        """
+        valid = validate_email(email, check_deliverability=False)
+
+        if self.enabled:
+            self.check_domain(valid.ascii_domain, valid.domain)
+
+        return valid.email
+
+    def check_domain(self, domain, domain_i18n=None):
+        found, error = self.cache.get(domain)
+
+        if not found:
+            try:
+                # False means unknown (e.g. a DNS timeout), not cached
+                if self.resolver(domain, domain_i18n or domain) is not False:
+                    self.cache.put(domain)
+
+            except EmailUndeliverableError as e:
+                error = str(e)
+                self.cache.put(domain, error)
+
+        if error:
+            raise EmailUndeliverableError(error)
+
+
+deliverability_checker = DeliverabilityChecker()
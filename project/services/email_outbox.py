@@ -0,0 +1,350 @@
+"""Durable outbox for outgoing emails.
+
+Request handlers only write an `email_outbox` row; a pool of background
+workers claims due rows, hands them to the configured transport in batches
+and retries failures with exponential backoff. Claimed rows are leased
+(`next_attempt_at` is pushed forward) so rows held by a crashed worker are
+picked up again once the lease runs out. On MySQL 8 / PostgreSQL claims use
+SKIP LOCKED, so several worker processes can share the outbox; SQLite has
+no row locks, so run a single worker there.
+
+Bodies carry one time PINs: a row's html_content is cleared as soon as it
+is sent or has failed for good, and sent rows are deleted by the workers
+EMAIL_OUTBOX_KEEP_DAYS after sending.
+"""
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from itertools import groupby
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from project import db
+from project.models import EmailOutbox, EmailStatus
+from project.services.metrics import external_call
+
+logger = logging.getLogger(__name__)
+
+
+class TransportError(Exception):
+    """
+    retryable: the same batch may go through later. split: the batch was
+    refused as a whole, smaller batches may let the valid messages through
+    """
+    def __init__(self, message, retryable=True, split=False):
+        super().__init__(message)
+        self.retryable = retryable
+        self.split = split
+
+
+class EmailTransport:
+    """
+    Delivers a batch of messages sharing the same subject, each message
+    being a dict with id, recipient, subject and html_content. Raises
+    TransportError if the batch was not accepted
+    """
+    max_batch = 1
+
+    def send(self, messages):
+        raise NotImplementedError
+
+
+class SendGridTransport(EmailTransport):
+    """
+    SendGrid v3 mail send over a pooled keep-alive session. A batch goes out
+    as one request with a personalization per recipient, each carrying its
+    own html body as a substitution
+    """
+    url = "https://api.sendgrid.com/v3/mail/send"
+    max_batch = 500
+    placeholder = "-html_content-"
+
+    def __init__(self, api_key, sender, pool_size=4, timeout=10):
+        self.sender = sender
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({
+            "Authorization": "Bearer {}".format(api_key),
+            "Content-Type": "application/json"
+        })
+
+    def send(self, messages):
+        payload = {
+            "from": {"email": self.sender},
+            "subject": messages[0]["subject"],
+            "content": [{"type": "text/html", "value": self.placeholder}],
+            "personalizations": [{
+                "to": [{"email": message["recipient"]}],
+                "substitutions": {self.placeholder: message["html_content"]}
+            } for message in messages]
+        }
+
+        try:
+            with external_call("sendgrid"):
+                response = self.session.post(
+                    self.url, data=json.dumps(payload), timeout=self.timeout)
+        except requests.RequestException as e:
+            raise TransportError("SendGrid request failed: {}".format(e))
+
+        if response.status_code >= 300:
+            # one invalid personalization gets the whole request a 400
+            raise TransportError(
+                "SendGrid responded {}: {}".format(
+                    response.status_code, response.text[:500]),
+                retryable=response.status_code == 429 or response.status_code >= 500,
+                split=response.status_code in (400, 413))
+
+
+class FileTransport(EmailTransport):
+    """Writes every message as a json file, for local development"""
+    max_batch = 100
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, messages):
+        for message in messages:
+            path = os.path.join(self.directory, "{}.json".format(message["id"]))
+            with open(path, "w") as f:
+                json.dump(message, f)
+
+
+class MemoryTransport(EmailTransport):
+    """Keeps sent messages in memory, for tests and benchmarks"""
+    max_batch = 100
+
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        with self._lock:
+            self.sent.extend(messages)
+
+
+def make_transport(config):
+    transport = config.get("EMAIL_TRANSPORT")
+
+    if transport == "sendgrid":
+        return SendGridTransport(
+            api_key=config.get("SENDGRID_API_KEY"),
+            sender=config.get("EMAIL_SENDER"),
+            pool_size=max(config.get("EMAIL_OUTBOX_WORKERS"), 1)
+        )
+
+    if transport == "file":
+        return FileTransport(config.get("EMAIL_FILE_DIR"))
+
+    if transport == "memory":
+        return MemoryTransport()
+
+    raise ValueError("Unknown EMAIL_TRANSPORT {}".format(transport))
+
+
+class Outbox:
+    """Writes emails to the outbox table and runs the workers draining it"""
+
+    def __init__(self):
+        self.app = None
+        self.transport = None
+        self._workers = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._pruned_at = None
+
+    def init_app(self, app):
+        self.app = app
+        self.transport = make_transport(app.config)
+        app.extensions["email_outbox"] = self
+
+    def enqueue(self, recipient, subject, html_content):
+        """Persist an email and wake the workers, returns the outbox id"""
+        message = EmailOutbox(
+            recipient=recipient, subject=subject, html_content=html_content)
+
+        db.session.add(message)
+        db.session.flush()
+        message_id = message.id
+        db.session.commit()
+
+        self.start()
+        self._wakeup.set()
+
+        return message_id
+
+    def start(self):
+        """Start the in-process worker pool, once"""
+        with self._lock:
+            if self._workers:
+                return
+
+            for index in range(self.app.config.get("EMAIL_OUTBOX_WORKERS")):
+                worker = threading.Thread(
+                    target=self.run, name="email-outbox-{}".format(index),
+                    daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+        for worker in self._workers:
+            worker.join()
+
+        self._workers = []
+        self._stopping.clear()
+
+    def run(self):
+        """Drain the outbox until stopped, sleeping while nothing is due"""
+        poll_seconds = self.app.config.get("EMAIL_OUTBOX_POLL_SECONDS")
+
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    self.prune_if_due()
+                    processed = self.process_batch()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.exception(e)
+                    processed = 0
+
+            if not processed:
+                self._wakeup.wait(poll_seconds)
+                self._wakeup.clear()
+
+    def prune_if_due(self):
+        """Prune once per EMAIL_OUTBOX_PRUNE_SECONDS, whichever worker comes first"""
+        now = datetime.utcnow()
+        every = timedelta(seconds=self.app.config.get("EMAIL_OUTBOX_PRUNE_SECONDS"))
+
+        with self._lock:
+            if self._pruned_at and now - self._pruned_at < every:
+                return
+
+            self._pruned_at = now
+
+        self.prune()
+
+    def prune(self, keep_days=None):
+        """Delete messages sent more than keep_days ago, returns how many"""
+        if keep_days is None:
+            keep_days = self.app.config.get("EMAIL_OUTBOX_KEEP_DAYS")
+
+        deleted = EmailOutbox.query.filter(
+            EmailOutbox.status == EmailStatus.sent,
+            EmailOutbox.sent_at < datetime.utcnow() - timedelta(days=keep_days)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+        if deleted:
+            logger.info("Pruned {} sent emails".format(deleted))
+
+        return deleted
+
+    def claim(self, limit):
+        """Lease up to limit due messages, returns them as plain dicts"""
+        now = datetime.utcnow()
+        lease = timedelta(seconds=self.app.config.get("EMAIL_OUTBOX_LEASE_SECONDS"))
+
+        rows = EmailOutbox.query.filter(
+            EmailOutbox.status.in_([EmailStatus.pending, EmailStatus.sending]),
+            EmailOutbox.next_attempt_at <= now
+        ).order_by(
+            EmailOutbox.next_attempt_at.asc()
+        ).limit(limit).with_for_update(skip_locked=True).all()
+
+        messages = []
+        for row in rows:
+            row.status = EmailStatus.sending
+            row.attempts += 1
+            row.next_attempt_at = now + lease
+
+            messages.append({
+                "id": row.id,
+                "recipient": row.recipient,
+                "subject": row.subject,
+                "html_content": row.html_content,
+                "attempts": row.attempts
+            })
+
+        db.session.commit()
+
+        return messages
+
+    def process_batch(self):
+        """Claim and deliver one batch, returns the number of messages claimed"""
+        messages = self.claim(min(
+            self.app.config.get("EMAIL_OUTBOX_BATCH_SIZE"),
+            self.transport.max_batch))
+
+        messages.sort(key=lambda message: message["subject"])
+
+        for _, group in groupby(messages, key=lambda message: message["subject"]):
+            self._deliver(list(group))
+
+        return len(messages)
+
+    def _deliver(self, messages):
+        """
+        Send messages sharing a subject. A batch refused as a whole is split
+        in halves until the messages at fault are alone, so only they fail
+        """
+        try:
+            self.transport.send(messages)
+            self._mark_sent(messages)
+
+        except TransportError as e:
+            if e.split and len(messages) > 1:
+                middle = len(messages) // 2
+                self._deliver(messages[:middle])
+                self._deliver(messages[middle:])
+                return
+
+            logger.warning("Email batch failed: {}".format(e))
+            self._schedule_retry(messages, str(e), e.retryable)
+
+        db.session.commit()
+
+    def _mark_sent(self, messages):
+        EmailOutbox.query.filter(
+            EmailOutbox.id.in_([message["id"] for message in messages])
+        ).update({
+            "status": EmailStatus.sent,
+            "sent_at": datetime.utcnow(),
+            "html_content": "",
+            "last_error": None
+        }, synchronize_session=False)
+
+    def _schedule_retry(self, messages, error, retryable):
+        max_attempts = self.app.config.get("EMAIL_OUTBOX_MAX_ATTEMPTS")
+        retry_seconds = self.app.config.get("EMAIL_OUTBOX_RETRY_SECONDS")
+
+        by_attempts = {}
+        for message in messages:
+            by_attempts.setdefault(message["attempts"], []).append(message["id"])
+
+        for attempts, ids in by_attempts.items():
+            if not retryable or attempts >= max_attempts:
+                values = {"status": EmailStatus.failed, "html_content": ""}
+            else:
+                values = {
+                    "status": EmailStatus.pending,
+                    "next_attempt_at": datetime.utcnow() + timedelta(
+                        seconds=retry_seconds * 2 ** (attempts - 1))
+                }
+
+            values["last_error"] = error
+            EmailOutbox.query.filter(EmailOutbox.id.in_(ids)).update(
+                values, synchronize_session=False)
+
+
+email_outbox = Outbox()
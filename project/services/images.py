@@ -0,0 +1,146 @@
+"""Normalization of uploaded photos before they reach the CDN.
+
+Phone photos are decoded, rotated according to their EXIF orientation,
+scaled down to IMAGE_MAX_DIMENSION, stripped of metadata and re-encoded as
+IMAGE_FORMAT. Decoding and encoding are CPU bound and hold the GIL, so they
+run in a process pool started on first use; workers are spawned rather than
+forked since the app process already runs background threads.
+"""
+import io
+import logging
+import threading
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from project.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+NormalizedImage = namedtuple(
+    "NormalizedImage", ["data", "width", "height", "format", "content_type"])
+
+CONTENT_TYPES = {
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+    "PNG": "image/png"
+}
+
+# refuse decompression bombs instead of only warning about them
+Image.MAX_IMAGE_PIXELS = 50 * 1000 * 1000
+
+
+def normalize_image(data, max_dimension, image_format, quality):
+    """
+    Decode, orient, downscale and re-encode an image without its metadata.
+    Runs in a worker process, so only takes and returns plain values
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ValueError("Invalid image file: {}".format(type(e).__name__))
+
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (
+        image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha and image_format != "JPEG" else "RGB")
+
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+    options = {"quality": quality}
+    if image_format == "WEBP":
+        options["method"] = 4
+    else:
+        options["optimize"] = True
+
+    output = io.BytesIO()
+    image.save(output, format=image_format, **options)
+
+    return NormalizedImage(
+        output.getvalue(), image.width, image.height,
+        image_format, CONTENT_TYPES[image_format])
+
+
+class ImageNormalizer:
+    """Runs `normalize_image` in a lazily started process pool"""
+
+    def __init__(self):
+        self.config = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.config = app.config
+        app.extensions["image_normalizer"] = self
+
+    @property
+    def enabled(self):
+        return self.config.get("IMAGE_NORMALIZE")
+
+    @property
+    def variant(self):
+        """Identifies the output of the current settings, for deduplication"""
+        return "{}-{}-{}".format(
+            self.config.get("IMAGE_FORMAT").lower(),
+            self.config.get("IMAGE_MAX_DIMENSION"),
+            self.config.get("IMAGE_QUALITY"))
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.config.get("IMAGE_WORKERS"),
+                    mp_context=multiprocessing.get_context("spawn"))
+
+            return self._executor
+
+    def _discard(self, executor):
+        """Drop a broken pool, the next upload starts a new one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+        executor.shutdown(wait=False)
+
+    def normalize(self, stream):
+        """
+        Normalize an uploaded image stream, raises APIError if undecodable,
+        too slow to process or if a worker died on it
+        """
+        executor = self._pool()
+
+        try:
+            future = executor.submit(
+                normalize_image,
+                stream.read(),
+                self.config.get("IMAGE_MAX_DIMENSION"),
+                self.config.get("IMAGE_FORMAT"),
+                self.config.get("IMAGE_QUALITY"))
+
+            return future.result(timeout=self.config.get("IMAGE_TIMEOUT_SECONDS"))
+
+        except ValueError as e:
+            raise APIError(str(e))
+
+        except TimeoutError:
+            future.cancel()
+            logger.warning("Image normalization timed out")
+            raise APIError("Image took too long to process")
+
+        except BrokenProcessPool:
+            # a worker was killed, e.g. out of memory on a huge image
+            logger.error("Image worker died, restarting the pool")
+            self._discard(executor)
+            raise APIError("Image could not be processed, please retry")
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+image_normalizer = ImageNormalizer()
@@ -0,0 +1,170 @@
+"""tracemalloc snapshots for finding memory hungry endpoints.
+
+An admin adds `__memory=1` to a request to get, instead of its body, the
+allocation sites that grew while it was served and its peak traced memory.
+A trace window (`start`) takes a baseline snapshot and, until `stop` or
+MEMORY_WINDOW_SECONDS elapse, records the peak of every request per route;
+`report` diffs the current snapshot against the baseline.
+
+Tracing slows allocations down noticeably and is process wide: it only
+runs during a window or a profiled request, and only in the worker process
+that received the admin request. Peaks are approximate when requests run
+concurrently, as tracemalloc keeps a single peak per process.
+"""
+import time
+import logging
+import threading
+import tracemalloc
+
+from flask import g, request, jsonify
+
+logger = logging.getLogger(__name__)
+
+MEMORY_PARAM = "__memory"
+
+FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+)
+
+
+def snapshot():
+    return tracemalloc.take_snapshot().filter_traces(FILTERS)
+
+
+def top_sites(current, baseline, limit):
+    """Allocation sites that grew most since baseline"""
+    return [{
+        "site": "{}:{}".format(stat.traceback[0].filename, stat.traceback[0].lineno),
+        "size_diff": stat.size_diff,
+        "size": stat.size,
+        "count_diff": stat.count_diff
+    } for stat in current.compare_to(baseline, "lineno")[:limit]]
+
+
+class MemoryTracer:
+
+    def __init__(self):
+        self.frames = None
+        self.window_seconds = None
+        self.top = None
+        self.baseline = None
+        self.deadline = None
+        self.peaks = {}
+        self.last_report = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.frames = app.config.get("MEMORY_TRACE_FRAMES")
+        self.window_seconds = app.config.get("MEMORY_WINDOW_SECONDS")
+        self.top = app.config.get("MEMORY_TOP")
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.extensions["memory_tracer"] = self
+
+    @property
+    def active(self):
+        return self.baseline is not None
+
+    def start(self, seconds=None):
+        """Open a trace window, returns its deadline (epoch seconds)"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+
+            self.baseline = snapshot()
+            self.peaks = {}
+            self.deadline = time.time() + (seconds or self.window_seconds)
+            return self.deadline
+
+    def report(self, limit=None):
+        """Growth since the baseline, the last report once the window closed"""
+        with self._lock:
+            if not self.active:
+                return self.last_report
+
+            current, peak = tracemalloc.get_traced_memory()
+            return {
+                "active": True,
+                "deadline": self.deadline,
+                "traced_bytes": current,
+                "peak_bytes": peak,
+                "endpoints": dict(self.peaks),
+                "top": top_sites(snapshot(), self.baseline, limit or self.top)
+            }
+
+    def stop(self):
+        """Close the window, returns its final report"""
+        report = self.report()
+
+        with self._lock:
+            if self.active:
+                report["active"] = False
+                self.last_report = report
+                self.baseline = None
+                self.deadline = None
+                tracemalloc.stop()
+
+        return report
+
+    def _profiled(self):
+        from project.api.authentications import is_superadmin
+
+        return request.args.get(MEMORY_PARAM) and is_superadmin(
+            request.headers.get("Authorization"))
+
+    def before_request(self):
+        if self._profiled():
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start(self.frames)
+
+            g.memory_trace = (snapshot(), started)
+
+        elif not self.active:
+            return
+
+        g.memory_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def after_request(self, response):
+        start = g.pop("memory_start", None)
+        if start is None or not tracemalloc.is_tracing():
+            return response
+
+        peak = tracemalloc.get_traced_memory()[1] - start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+
+        with self._lock:
+            if self.active:
+                endpoint = "{} {}".format(request.method, route)
+                self.peaks[endpoint] = max(self.peaks.get(endpoint, 0), peak)
+
+        trace = g.pop("memory_trace", None)
+        if trace:
+            baseline, started = trace
+            top = top_sites(snapshot(), baseline, self.top)
+            if started and not self.active:
+                tracemalloc.stop()
+
+            profiled = jsonify({
+                "status": True,
+                "message": "Memory profile of {} {}".format(request.method, route),
+                "data": {
+                    "response_status": response.status_code,
+                    "peak_bytes": peak,
+                    "top": top
+                }
+            })
+            profiled.headers["X-Profiled-Status"] = str(response.status_code)
+            return profiled
+
+        if self.active and time.time() > self.deadline:
+            logger.info("Memory trace window closed: {}".format(self.stop()["endpoints"]))
+
+        return response
+
+
+memory_tracer = MemoryTracer()
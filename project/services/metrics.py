@@ -0,0 +1,464 @@
+"""Request, database pool and external call metrics in Prometheus format.
+
+Counters and histograms are sharded per thread: a thread only ever writes
+its own shard, so recording takes no lock, and a scrape sums the shards.
+The shards of exited threads are folded into one retired total, so thread
+churn does not grow them. Every value is a sum (histograms are cumulative
+buckets plus sum and count), so the snapshots of several worker processes
+add up. With METRICS_DIR set, each process writes its snapshot there at
+most every METRICS_FLUSH_SECONDS and `/metrics` serves the total over all
+files; gauges are only summed from snapshots fresh enough to come from a
+live process. As in Prometheus' multiprocess mode, the file of a process
+that exited is removed, its counters and histograms being added to
+retired.json first and its gauges dropped.
+"""
+import os
+import json
+import time
+import fcntl
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """A family of samples keyed by label values, sharded per thread"""
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # (thread, shard) of the live threads, and what exited ones recorded
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._fold_exited()
+                self._shards.append((threading.current_thread(), shard))
+
+        return shard
+
+    def _fold_exited(self):
+        """Add the shards of exited threads to the retired total, under the lock"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+                continue
+
+            for labels, value in shard.items():
+                self._retired[labels] = _add(self._retired.get(labels), value)
+
+        self._shards = live
+
+    def collect(self):
+        """{label values: value} summed over the shards"""
+        with self._lock:
+            self._fold_exited()
+            shards = [shard for _, shard in self._shards]
+            total = {labels: _add(None, value)
+                     for labels, value in self._retired.items()}
+
+        for shard in shards:
+            for labels, value in list(shard.items()):
+                total[labels] = _add(total.get(labels), value)
+
+        return total
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+
+class Gauge(Counter):
+    """Up and down counter, e.g. requests in flight"""
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        sample = shard.get(labels)
+        if sample is None:
+            # one count per bucket, then sum and count
+            sample = shard[labels] = [0] * len(self.buckets) + [0.0, 0]
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                sample[i] += 1
+                break
+
+        sample[-2] += value
+        sample[-1] += 1
+
+
+def _add(a, b):
+    if a is None:
+        return list(b) if isinstance(b, list) else b
+    if isinstance(a, list):
+        return [x + y for x, y in zip(a, b)]
+    return a + b
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v)) for k, v in pairs) + "}"
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """
+        collector() returns [(name, kind, help, labelnames, {label values:
+        value})] read at scrape time, for stats kept elsewhere
+        """
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        """{name: {kind, help, labelnames, buckets, samples: [[labels, value]]}}"""
+        families = {}
+        for metric in self.metrics:
+            families[metric.name] = {
+                "kind": metric.kind,
+                "help": metric.help,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": [[list(k), v] for k, v in metric.collect().items()]
+            }
+
+        for collector in self.collectors:
+            try:
+                for name, kind, help, labelnames, samples in collector():
+                    families[name] = {
+                        "kind": kind, "help": help, "labelnames": list(labelnames),
+                        "buckets": [], "samples": [[list(k), v] for k, v in samples.items()]
+                    }
+            except Exception as e:
+                logger.error("Metrics collector failed: {}".format(e))
+
+        return families
+
+
+def merge(snapshots):
+    """Sum snapshots of several processes"""
+    families = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            merged = families.setdefault(name, dict(family, samples={}))
+            for labels, value in family["samples"]:
+                key = tuple(labels)
+                merged["samples"][key] = _add(merged["samples"].get(key), value)
+
+    for family in families.values():
+        family["samples"] = [[list(k), v] for k, v in family["samples"].items()]
+
+    return families
+
+
+def render(families):
+    """Prometheus text exposition format"""
+    lines = []
+    for name, family in sorted(families.items()):
+        lines.append("# HELP {} {}".format(name, family["help"]))
+        lines.append("# TYPE {} {}".format(name, family["kind"]))
+        names = family["labelnames"]
+
+        for labels, value in sorted(family["samples"]):
+            if family["kind"] != "histogram":
+                lines.append("{}{} {}".format(name, _labels(names, labels), value))
+                continue
+
+            cumulative = 0
+            for bound, count in zip(family["buckets"], value):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(
+                    name, _labels(names, labels, ("le", bound)), cumulative))
+            lines.append("{}_bucket{} {}".format(
+                name, _labels(names, labels, ("le", "+Inf")), value[-1]))
+            lines.append("{}_sum{} {}".format(name, _labels(names, labels), value[-2]))
+            lines.append("{}_count{} {}".format(name, _labels(names, labels), value[-1]))
+
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_latency = registry.histogram(
+    "http_request_duration_seconds", "Request latency",
+    ("blueprint", "route", "method"))
+request_count = registry.counter(
+    "http_requests_total", "Responses sent", ("blueprint", "route", "method", "status"))
+in_flight = registry.gauge(
+    "http_requests_in_flight", "Requests being served")
+request_queries = registry.histogram(
+    "http_request_queries", "SQL statements per request",
+    ("blueprint", "route"), buckets=(1, 2, 5, 10, 20, 50, 100))
+external_latency = registry.histogram(
+    "external_request_duration_seconds", "Calls to external services",
+    ("service", "outcome"))
+
+
+def service_stats():
+    """Stats the services keep themselves"""
+    from project.services import pool_monitor, asset_stats, deliverability_checker
+
+    families = []
+    pool = pool_monitor.pool_status()
+    if pool:
+        for key in ("size", "checked_out", "overflow", "idle"):
+            families.append(("db_pool_{}".format(key), "gauge",
+                             "Connections, {}".format(key.replace("_", " ")), (),
+                             {(): pool[key]}))
+
+    stats = pool_monitor.stats
+    families.append(("db_pool_checkouts_total", "counter",
+                     "Connections checked out", (), {(): stats.checkouts}))
+    families.append(("db_pool_wait_seconds_total", "counter",
+                     "Time waited for connections", (), {(): stats.wait_seconds}))
+
+    families.append(("upload_dedup_lookups_total", "counter",
+                     "Uploaded asset lookups", ("result",),
+                     {("hit",): asset_stats.hits, ("miss",): asset_stats.misses}))
+
+    cache = deliverability_checker.cache
+    if cache:
+        families.append(("email_deliverability_lookups_total", "counter",
+                         "Deliverability cache lookups", ("result",),
+                         {("hit",): cache.hits, ("miss",): cache.misses}))
+
+    return families
+
+
+@contextmanager
+def external_call(service):
+    """Time a call to an external service, e.g. with external_call("imagekit")"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        external_latency.observe(time.perf_counter() - start, service, outcome)
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.app = None
+        self.directory = None
+        self.flush_seconds = None
+        self._flushed = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get("METRICS_DIR")
+        self.flush_seconds = app.config.get("METRICS_FLUSH_SECONDS")
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            atexit.register(self.exit)
+
+        if service_stats not in registry.collectors:
+            registry.add_collector(service_stats)
+
+        app.before_request(self.start)
+        app.after_request(self.record)
+        app.teardown_request(self.finish)
+        app.extensions["request_metrics"] = self
+
+    def start(self):
+        g.metrics_start = time.perf_counter()
+        in_flight.inc()
+
+    def record(self, response):
+        start = g.get("metrics_start")
+        if start is None:
+            return response
+
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        blueprint = request.blueprint or "app"
+
+        request_latency.observe(
+            time.perf_counter() - start, blueprint, route, request.method)
+        request_count.inc(blueprint, route, request.method, response.status_code)
+
+        queries = g.get("request_queries")
+        if queries is not None:
+            request_queries.observe(queries.count, blueprint, route)
+
+        if self.directory and time.monotonic() - self._flushed > self.flush_seconds:
+            self.flush()
+
+        return response
+
+    def finish(self, exc=None):
+        if g.pop("metrics_start", None) is not None:
+            in_flight.dec()
+
+    def _path(self, pid):
+        return os.path.join(self.directory, "{}.json".format(pid))
+
+    @contextmanager
+    def _directory_lock(self):
+        """Serializes retiring files with reading them, across processes"""
+        with open(os.path.join(self.directory, "metrics.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _retire(self, pid):
+        """
+        Add the counters and histograms of an exited process to retired.json
+        and remove its file, with the directory lock held
+        """
+        path = self._path(pid)
+        retired_path = os.path.join(self.directory, "retired.json")
+
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            snapshot = {}
+
+        try:
+            with open(retired_path) as f:
+                retired = json.load(f)
+        except (OSError, ValueError):
+            retired = {}
+
+        merged = merge([retired, {name: family for name, family in snapshot.items()
+                                  if family["kind"] != "gauge"}])
+
+        with open(retired_path + ".tmp", "w") as f:
+            json.dump(merged, f)
+        os.replace(retired_path + ".tmp", retired_path)
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def exit(self):
+        """At interpreter exit: write the last counts, then retire them"""
+        try:
+            # the service collectors read through the app
+            with self.app.app_context():
+                self.flush()
+            with self._directory_lock():
+                self._retire(os.getpid())
+        except OSError as e:
+            logger.error("Could not retire metrics snapshot: {}".format(e))
+
+    def flush(self):
+        """Write this process' snapshot for the other processes to serve"""
+        self._flushed = time.monotonic()
+        path = self._path(os.getpid())
+
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(registry.snapshot(), f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.error("Could not write metrics snapshot: {}".format(e))
+
+    def families(self):
+        if not self.directory:
+            return registry.snapshot()
+
+        self.flush()
+        stale = time.time() - 3 * self.flush_seconds
+        snapshots = []
+
+        with self._directory_lock():
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not name.endswith(".json"):
+                    continue
+
+                pid = name[:-len(".json")]
+                if pid.isdigit() and not _process_alive(int(pid)):
+                    # a worker that died without running its exit hook
+                    self._retire(pid)
+                    continue
+
+                try:
+                    fresh = os.path.getmtime(path) >= stale
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+
+                if not fresh:
+                    # a snapshot this old cannot tell the current gauges
+                    snapshot = {name: family for name, family in snapshot.items()
+                                if family["kind"] != "gauge"}
+                snapshots.append(snapshot)
+
+        return merge(snapshots)
+
+    def render(self):
+        return render(self.families())
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+request_metrics = RequestMetrics()
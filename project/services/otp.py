@@ -0,0 +1,151 @@
+"""One time PINs kept in a TTL store instead of on the user row.
+
+Only an HMAC of each code is stored, next to its expiry and a failed
+attempt counter. The default store lives in process memory, which is fine
+for a single worker process; with several processes configure `OTP_STORE`
+with the import path of a shared implementation of `OTPStore`.
+"""
+import hmac
+import time
+import hashlib
+import secrets
+import threading
+
+from werkzeug.utils import import_string
+
+from project.exceptions import APIError
+
+
+class OTPStore:
+    """
+    Backend interface. Records are dicts {"hash": str, "attempts": int}
+    that expire ttl seconds after `put`
+    """
+
+    def put(self, key, record, ttl):
+        raise NotImplementedError
+
+    def get(self, key):
+        """Return the record, or None if missing or expired"""
+        raise NotImplementedError
+
+    def increment_attempts(self, key):
+        """
+        Atomically count an attempt, returns the new count, or None if the
+        record is missing or expired
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class MemoryOTPStore(OTPStore):
+    """In-process store, expired records are swept lazily"""
+
+    sweep_every = 1000
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def put(self, key, record, ttl):
+        with self._lock:
+            self._records[key] = (time.monotonic() + ttl, dict(record))
+
+            self._writes += 1
+            if self._writes % self.sweep_every == 0:
+                self._sweep()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return dict(entry[1]) if entry else None
+
+    def increment_attempts(self, key):
+        with self._lock:
+            entry = self._live(key)
+            if not entry:
+                return None
+
+            entry[1]["attempts"] += 1
+            return entry[1]["attempts"]
+
+    def delete(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+
+    def _live(self, key):
+        entry = self._records.get(key)
+        if entry and entry[0] <= time.monotonic():
+            del self._records[key]
+            return None
+
+        return entry
+
+    def _sweep(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._records.items() if entry[0] <= now]:
+            del self._records[key]
+
+
+class OTPService:
+    """Issues and verifies email OTPs"""
+
+    def __init__(self):
+        self.store = None
+        self.secret = None
+        self.ttl = None
+        self.max_attempts = None
+
+    def init_app(self, app):
+        self.store = import_string(app.config.get("OTP_STORE"))()
+        self.secret = app.config.get("SECRET_KEY").encode()
+        self.ttl = app.config.get("OTP_TTL_SECONDS")
+        self.max_attempts = app.config.get("OTP_MAX_ATTEMPTS")
+
+    def _key(self, purpose, user_id):
+        return "otp:{}:{}".format(purpose, int(user_id))
+
+    def _hash(self, key, code):
+        message = "{}:{}".format(key, int(code)).encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def issue(self, user_id, purpose="email"):
+        """Create a new 6 digit code, replacing any previous one"""
+        code = 100000 + secrets.randbelow(900000)
+        key = self._key(purpose, user_id)
+
+        self.store.put(key, {"hash": self._hash(key, code), "attempts": 0}, self.ttl)
+
+        return code
+
+    def verify(self, user_id, code, purpose="email"):
+        """Check a code without touching the database, raises APIError"""
+        key = self._key(purpose, user_id)
+
+        # the attempt is counted before comparing, so concurrent guesses
+        # cannot all read the same count and each get a try
+        attempts = self.store.increment_attempts(key)
+        if attempts is None:
+            raise APIError("OTP not sent yet or expired")
+
+        if attempts > self.max_attempts:
+            self.store.delete(key)
+            raise APIError("Too many attempts, please request a new OTP")
+
+        record = self.store.get(key)
+        if not record:
+            raise APIError("OTP not sent yet or expired")
+
+        if not hmac.compare_digest(record["hash"], self._hash(key, code)):
+            if attempts >= self.max_attempts:
+                self.store.delete(key)
+
+            raise APIError("Invalid OTP")
+
+        self.store.delete(key)
+
+
+otp_service = OTPService()
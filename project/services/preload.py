@@ -0,0 +1,92 @@
+from project.models import User, Location, Vehicle, Licence, Trip
+
+
+class Preloaded:
+    """
+    Related rows fetched up front for a batch of trips, ride requests,
+    users, churches or ratings, so that passing it to their `to_json`
+    serializes the whole batch without any further queries:
+        users: {user_id: User}
+        locations: {location_id: Location}
+        vehicles: {user_id: Vehicle}
+        licences: {user_id: Licence}
+        trips: {trip_id: Trip}
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.locations = {}
+        self.vehicles = {}
+        self.licences = {}
+        self.trips = {}
+
+    @classmethod
+    def load(cls, trips=(), passengers=(), users=(), churches=(), ratings=()):
+        """
+        Load rated trips, drivers, passengers, driver documents and every
+        referenced location in at most five queries, however large the
+        batch is
+        """
+        preloaded = cls()
+
+        for user in users:
+            preloaded.users[user.id] = user
+
+        for trip in trips:
+            preloaded.trips[trip.id] = trip
+
+        preloaded.load_trips({rating.trip_id for rating in ratings})
+        trips = list(preloaded.trips.values())
+
+        driver_ids = {trip.driver_id for trip in trips}
+        user_ids = driver_ids | {passenger.passenger_id for passenger in passengers}
+        for rating in ratings:
+            user_ids.update((rating.passenger_id, rating.driver_id))
+
+        preloaded.load_users(user_ids - set(preloaded.users))
+        preloaded.load_documents(driver_ids)
+
+        location_ids = {user.location_id for user in preloaded.users.values()}
+        location_ids.update(church.location_id for church in churches)
+        for row in trips + list(passengers):
+            location_ids.update((row.source_id, row.destination_id))
+
+        preloaded.load_locations(location_ids)
+
+        return preloaded
+
+    def load_trips(self, trip_ids):
+        trip_ids = set(trip_ids) - set(self.trips)
+        if not trip_ids:
+            return
+
+        for trip in Trip.query.filter(Trip.id.in_(trip_ids)).all():
+            self.trips[trip.id] = trip
+
+    def load_users(self, user_ids):
+        if not user_ids:
+            return
+
+        for user in User.query.filter(User.id.in_(user_ids)).all():
+            self.users[user.id] = user
+
+    def load_documents(self, driver_ids):
+        if not driver_ids:
+            return
+
+        # keep the first row per driver, as Vehicle/Licence .first() would
+        vehicles = Vehicle.query.filter(
+            Vehicle.user_id.in_(driver_ids)).order_by(Vehicle.id.desc()).all()
+        licences = Licence.query.filter(
+            Licence.user_id.in_(driver_ids)).order_by(Licence.id.desc()).all()
+
+        self.vehicles.update((vehicle.user_id, vehicle) for vehicle in vehicles)
+        self.licences.update((licence.user_id, licence) for licence in licences)
+
+    def load_locations(self, location_ids):
+        location_ids = set(location_ids) - {None} - set(self.locations)
+        if not location_ids:
+            return
+
+        for location in Location.query.filter(Location.id.in_(location_ids)).all():
+            self.locations[location.id] = location
@@ -0,0 +1,135 @@
+"""CPU profiling of live requests.
+
+An admin adds `__profile=1` to any request to get the cProfile report of
+that request back instead of its response, or `__profile=save` to keep the
+response and store the profile. Besides, PROFILE_SAMPLE_PERCENT of all
+requests are profiled and stored, a rate admins can change at runtime.
+
+Stored profiles are pstats files in PROFILE_DIR, of which the newest
+PROFILE_KEEP are kept; they load in pstats, snakeviz or flameprof.
+"""
+import io
+import os
+import time
+import random
+import pstats
+import logging
+import cProfile
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PARAM = "__profile"
+
+
+class RequestProfiler:
+
+    def __init__(self):
+        self.directory = None
+        self.sample_percent = 0.0
+        self.keep = None
+        self.top = None
+
+    def init_app(self, app):
+        self.directory = os.path.abspath(app.config.get("PROFILE_DIR"))
+        self.sample_percent = app.config.get("PROFILE_SAMPLE_PERCENT")
+        self.keep = app.config.get("PROFILE_KEEP")
+        self.top = app.config.get("PROFILE_TOP")
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.extensions["request_profiler"] = self
+
+    def _mode(self):
+        from project.api.authentications import is_superadmin
+
+        mode = request.args.get(PROFILE_PARAM)
+        if mode and is_superadmin(request.headers.get("Authorization")):
+            return "save" if mode == "save" else "inline"
+
+        if self.sample_percent and random.random() * 100 < self.sample_percent:
+            return "save"
+
+        return None
+
+    def start(self):
+        mode = self._mode()
+        if not mode:
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active on this interpreter
+            return
+
+        g.profile = (profile, mode)
+
+    def finish(self, response):
+        profile, mode = g.pop("profile", (None, None))
+        if profile is None:
+            return response
+
+        profile.disable()
+
+        if mode == "inline":
+            report = self.report(pstats.Stats(profile))
+            response.set_data(report)
+            response.headers["X-Profiled-Status"] = str(response.status_code)
+            response.headers["Content-Type"] = "text/plain; charset=utf-8"
+            response.status_code = 200
+            return response
+
+        try:
+            response.headers["X-Profile"] = self.save(profile)
+        except OSError as e:
+            logger.error("Could not store profile: {}".format(e))
+
+        return response
+
+    def report(self, stats, sort="cumulative"):
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.sort_stats(sort).print_stats(self.top)
+        return stream.getvalue()
+
+    def save(self, profile):
+        """Write a pstats file, returns its name"""
+        os.makedirs(self.directory, exist_ok=True)
+
+        endpoint = (request.endpoint or "unmatched").replace(".", "-")
+        name = "{}-{}-{}.prof".format(
+            time.strftime("%Y%m%d%H%M%S"), endpoint, os.urandom(4).hex())
+        profile.dump_stats(os.path.join(self.directory, name))
+
+        for old in self.list()[self.keep:]:
+            os.remove(os.path.join(self.directory, old["name"]))
+
+        return name
+
+    def list(self):
+        """Stored profiles, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+
+        profiles = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".prof"):
+                stat = os.stat(os.path.join(self.directory, name))
+                profiles.append({
+                    "name": name, "size": stat.st_size, "created": stat.st_mtime})
+
+        return sorted(profiles, key=lambda p: p["created"], reverse=True)
+
+    def path(self, name):
+        """Path of a stored profile, None if there is no such profile"""
+        if os.path.basename(name) != name or not name.endswith(".prof"):
+            return None
+
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,136 @@
+"""Per request SQL statement counts and timing.
+
+Cursor execution events of every engine are counted while a request is
+served: the number of statements, the time spent in the database and how
+often each statement text ran. Statements are compiled with bound
+parameters, so a per-row lookup repeats the same text; more than
+QUERY_REPEAT_THRESHOLD runs of one statement in a request are logged as a
+likely N+1. Responses carry a `Server-Timing` header with the totals.
+
+Views declare the most statements a request may take with `query_budget`,
+whatever the size of the data; requests over budget are logged, and
+`manage.py check-query-budgets` enforces the budgets on seeded datasets.
+
+The cost per statement is two clock reads and a dict increment, so the
+instrumentation can stay on in production; QUERY_STATS disables it.
+"""
+import time
+import logging
+
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+def query_budget(statements):
+    """
+    Declare the most SQL statements a request to the view may run, the
+    authentication included. Place it under the route decorator
+    """
+    def decorator(f):
+        f.query_budget = statements
+        return f
+
+    return decorator
+
+
+def budget_of(view):
+    """Statement budget declared for a view function, None if undeclared"""
+    return getattr(view, "query_budget", None)
+
+
+class RequestQueries:
+    """Statements issued while serving one request"""
+
+    __slots__ = ("count", "seconds", "statements", "started")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = {}
+        self.started = time.perf_counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, threshold):
+        """(statement, count) pairs ran more than threshold times"""
+        return sorted(
+            ((statement, count) for statement, count in self.statements.items()
+             if count > threshold),
+            key=lambda item: -item[1])
+
+
+class QueryInspector:
+
+    def __init__(self):
+        self.enabled = False
+        self.threshold = None
+        self._listening = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get("QUERY_STATS")
+        self.threshold = app.config.get("QUERY_REPEAT_THRESHOLD")
+
+        if self.enabled:
+            if not self._listening:
+                # every engine, the replica bind included
+                event.listen(Engine, "before_cursor_execute", self._before_execute)
+                event.listen(Engine, "after_cursor_execute", self._after_execute)
+                self._listening = True
+
+            app.before_request(self.start)
+            app.after_request(self.report)
+
+        app.extensions["query_inspector"] = self
+
+    @staticmethod
+    def current():
+        """RequestQueries of the request being served, if instrumented"""
+        if has_request_context():
+            return g.get("request_queries")
+
+        return None
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        queries = self.current()
+        if queries is not None:
+            queries.record(statement, time.perf_counter() - context._query_start)
+
+    def start(self):
+        g.request_queries = RequestQueries()
+
+    def report(self, response):
+        queries = g.get("request_queries")
+        if queries is None:
+            return response
+
+        timings = [
+            'db;dur={:.2f};desc="{} queries"'.format(queries.seconds * 1000, queries.count),
+            "app;dur={:.2f}".format((time.perf_counter() - queries.started) * 1000)
+        ]
+        if g.get("db_pool_wait") is not None:
+            timings.append("pool;dur={:.2f}".format(g.db_pool_wait * 1000))
+
+        response.headers.add("Server-Timing", ", ".join(timings))
+
+        budget = budget_of(current_app.view_functions.get(request.endpoint))
+        if budget is not None and queries.count > budget:
+            logger.warning("{} {} ran {} statements, over its budget of {}".format(
+                request.method, request.path, queries.count, budget))
+
+        for statement, count in queries.repeated(self.threshold):
+            logger.warning("Possible N+1 on {} {}: {} runs of {}".format(
+                request.method, request.path, count, " ".join(statement.split())[:200]))
+
+        return response
+
+
+query_inspector = QueryInspector()
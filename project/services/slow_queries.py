@@ -0,0 +1,186 @@
+"""Slow statement log with the query plan of each slow SELECT.
+
+Statements running longer than SLOW_QUERY_MS are logged with their SQL on
+one line, the shape of their parameters (types only, values may be
+personal data), the endpoint that issued them and, for SELECTs, the plan
+returned by EXPLAIN on a separate connection.
+
+Nothing beyond a clock read happens on the request path for fast
+statements. Slow ones are handed to a single background thread through a
+bounded queue and dropped when it is full; at most SLOW_QUERY_LOG_PER_MINUTE
+are logged, and the same statement is explained at most once every
+SLOW_QUERY_EXPLAIN_SECONDS.
+"""
+import time
+import queue
+import logging
+import threading
+
+from flask import request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_PREFIXES = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "mysql": "EXPLAIN ",
+    "postgresql": "EXPLAIN ",
+}
+
+
+def format_plan(plan, dialect_name):
+    if dialect_name == "sqlite":
+        return [row["detail"] for row in plan]
+
+    if dialect_name == "mysql":
+        return ["{} type={} key={} rows={}".format(
+            row.get("table"), row.get("type"), row.get("key"), row.get("rows")
+        ) for row in plan]
+
+    return [row["QUERY PLAN"] for row in plan]
+
+
+def explain(engine, statement, parameters):
+    """Plan rows of a compiled statement, on a connection of its own"""
+    prefix = EXPLAIN_PREFIXES.get(engine.dialect.name)
+    if not prefix:
+        raise RuntimeError(
+            "EXPLAIN is not supported for {}".format(engine.dialect.name))
+
+    with engine.connect() as connection:
+        result = connection.exec_driver_sql(prefix + statement, parameters)
+        return [dict(row._mapping) for row in result]
+
+
+def parameters_shape(parameters, executemany):
+    """Parameter types without their values"""
+    if executemany:
+        return "{} x {}".format(
+            len(parameters), parameters_shape(parameters[0], False) if parameters else "()")
+
+    if isinstance(parameters, dict):
+        return "{" + ", ".join("{}: {}".format(key, type(value).__name__)
+                               for key, value in parameters.items()) + "}"
+
+    return "(" + ", ".join(type(value).__name__ for value in parameters or ()) + ")"
+
+
+class SlowQueryLog:
+
+    def __init__(self):
+        self.threshold = None
+        self.explain = False
+        self.per_minute = None
+        self.explain_interval = None
+        self._queue = queue.Queue(maxsize=100)
+        self._worker = None
+        self._listening = False
+        self._lock = threading.Lock()
+        self._window = (0, 0)
+        self._explained = {}
+        self.dropped = 0
+
+    def init_app(self, app):
+        self.threshold = app.config.get("SLOW_QUERY_MS") / 1000
+        self.explain = app.config.get("SLOW_QUERY_EXPLAIN")
+        self.per_minute = app.config.get("SLOW_QUERY_LOG_PER_MINUTE")
+        self.explain_interval = app.config.get("SLOW_QUERY_EXPLAIN_SECONDS")
+
+        if self.threshold and not self._listening:
+            event.listen(Engine, "before_cursor_execute", self._before_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_execute)
+            self._listening = True
+
+        app.extensions["slow_query_log"] = self
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._slow_query_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._slow_query_start
+        if not self.threshold or elapsed < self.threshold:
+            return
+
+        if threading.current_thread() is self._worker:
+            # our own EXPLAIN
+            return
+
+        endpoint = None
+        if has_request_context():
+            endpoint = "{} {}".format(
+                request.method, request.url_rule.rule if request.url_rule else request.path)
+
+        try:
+            self._queue.put_nowait(
+                (conn.engine, statement, parameters, executemany, elapsed, endpoint))
+        except queue.Full:
+            self.dropped += 1
+            return
+
+        self._start_worker()
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._drain, name="slow-query-log", daemon=True)
+                self._worker.start()
+
+    def _allowed(self):
+        """Rate limit, per minute window"""
+        minute = int(time.monotonic() // 60)
+        window, count = self._window
+        if window != minute:
+            window, count = minute, 0
+
+        self._window = (window, count + 1)
+        return count < self.per_minute
+
+    def _should_explain(self, statement):
+        if not self.explain or not statement.lstrip().upper().startswith("SELECT"):
+            return False
+
+        now = time.monotonic()
+        if self._explained.get(statement, 0) > now:
+            return False
+
+        if len(self._explained) > 1000:
+            self._explained = {k: v for k, v in self._explained.items() if v > now}
+        self._explained[statement] = now + self.explain_interval
+        return True
+
+    def _drain(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=60)
+            except queue.Empty:
+                return
+
+            try:
+                self.log(*item)
+            except Exception as e:
+                logger.error("Slow query log failed: {}".format(e))
+
+    def log(self, engine, statement, parameters, executemany, elapsed, endpoint):
+        if not self._allowed():
+            self.dropped += 1
+            return
+
+        lines = ["Slow query {:.1f}ms on {}: {}".format(
+            elapsed * 1000, endpoint or "(no request)", " ".join(statement.split())),
+            "parameters: {}".format(parameters_shape(parameters, executemany))]
+
+        if self._should_explain(statement):
+            try:
+                plan = explain(engine, statement,
+                               parameters[0] if executemany else parameters)
+                lines.extend("plan: {}".format(line)
+                             for line in format_plan(plan, engine.dialect.name))
+            except Exception as e:
+                lines.append("plan unavailable: {}".format(e))
+
+        logger.warning("\n  ".join(lines))
+
+
+slow_query_log = SlowQueryLog()
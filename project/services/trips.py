@@ -0,0 +1,227 @@
+from datetime import datetime, timedelta
+
+from project import db
+from project.exceptions import APIError
+from project.models import Location, Trip, TripStatus, TripPassenger, RequestStatus
+from project.services.preload import Preloaded
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday",
+            "friday", "saturday", "sunday"]
+
+
+class TripDetail:
+    """
+    A trip together with its accepted passengers and everything needed to
+    serialize both, loaded with a fixed number of queries
+    """
+
+    def __init__(self, trip, passengers, preloaded):
+        self.trip = trip
+        self.passengers = passengers
+        self.preloaded = preloaded
+
+    def trip_json(self):
+        return self.trip.to_json(self.preloaded)
+
+    def passengers_json(self):
+        return [passenger.to_json(self.preloaded) for passenger in self.passengers]
+
+    def passenger(self, passenger_id):
+        """Accepted ride request of the given passenger, if any"""
+        for passenger in self.passengers:
+            if passenger.passenger_id == int(passenger_id):
+                return passenger
+
+        return None
+
+
+def load_trip_detail(trip_id, driver_id=None):
+    """
+    Load trip, driver, vehicle, licence, all locations and accepted
+    passengers in six queries, whatever the number of passengers.
+    Returns None if the trip does not exist (or is not driven by driver_id)
+    """
+    trip = Trip.query.filter_by(id=trip_id)
+    if driver_id is not None:
+        trip = trip.filter_by(driver_id=driver_id)
+
+    trip = trip.first()
+    if not trip:
+        return None
+
+    passengers = TripPassenger.query.filter_by(
+        trip_id=trip.id, request_status=RequestStatus.accepted).all()
+
+    return TripDetail(trip, passengers, Preloaded.load([trip], passengers))
+
+
+def accepted_passenger_counts(trip_ids):
+    """{trip_id: number of accepted ride requests} for many trips in one query"""
+    counts = {trip_id: 0 for trip_id in trip_ids}
+    if not counts:
+        return counts
+
+    rows = db.session.query(
+        TripPassenger.trip_id, db.func.count(TripPassenger.id)
+    ).filter(
+        TripPassenger.trip_id.in_(counts),
+        TripPassenger.request_status == RequestStatus.accepted
+    ).group_by(TripPassenger.trip_id).all()
+
+    counts.update(rows)
+    return counts
+
+
+def apply_request_statuses(driver_id, changes):
+    """
+    Move a batch of the driver's pending ride requests to new statuses in
+    one transaction. `changes` is a list of (request_id, status name) pairs;
+    seat capacity is checked across the whole batch, in order, per trip.
+    Returns one result dict per change, in the same order
+    """
+    request_ids = {request_id for request_id, _ in changes}
+
+    rows = db.session.query(TripPassenger, Trip).join(
+        Trip, Trip.id == TripPassenger.trip_id
+    ).filter(
+        TripPassenger.id.in_(request_ids),
+        TripPassenger.request_status == RequestStatus.pending,
+        Trip.driver_id == driver_id
+    ).with_for_update().all() if request_ids else []
+
+    pending = {passenger_request.id: (passenger_request, trip)
+               for passenger_request, trip in rows}
+    trips = {trip.id: trip for _, trip in rows}
+    seats_left = {trip.id: trip.number_of_seats for trip in trips.values()}
+
+    results = []
+    seen = set()
+    by_status = {}
+
+    for request_id, status in changes:
+        result = {'id': request_id, 'status': False}
+        results.append(result)
+
+        if request_id in seen:
+            result['message'] = 'Duplicate trip request in batch'
+            continue
+
+        seen.add(request_id)
+
+        if request_id not in pending:
+            result['message'] = 'Trip request does not exist'
+            continue
+
+        status = str(status).lower()
+        if status not in RequestStatus.__members__:
+            result['message'] = 'Invalid request status'
+            continue
+
+        passenger_request, trip = pending[request_id]
+
+        if RequestStatus[status] == RequestStatus.accepted:
+            if trip.status != TripStatus.pending:
+                result['message'] = 'Trip request cannot be accepted'
+                continue
+
+            if passenger_request.seats_booked > seats_left[trip.id]:
+                result['message'] = 'Not enough seats available'
+                continue
+
+            seats_left[trip.id] -= passenger_request.seats_booked
+
+        by_status.setdefault(RequestStatus[status], []).append(request_id)
+
+        result['status'] = True
+        result['message'] = 'Trip request updated successfully'
+        result['request_status'] = status
+
+    now = datetime.utcnow()
+
+    for status, ids in by_status.items():
+        TripPassenger.query.filter(TripPassenger.id.in_(ids)).update(
+            {'request_status': status, 'timestamp': now},
+            synchronize_session=False)
+
+    booked = {trip_id: trips[trip_id].number_of_seats - seats
+              for trip_id, seats in seats_left.items()
+              if seats != trips[trip_id].number_of_seats}
+
+    if booked:
+        Trip.query.filter(Trip.id.in_(booked)).update({
+            'number_of_seats': Trip.number_of_seats - db.case(booked, value=Trip.id),
+            'timestamp': now
+        }, synchronize_session=False)
+
+    db.session.commit()
+
+    return results
+
+
+def recurrence_dates(weekday, weeks, at_time, start_date=None):
+    """
+    Dates of a weekly recurrence, e.g. every sunday for 12 weeks. Without a
+    start date the series begins with the next occurrence still ahead
+    """
+    weekday = str(weekday).lower()
+    if weekday not in WEEKDAYS:
+        raise APIError("Invalid weekday {}".format(weekday))
+
+    start = start_date or datetime.now().date()
+    first = start + timedelta(days=(WEEKDAYS.index(weekday) - start.weekday()) % 7)
+
+    if not start_date and datetime.combine(first, at_time) < datetime.now():
+        first += timedelta(weeks=1)
+
+    return [first + timedelta(weeks=week) for week in range(weeks)]
+
+
+def create_trips(driver_id, source, destination_id, at_time, dates,
+                 number_of_seats, carpool=False):
+    """
+    Create one trip per date in a single transaction: conflicts are found
+    with one range query, each trip gets its own source location (trip
+    updates edit it in place) and the trips go in with one executemany.
+    Returns the created trips ordered by date
+    """
+    dates = sorted(dates)
+
+    conflicts = Trip.query.with_entities(Trip.date).filter(
+        Trip.driver_id == driver_id,
+        Trip.date.between(dates[0], dates[-1]),
+        Trip.time == at_time,
+        Trip.status.in_([TripStatus.active, TripStatus.pending])
+    ).all()
+
+    conflicts = sorted({conflict.date for conflict in conflicts} & set(dates))
+    if conflicts:
+        raise APIError("Sorry, there's already a trip for you on {} at this "
+                       "time.".format(", ".join(
+                           conflict.strftime("%Y-%m-%d") for conflict in conflicts)))
+
+    sources = [Location(
+        latitude=source.get("latitude"),
+        longitude=source.get("longitude"),
+        place=source.get("place")
+    ) for _ in dates]
+
+    db.session.add_all(sources)
+    db.session.flush()
+
+    source_ids = [location.id for location in sources]
+
+    db.session.execute(Trip.__table__.insert(), [{
+        "driver_id": driver_id,
+        "source_id": source_id,
+        "destination_id": destination_id,
+        "date": trip_date,
+        "time": at_time,
+        "number_of_seats": number_of_seats,
+        "carpool": carpool
+    } for trip_date, source_id in zip(dates, source_ids)])
+
+    db.session.commit()
+
+    return Trip.query.filter(
+        Trip.source_id.in_(source_ids)
+    ).order_by(Trip.date.asc()).all()
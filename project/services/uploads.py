@@ -0,0 +1,339 @@
+"""Upload pipeline shared by the upload endpoints.
+
+`store` hashes the payload, normalizes it when enabled and writes it to the
+configured storage backend unless the same content was stored before, and
+`store_many` does so for several files concurrently. `submit` runs the same
+pipeline as a background job: the payload is copied to UPLOAD_JOB_DIR, an
+`upload_job` row records its progress and a bounded thread pool performs
+the upload, so slow clients and a slow CDN no longer hold a request worker. Jobs live in the database, so any process can report
+their status; a job whose process died stays pending.
+
+Large files from flaky mobile connections can also be sent as a resumable
+session: chunks are appended to a staging file in UPLOAD_SESSION_DIR at the
+offset the client believes it is at, the client asks for the current offset
+after a dropped connection, and the file goes through `store` once complete.
+A session belongs to the user who opened it, each user has at most
+UPLOAD_SESSION_MAX_OPEN of them, and sessions idle for longer than
+UPLOAD_SESSION_TTL_SECONDS are removed.
+"""
+import io
+import os
+import re
+import json
+import fcntl
+import time
+import uuid
+import shutil
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from project import db
+from project.exceptions import APIError
+from project.models import UploadJob, JobStatus
+from project.services.assets import hash_stream, upload_once, ORIGINAL
+from project.services.images import image_normalizer
+from project.services.storage import make_storage
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadService:
+
+    def __init__(self):
+        self.app = None
+        self.storage = None
+        self._executor = None
+        self._batch_executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.storage = make_storage(app.config)
+        self._slots = threading.BoundedSemaphore(
+            app.config.get("UPLOAD_QUEUE_SIZE"))
+        app.extensions["upload_service"] = self
+
+    def store(self, stream, filename, content_type, keep_original=False):
+        """
+        Upload a seekable stream through the pipeline, returns a dict with
+        image_url, and original_url when keep_original is set
+        """
+        digest, size = hash_stream(stream)
+
+        def upload_original():
+            stream.seek(0)
+            return self.storage.save(stream, filename, content_type)
+
+        def upload_normalized():
+            # resize, orient and strip metadata before uploading
+            image = image_normalizer.normalize(stream)
+            name = "{}.{}".format(
+                filename.rsplit(".", 1)[0], image.format.lower())
+
+            logger.info("Normalized {} to {}x{} ({} bytes)".format(
+                filename, image.width, image.height, len(image.data)))
+            return self.storage.save(
+                io.BytesIO(image.data), name, image.content_type)
+
+        if not image_normalizer.enabled:
+            # stored as is
+            return {"image_url": upload_once(digest, size, ORIGINAL, upload_original)}
+
+        data = {"image_url": upload_once(
+            digest, size, image_normalizer.variant, upload_normalized)}
+
+        if keep_original:
+            data["original_url"] = upload_once(
+                digest, size, ORIGINAL, upload_original)
+
+        return data
+
+    def _store_in_context(self, *args):
+        with self.app.app_context():
+            return self.store(*args)
+
+    def store_many(self, files, keep_original=False):
+        """
+        Upload several (key, stream, filename, content_type) files at once
+        through a pool of UPLOAD_BATCH_WORKERS, so a batch takes about as
+        long as its slowest file. Returns ({key: data}, {key: error})
+        """
+        with self._lock:
+            if self._batch_executor is None:
+                self._batch_executor = ThreadPoolExecutor(
+                    max_workers=self.app.config.get("UPLOAD_BATCH_WORKERS"),
+                    thread_name_prefix="upload-batch")
+
+        futures = {
+            key: self._batch_executor.submit(
+                self._store_in_context, stream, filename, content_type, keep_original)
+            for key, stream, filename, content_type in files
+        }
+
+        results, errors = {}, {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                logger.error("Error uploading {}: {}".format(key, e))
+                errors[key] = str(e)
+
+        return results, errors
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.app.config.get("UPLOAD_WORKERS"),
+                    thread_name_prefix="upload")
+
+            return self._executor
+
+    def submit(self, stream, filename, content_type, keep_original=False):
+        """
+        Queue an upload, returns the job or None when UPLOAD_QUEUE_SIZE jobs
+        are already queued or running
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        try:
+            directory = self.app.config.get("UPLOAD_JOB_DIR")
+            os.makedirs(directory, exist_ok=True)
+
+            job_id = uuid.uuid4().hex
+            path = os.path.join(directory, job_id)
+
+            stream.seek(0)
+            with open(path, "wb") as f:
+                shutil.copyfileobj(stream, f)
+
+            job = UploadJob(id=job_id, filename=filename, content_type=content_type,
+                            keep_original=keep_original, path=path)
+            job.insert()
+
+            self._pool().submit(self._run, job_id)
+
+        except Exception:
+            self._slots.release()
+            raise
+
+        return job
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                job = UploadJob.query.get(job_id)
+                job.status = JobStatus.running
+                db.session.commit()
+
+                with open(job.path, "rb") as f:
+                    data = self.store(
+                        f, job.filename, job.content_type, job.keep_original)
+
+                job.image_url = data["image_url"]
+                job.original_url = data.get("original_url")
+                job.status = JobStatus.done
+
+            except Exception as e:
+                db.session.rollback()
+                logger.exception(e)
+
+                job = UploadJob.query.get(job_id)
+                job.status = JobStatus.failed
+                job.error = str(e)
+
+            finally:
+                self._slots.release()
+
+            if os.path.exists(job.path):
+                os.remove(job.path)
+
+            job.path = None
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+    def _session_paths(self, session_id):
+        if not SESSION_ID.match(session_id or ""):
+            raise APIError("Upload session not found")
+
+        directory = self.app.config.get("UPLOAD_SESSION_DIR")
+        base = os.path.join(directory, session_id)
+        return base + ".json", base + ".part"
+
+    def _expire_sessions(self):
+        """Remove the files of sessions idle for UPLOAD_SESSION_TTL_SECONDS"""
+        directory = self.app.config.get("UPLOAD_SESSION_DIR")
+        deadline = time.time() - self.app.config.get("UPLOAD_SESSION_TTL_SECONDS")
+
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _open_sessions(self, user_id):
+        """Number of sessions of a user that are not complete or expired"""
+        directory = self.app.config.get("UPLOAD_SESSION_DIR")
+        count = 0
+
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    if json.load(f).get("user_id") == user_id:
+                        count += 1
+            except (OSError, ValueError):
+                pass
+
+        return count
+
+    def open_session(self, user_id, filename, content_type, size):
+        """Start a resumable upload of size bytes for a user, returns its state"""
+        if size <= 0 or size > self.app.config.get("UPLOAD_SESSION_MAX_SIZE"):
+            raise APIError("Invalid upload size")
+
+        os.makedirs(self.app.config.get("UPLOAD_SESSION_DIR"), exist_ok=True)
+        self._expire_sessions()
+
+        max_open = self.app.config.get("UPLOAD_SESSION_MAX_OPEN")
+        if self._open_sessions(user_id) >= max_open:
+            raise APIError("At most {} upload sessions can be open at once".format(
+                max_open))
+
+        session = {
+            "id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "filename": filename,
+            "content_type": content_type,
+            "size": size
+        }
+
+        meta_path, part_path = self._session_paths(session["id"])
+        with open(meta_path, "w") as f:
+            json.dump(session, f)
+        open(part_path, "wb").close()
+
+        session["offset"] = 0
+        return session
+
+    def session_state(self, session_id, user_id):
+        """
+        Metadata of a session of the user with the number of bytes received
+        so far; a session idle for UPLOAD_SESSION_TTL_SECONDS is removed
+        """
+        meta_path, part_path = self._session_paths(session_id)
+        deadline = time.time() - self.app.config.get("UPLOAD_SESSION_TTL_SECONDS")
+
+        try:
+            with open(meta_path) as f:
+                session = json.load(f)
+            session["offset"] = os.path.getsize(part_path)
+            idle = max(os.path.getmtime(meta_path),
+                       os.path.getmtime(part_path)) < deadline
+        except (OSError, ValueError):
+            raise APIError("Upload session not found")
+
+        if session.get("user_id") != user_id:
+            raise APIError("Upload session not found")
+
+        if idle:
+            for path in (meta_path, part_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            raise APIError("Upload session not found")
+
+        return session
+
+    def append_chunk(self, session_id, user_id, offset, stream):
+        """
+        Append a chunk sent from offset, streamed to the staging file. Once
+        the last byte is in the file is stored and the session removed;
+        returns the session state, with image_url when complete
+        """
+        session = self.session_state(session_id, user_id)
+        meta_path, part_path = self._session_paths(session_id)
+
+        with open(part_path, "ab") as f:
+            # one writer per session, across worker processes too
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise APIError("Upload session busy, retry shortly")
+
+            if offset != os.fstat(f.fileno()).st_size:
+                raise APIError("Offset mismatch, upload resumes at {}".format(
+                    os.fstat(f.fileno()).st_size))
+
+            shutil.copyfileobj(stream, f)
+            f.flush()
+            session["offset"] = f.tell()
+
+            if session["offset"] > session["size"]:
+                f.truncate(offset)
+                raise APIError("Upload exceeds the announced size")
+
+            if session["offset"] == session["size"]:
+                with open(part_path, "rb") as data:
+                    session.update(self.store(
+                        data, session["filename"], session["content_type"]))
+
+                os.remove(part_path)
+                os.remove(meta_path)
+            else:
+                # keeps the session from expiring while chunks arrive
+                os.utime(meta_path)
+
+        return session
+
+upload_service = UploadService()